@@ -0,0 +1,168 @@
+# Alignment of two data streams by cross-correlating their synchronization events, with clock drift correction.
+# The ends of each stream's events (e.g. EEG artifact epochs, ET closed eyes periods) are turned into a binary train
+# of equal length boxes, and the lag between the trains is found with an FFT based cross-correlation (O(n log n)),
+# once in a window at the start of the recording and once in a window at its end. The events' ends are correlated
+# rather than the whole events, since the same event lasts differently in the two streams (e.g. an artifact epoch
+# and the closed eyes period around it), which would shift the best lags range of the whole events by the difference
+# of their lengths. The two lags give a linear model of the drift between the streams' clocks, which is turned into
+# an index map: for every sample of the reference stream, the index of the matching sample of the other stream.
+
+import numpy as np
+
+END_WINDOW_MIN_MATCH = 0.5  # fraction of the end window's reference events that must match, or the drift is 0
+END_WINDOW_MAX_AMBIGUITY = 0.8  # ratio of another lag's match to the best one's, from which the drift is 0
+
+
+def get_event_train(timestamps, length):
+    """
+    :param timestamps: list of (start, end) event timestamps (indices)
+    :param length: length of the train
+    :return: float array of the given length, which is 1 during the events and 0 otherwise
+    """
+    timestamps = np.clip(np.asarray(timestamps, dtype=np.int64).reshape(-1, 2), 0, length)
+    changes = np.zeros(length + 1)
+    np.add.at(changes, timestamps[:, 0], 1)
+    np.add.at(changes, timestamps[:, 1], -1)
+    return (np.cumsum(changes[:-1]) > 0).astype(np.float64)
+
+
+def get_edge_train(timestamps, length, edge_length):
+    """
+    :param timestamps: list of (start, end) event timestamps (indices)
+    :param length: length of the train
+    :param edge_length: length of the box at the end of every event (longer than the events' ends jitter)
+    :return: float array of the given length, which is 1 from every event's end for edge_length and 0 otherwise
+    """
+    ends = np.asarray(timestamps, dtype=np.int64).reshape(-1, 2)[:, 1]
+    return get_event_train(np.stack([ends, ends + edge_length], axis=1), length)
+
+
+def get_true_range(mask, index):
+    """
+    :param mask: boolean array
+    :param index: an index where mask is True
+    :return: (start, stop) of the range of consecutive True values that includes index
+    """
+    before, after = mask[index::-1], mask[index:]
+    start = index + 1 - (np.argmin(before) if not before.all() else len(before))
+    stop = index + (np.argmin(after) if not after.all() else len(after))
+    return start, stop
+
+
+def get_cross_correlation(reference, other):
+    """
+    :param reference: 1D array
+    :param other: 1D array
+    :return: the cross-correlation sum(other[i + lag] * reference[i]) for every lag, and the array of lags
+    (from -(len(reference) - 1) to len(other) - 1)
+    """
+    fft_length = 1 << (len(reference) + len(other) - 2).bit_length()
+    correlation = np.fft.irfft(np.fft.rfft(other, fft_length) * np.conj(np.fft.rfft(reference, fft_length)),
+                               fft_length)
+    lags = np.arange(-(len(reference) - 1), len(other))
+    return np.concatenate([correlation[fft_length - (len(reference) - 1):], correlation[:len(other)]]), lags
+
+
+def get_lag(reference, other, min_lag, max_lag, min_match=None, max_ambiguity=None):
+    """
+    :param reference: event train of the reference stream
+    :param other: event train of the other stream
+    :param min_lag: minimal lag to consider
+    :param max_lag: maximal lag to consider
+    :param min_match: if given, the minimal fraction of the reference's event samples that must overlap the other's
+    events at the lag
+    :param max_ambiguity: if given, the maximal ratio of the best overlap at the lags outside the lag's peak (the
+    range of lags around it with any overlap) to the lag's overlap
+    :return: the lag for which other[i + lag] best matches reference[i] (the middle of the best lags range, since
+    boxes match equally well over a range of lags, which is only unbiased if the matching boxes are equally long, see
+    get_edge_train), or None if no events overlap at any lag, or the match is weaker or more ambiguous than allowed
+    """
+    if not len(reference) or not len(other):
+        return None
+    correlation, lags = get_cross_correlation(reference, other)
+    considered = (lags >= min_lag) & (lags <= max_lag)
+    correlation, lags = correlation[considered], lags[considered]
+    if not len(correlation) or correlation.max() < 0.5:  # the trains are binary, so any overlap is at least 1
+        return None
+    best_value = correlation.max()
+    if min_match is not None and best_value < min_match * reference.sum() - 0.5:
+        return None
+    best_start, best_stop = get_true_range(correlation >= best_value - 0.5, np.argmax(correlation))
+    lag_index = best_start + (best_stop - best_start) // 2
+    if max_ambiguity is not None:
+        peak_start, peak_stop = get_true_range(correlation >= 0.5, lag_index)
+        others_value = max(correlation[:peak_start].max(initial=0), correlation[peak_stop:].max(initial=0))
+        if others_value > max_ambiguity * best_value:
+            return None
+    return int(lags[lag_index])
+
+
+def get_window_lag(reference_train, other_train, window_start, window_length, expected_lag, max_lag_error,
+                   min_match=None, max_ambiguity=None):
+    """
+    :param reference_train: event train of the whole reference stream
+    :param other_train: event train of the whole other stream
+    :param window_start: start index of the window in the reference stream
+    :param window_length: length of the window
+    :param expected_lag: the lag around which to search
+    :param max_lag_error: maximal distance of the lag from expected_lag
+    :param min_match: see get_lag
+    :param max_ambiguity: see get_lag
+    :return: the lag in this window and the mean position of its reference events, or (None, None) if the window
+    doesn't have events in both streams (or they don't match well enough)
+    """
+    reference = reference_train[window_start:window_start + window_length]
+    if not reference.any():
+        return None, None
+    other_start = max(0, window_start + expected_lag - max_lag_error)
+    other = other_train[other_start:window_start + window_length + expected_lag + max_lag_error]
+    offset = other_start - window_start
+    lag = get_lag(reference, other, expected_lag - max_lag_error - offset, expected_lag + max_lag_error - offset,
+                  min_match, max_ambiguity)
+    if lag is None:
+        return None, None
+    return lag + offset, window_start + float(np.mean(np.flatnonzero(reference)))
+
+
+def estimate_alignment(reference_timestamps, other_timestamps, reference_length, other_length, window_length,
+                       max_lag, max_drift_lag=None, edge_length=1):
+    """
+    :param reference_timestamps: list of (start, end) event timestamps of the reference stream
+    :param other_timestamps: list of (start, end) event timestamps of the other stream (at the same sample rate)
+    :param reference_length: number of samples of the reference stream
+    :param other_length: number of samples of the other stream
+    :param window_length: number of samples of the windows at the start and at the end of the reference stream
+    :param max_lag: maximal (absolute) lag between the streams
+    :param max_drift_lag: maximal change of the lag between the start and the end windows (max_lag if None)
+    :param edge_length: length of the boxes at the events' ends that are correlated (see get_edge_train)
+    :return: (lag, drift) of the linear model: other index = reference index + lag + drift * reference index,
+    where drift is 0 if the events at the end of the streams don't match (see END_WINDOW_MIN_MATCH and
+    END_WINDOW_MAX_AMBIGUITY). lag is None if there are no matching events
+    """
+    reference_train = get_edge_train(reference_timestamps, reference_length, edge_length)
+    other_train = get_edge_train(other_timestamps, other_length, edge_length)
+    start_lag, start_position = get_window_lag(reference_train, other_train, 0, window_length, 0, max_lag)
+    if start_lag is None:
+        return None, 0.0
+    end_window_start = reference_length - window_length
+    if end_window_start <= window_length:  # the windows overlap, so the end window adds nothing
+        return start_lag, 0.0
+    end_lag, end_position = get_window_lag(reference_train, other_train, end_window_start, window_length, start_lag,
+                                           max_lag if max_drift_lag is None else max_drift_lag,
+                                           END_WINDOW_MIN_MATCH, END_WINDOW_MAX_AMBIGUITY)
+    if end_lag is None:
+        return start_lag, 0.0
+    drift = (end_lag - start_lag) / (end_position - start_position)
+    return start_lag - drift * start_position, drift
+
+
+def get_alignment_index_map(reference_start, reference_stop, lag, drift=0.0):
+    """
+    :param reference_start: first index of the reference stream to map
+    :param reference_stop: end index of the reference stream to map
+    :param lag: see estimate_alignment
+    :param drift: see estimate_alignment
+    :return: array of the other stream's index for every reference index in the range
+    """
+    reference_indices = np.arange(reference_start, reference_stop)
+    return np.rint(reference_indices + lag + drift * reference_indices).astype(np.int64)
@@ -0,0 +1,71 @@
+# EEG artifact detection, based on statistics of fixed length epochs of the signal.
+# The signal is viewed as a (epochs, channels, samples) block without copying it - a reshape for consecutive epochs,
+# or a sliding window view when the epochs overlap - so all the epochs of all the channels are processed at once.
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+EPOCH_STATISTICS = ["max", "min", "ptp"]
+
+
+def get_epochs_num(samples_num, epoch_length, epoch_step=None, max_samples=None):
+    """
+    :param samples_num: number of samples in the signal
+    :param epoch_length: number of samples in an epoch
+    :param epoch_step: number of samples between the starts of consecutive epochs (epoch_length if None)
+    :param max_samples: if given, only epochs that end until this sample are counted
+    :return: number of epochs in the signal. An epoch must end before the last sample of the signal
+    """
+    epoch_step = epoch_step or epoch_length
+    last_end = samples_num - 1
+    if max_samples is not None:
+        last_end = min(last_end, max_samples)
+    return max(0, (last_end - epoch_length) // epoch_step + 1)
+
+
+def get_epochs(data, epoch_length, epoch_step=None, max_samples=None):
+    """
+    :param data: array of shape (samples, channels)
+    :param epoch_length: number of samples in an epoch
+    :param epoch_step: number of samples between the starts of consecutive epochs (epoch_length if None)
+    :param max_samples: if given, only epochs that end until this sample are included
+    :return: a view of the data with shape (epochs, channels, epoch_length)
+    """
+    epoch_step = epoch_step or epoch_length
+    epochs_num = get_epochs_num(len(data), epoch_length, epoch_step, max_samples)
+    if epoch_step == epoch_length:
+        used_data = data[:epochs_num * epoch_length]
+        return used_data.reshape(epochs_num, epoch_length, data.shape[1]).swapaxes(1, 2)
+    return sliding_window_view(data, epoch_length, axis=0)[::epoch_step][:epochs_num]
+
+
+def get_epoch_statistics(data, epoch_length, epoch_step=None, max_samples=None):
+    """
+    :param data: array of shape (samples, channels)
+    :return: dict of each of EPOCH_STATISTICS to an array of shape (epochs, channels) with its value per epoch
+    (NaN samples are ignored). See get_epochs for the other parameters
+    """
+    epochs = get_epochs(data, epoch_length, epoch_step, max_samples)
+    if not len(epochs):
+        empty = np.empty((0, data.shape[1]))
+        return {statistic: empty for statistic in EPOCH_STATISTICS}
+    maxima = np.fmax.reduce(epochs, axis=2)
+    minima = np.fmin.reduce(epochs, axis=2)
+    return {"max": maxima, "min": minima, "ptp": maxima - minima}
+
+
+def get_artifact_epochs(epoch_values, threshold, epoch_length, epoch_step=None):
+    """
+    :param epoch_values: array of shape (epochs, channels) with a statistic per epoch (see get_epoch_statistics)
+    :param threshold: the minimal difference of an epoch's value from the previous epoch's value to be an artifact
+    :param epoch_length: number of samples in an epoch
+    :param epoch_step: number of samples between the starts of consecutive epochs (epoch_length if None)
+    :return: list (per channel) of arrays of shape (artifacts_num, 2) with (start, end) indices of artifact epochs
+    """
+    epoch_step = epoch_step or epoch_length
+    is_artifact = np.diff(epoch_values, axis=0) > threshold  # epoch i + 1 compared to epoch i
+    artifact_epochs = []
+    for channel_is_artifact in is_artifact.T:
+        starts = (np.flatnonzero(channel_is_artifact) + 1) * epoch_step
+        artifact_epochs.append(np.column_stack([starts, starts + epoch_length]))
+    return artifact_epochs
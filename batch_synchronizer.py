@@ -0,0 +1,149 @@
+# Batch synchronization of a whole archive of recordings.
+# Every recording that has both EEG and ET data files (paired by the recording identifier in their names) is
+# synchronized in its own process, into its own output directory named by its identifier, and a manifest with
+# the result of every recording (onsets, timings or the error) is saved in the output directory.
+
+import os
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from eeg_et_hr_synchronizer import find_all_data_paths, synchronize_recording, EEG_DATA_PARENT_DIR, \
+    ET_DATA_PARENT_DIR, HR_DATA_PARENT_DIR, SYNCHRONIZED_OUTPUT_DIR, RECORDING_IDENTIFIER_PATTERN
+from file_utils import atomic_write
+from output_backends import SIDECAR_FILE_NAME
+
+MANIFEST_FILE_NAME = "batch_manifest.json"
+
+
+def is_up_to_date(output_dir, data_paths):
+    """
+    :param output_dir: the recording's output directory
+    :param data_paths: the recording's data paths
+    :return: whether the output directory has a complete output that is newer than all the data files
+    """
+    sidecar_path = os.path.join(output_dir, SIDECAR_FILE_NAME)  # written last, so it marks a complete output
+    if not os.path.isfile(sidecar_path):
+        return False
+    return all(os.path.getmtime(path) <= os.path.getmtime(sidecar_path) for path in data_paths if path)
+
+
+def get_skipped_result(identifier, data_paths, output_dir, previous_result=None):
+    """
+    :param identifier: the recording identifier
+    :param data_paths: the recording's (EEG, ET, HR) data paths
+    :param output_dir: the recording's up to date output directory
+    :param previous_result: the recording's result in the previous manifest, or None if it's missing
+    :return: dict with the result of the previous synchronization (e.g. its timing), and the trial onsets of the
+    output directory's sidecar file (raises an error if it can't be read, e.g. it was truncated)
+    """
+    result = {key: value for key, value in (previous_result or {}).items() if key not in ["error", "traceback"]}
+    result.update(identifier=identifier, eeg_data_path=data_paths[0], et_data_path=data_paths[1],
+                  hr_data_path=data_paths[2], output_dir=output_dir, status="skipped")
+    with open(os.path.join(output_dir, SIDECAR_FILE_NAME), "r") as f:
+        sidecar = json.load(f)
+    result.update({key: sidecar[key] for key in ["eeg_trial_onset_timestamp", "et_trial_onset_timestamp"]})
+    return result
+
+
+def load_manifest(output_parent_dir):
+    """
+    :param output_parent_dir: the directory of the manifest
+    :return: dict of recording identifier -> its result in the manifest (empty if there's no manifest)
+    """
+    try:
+        with open(os.path.join(output_parent_dir, MANIFEST_FILE_NAME), "r") as f:
+            return {result["identifier"]: result for result in json.load(f)}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def synchronize_session(identifier, data_paths, output_dir, streaming=False):
+    """
+    Synchronizes one recording, catching any error so the other recordings of the batch won't be affected.
+    :param identifier: the recording identifier
+    :param data_paths: the recording's (EEG, ET, HR) data paths
+    :param output_dir: the recording's output directory
+    :param streaming: whether to stream the data in chunks instead of loading the whole recordings
+    :return: dict with the result of the synchronization
+    """
+    result = {"identifier": identifier, "eeg_data_path": data_paths[0], "et_data_path": data_paths[1],
+              "hr_data_path": data_paths[2], "output_dir": output_dir}
+    start_time = time.perf_counter()
+    try:
+        result.update(synchronize_recording(*data_paths, output_dir=output_dir, streaming=streaming))
+        result["status"] = "done"
+    except Exception as error:
+        result.update(status="failed", error=repr(error), traceback=traceback.format_exc())
+    result["seconds"] = time.perf_counter() - start_time
+    return result
+
+
+def synchronize_all_recordings(eeg_data_parent_dir=EEG_DATA_PARENT_DIR, et_data_parent_dir=ET_DATA_PARENT_DIR,
+                               hr_data_parent_dir=HR_DATA_PARENT_DIR, output_parent_dir=SYNCHRONIZED_OUTPUT_DIR,
+                               workers=None, force=False, streaming=False, pattern=RECORDING_IDENTIFIER_PATTERN):
+    """
+    Synchronizes all the recordings in the data directories, in parallel.
+    :param output_parent_dir: the directory in which each recording gets an output directory named by its identifier
+    :param workers: maximal number of processes (or None for the number of CPUs)
+    :param force: whether to synchronize recordings even if their outputs are up to date
+    :param streaming: whether to stream the data in chunks instead of loading the whole recordings
+    :param pattern: regular expression of the recording identifier in the files' names
+    :return: list of the results of all the recordings (also saved as the manifest in output_parent_dir)
+    """
+    all_data_paths = find_all_data_paths(eeg_data_parent_dir, et_data_parent_dir, hr_data_parent_dir, pattern)
+    previous_results = load_manifest(output_parent_dir)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for identifier, data_paths in all_data_paths.items():
+            output_dir = os.path.join(output_parent_dir, identifier)
+            if not force and is_up_to_date(output_dir, data_paths):
+                try:
+                    results.append(get_skipped_result(identifier, data_paths, output_dir,
+                                                      previous_results.get(identifier)))
+                    continue
+                except (OSError, json.JSONDecodeError, KeyError, TypeError):
+                    print(f"{identifier}: the output's {SIDECAR_FILE_NAME} is corrupted, so it is synchronized again")
+            future = executor.submit(synchronize_session, identifier, data_paths, output_dir, streaming)
+            futures[future] = (identifier, data_paths, output_dir)
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as error:  # e.g. BrokenProcessPool, when a process was killed (by the OOM killer)
+                identifier, data_paths, output_dir = futures[future]
+                result = {"identifier": identifier, "eeg_data_path": data_paths[0], "et_data_path": data_paths[1],
+                          "hr_data_path": data_paths[2], "output_dir": output_dir, "status": "failed",
+                          "error": repr(error), "traceback": traceback.format_exc(), "seconds": 0.0}
+            print(f"{result['identifier']}: {result['status']} ({result['seconds']:.1f} seconds)")
+            results.append(result)
+    results.sort(key=lambda result: result["identifier"])
+    os.makedirs(output_parent_dir, exist_ok=True)
+    atomic_write(os.path.join(output_parent_dir, MANIFEST_FILE_NAME), lambda f: json.dump(results, f, indent=4), "w")
+    return results
+
+
+def main():
+    """
+    Main code to run for synchronizing all the recordings in the data directories.
+    """
+    parser = argparse.ArgumentParser(description="Synchronizes all the recordings in the data directories")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of processes (default: CPUs num)")
+    parser.add_argument("-f", "--force", action="store_true", help="synchronize even up to date recordings")
+    parser.add_argument("-s", "--stream", action="store_true", help="stream the data instead of loading it")
+    parser.add_argument("--eeg-dir", default=EEG_DATA_PARENT_DIR)
+    parser.add_argument("--et-dir", default=ET_DATA_PARENT_DIR)
+    parser.add_argument("--hr-dir", default=HR_DATA_PARENT_DIR)
+    parser.add_argument("--output-dir", default=SYNCHRONIZED_OUTPUT_DIR)
+    parser.add_argument("--pattern", default=RECORDING_IDENTIFIER_PATTERN,
+                        help="regular expression of the recording identifier in the files' names")
+    args = parser.parse_args()
+    results = synchronize_all_recordings(args.eeg_dir, args.et_dir, args.hr_dir, args.output_dir, args.workers,
+                                         args.force, args.stream, args.pattern)
+    failed = [result["identifier"] for result in results if result["status"] == "failed"]
+    print(f"{len(results)} recordings, {len(failed)} failed" + (f": {failed}" if failed else ""))
+
+
+if __name__ == '__main__':
+    main()
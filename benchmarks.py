@@ -0,0 +1,181 @@
+# Benchmarks of the pipeline's stages over synthetic sessions of growing durations (see synthetic_sessions).
+# Every stage is timed (the best of a few repeats) and its peak memory is measured (in a separate run, since tracing
+# the memory allocations slows the code), so the results of different versions, or of different engines, are compared
+# offline: the results are saved as a CSV file, and compared to the results of a previous run if given.
+# Only the memory of the benchmark's process is traced, so the memory of rendering the images in several processes
+# is not measured (it is measured with a single worker).
+
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+import recording_index
+import eeg_et_hr_synchronizer
+import lemons_demo_with_eeg_et_sync
+from eeg_et_hr_synchronizer import preprocess_eeg_data, preprocess_et_data, get_eeg_artifact_timestamps, \
+    get_closed_eyes_timestamps, get_eeg_trial_onset_timestamp, get_et_trial_onset_timestamps, save_synchronized_data
+from synthetic_sessions import generate_session, SYNTHETIC_STIMULI_NUM
+
+BENCHMARK_DURATIONS = [1, 10, 60]  # minutes
+BENCHMARK_REPEATS = 3  # timed runs of every stage, of which the fastest one is reported
+REGRESSION_TOLERANCE = 1.2  # ratio of the baseline's time or memory from which a stage is reported as a regression
+REGRESSION_MIN_SECONDS = 0.01  # smaller differences from the baseline's time are noise
+REGRESSION_MIN_MEMORY_MB = 1  # smaller differences from the baseline's peak memory are noise
+
+
+def measure(function, *args, repeats=BENCHMARK_REPEATS, trace_memory=True, **kwargs):
+    """
+    :param function: the stage's function
+    :param repeats: number of timed runs
+    :param trace_memory: whether to measure the peak memory (False if the function allocates it in other processes)
+    :return: the function's result, the best time (in seconds) of the runs, and the peak memory (in bytes) allocated
+    during a run (NaN if it isn't measured). Only allocations of this process are traced (not of the processes it
+    starts)
+    """
+    seconds = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds.append(time.perf_counter() - start_time)
+    if not trace_memory:
+        return result, min(seconds), np.nan
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, min(seconds), peak_bytes
+
+
+def benchmark_session(session, output_dir, repeats=BENCHMARK_REPEATS, workers=None):
+    """
+    :param session: a synthetic session (see generate_session), with stimuli images
+    :param output_dir: directory for the stages' outputs
+    :param repeats: number of timed runs of every stage
+    :param workers: number of processes for rendering the images (None for the number of CPUs). Their memory is
+    only measured with a single process
+    :return: list of (stage, seconds, peak bytes)
+    """
+    results = []
+
+    def run(stage, function, *args, trace_memory=True, **kwargs):
+        result, seconds, peak_bytes = measure(function, *args, repeats=repeats, trace_memory=trace_memory, **kwargs)
+        results.append((stage, seconds, peak_bytes))
+        print(f"  {stage}: {seconds:.3f} seconds, " +
+              (f"{peak_bytes / 2 ** 20:.1f} MB" if trace_memory else "memory not measured"))
+        return result
+
+    eeg_df = run("preprocess_eeg_data", preprocess_eeg_data, session["eeg_data_path"])
+    run("preprocess_et_data", preprocess_et_data, session["et_data_path"])
+    et_df = run("preprocess_et_data (lazy)", preprocess_et_data, session["et_data_path"], lazy=True)
+    # on the whole recording, since the beginning protocol's search time doesn't depend on the duration
+    run("get_eeg_artifact_timestamps", get_eeg_artifact_timestamps, eeg_df, search_time=None)
+    closed_eyes_timestamps = run("get_closed_eyes_timestamps", get_closed_eyes_timestamps, et_df)
+    eeg_trial_onset_timestamp = get_eeg_trial_onset_timestamp(get_eeg_artifact_timestamps(eeg_df))
+    et_trial_onset_timestamp = get_et_trial_onset_timestamps(closed_eyes_timestamps)
+    sync_df, _ = run("save_synchronized_data", save_synchronized_data, eeg_df, et_df, eeg_trial_onset_timestamp,
+                     et_trial_onset_timestamp, output_dir=os.path.join(output_dir, "synchronized"))
+    images_output_dir = os.path.join(output_dir, "images")
+    os.makedirs(images_output_dir, exist_ok=True)
+    run("save_et_locations_over_images", lemons_demo_with_eeg_et_sync.save_et_locations_over_images, sync_df,
+        images_output_dir, workers, trace_memory=workers == 1)
+    return results
+
+
+def run_benchmarks(durations=BENCHMARK_DURATIONS, data_dir=None, repeats=BENCHMARK_REPEATS, workers=None,
+                   ingestion_cache=False):
+    """
+    :param durations: durations (in minutes) of the benchmarked sessions
+    :param data_dir: directory to generate the sessions in (a temporary one if None)
+    :param repeats: number of timed runs of every stage
+    :param workers: number of processes for rendering the images (None for the number of CPUs)
+    :param ingestion_cache: whether to use the ingestion cache (so the data files are parsed only on the first run)
+    :return: data frame of the time and the peak memory (NaN if not measured) of every stage for every duration
+    """
+    # the modules' settings that are redirected to the benchmark's data, and restored when it ends
+    patched_globals = [(eeg_et_hr_synchronizer, "USE_INGESTION_CACHE"), (eeg_et_hr_synchronizer, "INGESTION_CACHE_DIR"),
+                       (lemons_demo_with_eeg_et_sync, "STIMULUS_CACHE_DIR"),
+                       (lemons_demo_with_eeg_et_sync, "IMAGES_DIR"),
+                       (lemons_demo_with_eeg_et_sync, "USED_LEMON_IMAGES_RECORDS_DIR"),
+                       (recording_index, "RECORDING_INDEX_PATH"), (recording_index, "_recording_index")]
+    original_values = [getattr(module, name) for module, name in patched_globals]
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            data_dir = data_dir or temp_dir
+            # the caches and the index are kept with the benchmark's data, not with the real recordings' ones
+            eeg_et_hr_synchronizer.USE_INGESTION_CACHE = ingestion_cache
+            eeg_et_hr_synchronizer.INGESTION_CACHE_DIR = os.path.join(temp_dir, "ingestion_cache")
+            lemons_demo_with_eeg_et_sync.STIMULUS_CACHE_DIR = os.path.join(temp_dir, "stimuli_cache")
+            recording_index.RECORDING_INDEX_PATH = os.path.join(temp_dir, "recording_index.json")
+            recording_index._recording_index = None
+            rows = []
+            for duration in durations:
+                session_dir = os.path.join(data_dir, f"{duration:g}_minutes")
+                print(f"Generating a session of {duration:g} minutes in {session_dir}")
+                session = generate_session(session_dir, duration * 60, stimuli_num=SYNTHETIC_STIMULI_NUM)
+                lemons_demo_with_eeg_et_sync.IMAGES_DIR = session["images_dir"]
+                lemons_demo_with_eeg_et_sync.USED_LEMON_IMAGES_RECORDS_DIR = session["images_lists_dir"]
+                print(f"Benchmarking the session of {duration:g} minutes:")
+                for stage, seconds, peak_bytes in benchmark_session(session, os.path.join(temp_dir, "output"),
+                                                                    repeats, workers):
+                    rows.append({"duration_minutes": duration, "stage": stage, "seconds": seconds,
+                                 "peak_memory_mb": peak_bytes / 2 ** 20})
+    finally:
+        for (module, name), value in zip(patched_globals, original_values):
+            setattr(module, name, value)
+    return pd.DataFrame(rows)
+
+
+def compare_to_baseline(results, baseline):
+    """
+    :param results: data frame of benchmarks results (see run_benchmarks)
+    :param baseline: data frame of previous benchmarks results
+    :return: data frame of the ratios of the results' time and memory to the baseline's, for the stages and durations
+    in both of them, and whether each one is a regression (see REGRESSION_TOLERANCE and the minimal differences)
+    """
+    comparison = results.merge(baseline, on=["duration_minutes", "stage"], suffixes=("", "_baseline"))
+    comparison["seconds_ratio"] = comparison.seconds / comparison.seconds_baseline
+    comparison["memory_ratio"] = comparison.peak_memory_mb / comparison.peak_memory_mb_baseline
+    is_slower = ((comparison.seconds_ratio > REGRESSION_TOLERANCE) &
+                 (comparison.seconds - comparison.seconds_baseline > REGRESSION_MIN_SECONDS))
+    is_larger = ((comparison.memory_ratio > REGRESSION_TOLERANCE) &
+                 (comparison.peak_memory_mb - comparison.peak_memory_mb_baseline > REGRESSION_MIN_MEMORY_MB))
+    comparison["regression"] = is_slower | is_larger
+    return comparison[["duration_minutes", "stage", "seconds", "seconds_ratio", "peak_memory_mb", "memory_ratio",
+                       "regression"]]
+
+
+def main():
+    """
+    Main code to run for benchmarking the pipeline.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks the pipeline's stages over synthetic sessions")
+    parser.add_argument("-d", "--durations", type=float, nargs="+", default=BENCHMARK_DURATIONS,
+                        help="minutes of every benchmarked session")
+    parser.add_argument("-r", "--repeats", type=int, default=BENCHMARK_REPEATS, help="timed runs of every stage")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="rendering processes (default: CPUs num), whose memory is only measured if 1")
+    parser.add_argument("-c", "--ingestion-cache", action="store_true",
+                        help="use the ingestion cache (otherwise the data files are parsed on every run)")
+    parser.add_argument("--data-dir", default=None, help="directory to keep the generated sessions in")
+    parser.add_argument("-o", "--output", default="benchmarks.csv", help="path of the results' CSV file")
+    parser.add_argument("-b", "--baseline", default=None, help="path of previous results to compare to")
+    args = parser.parse_args()
+    results = run_benchmarks(args.durations, args.data_dir, args.repeats, args.workers, args.ingestion_cache)
+    results.to_csv(args.output, index=False)
+    print(f"The results were saved in {args.output}")
+    if args.baseline:
+        comparison = compare_to_baseline(results, pd.read_csv(args.baseline))
+        with pd.option_context("display.width", 120, "display.max_columns", None):
+            print(comparison.round(3).to_string(index=False))
+        regressions = comparison[comparison.regression]
+        print(f"{len(regressions)} regressions" +
+              (f": {list(zip(regressions.duration_minutes, regressions.stage))}" if len(regressions) else ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,15 +9,27 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime
+from itertools import zip_longest
+from alignment import estimate_alignment, get_alignment_index_map
+from artifact_detection import get_epoch_statistics, get_artifact_epochs
+from output_backends import SynchronizedDataWriter
+from ingestion_cache import read_csv_cached, iter_csv_chunks_cached, INGESTION_CACHE_DIR
+from interval_detection import get_true_intervals, get_nan_mask, to_timestamps
+from recording_index import get_recording_index, get_recording_identifier, RECORDING_IDENTIFIER_PATTERN
+from resampling import UpsampledETData, StreamingETResampler, as_data_frame, take_samples, ET_TIME_COLUMN
 
 
 # Usage:
 HELP_FLAGS = ["?"] + [flag_prefix + flag for flag_prefix in ["", "-", "--"] for flag in ["h", "help", "u", "usage"]]
+STREAM_FLAGS = ["-s", "--stream"]
 USAGE_MESSAGE = f"""Usage:
 For using the most recent data files in the output directories: 
     python eeg_et_hr_synchronizer.py
 For using specific data files that contain an identifier substring in their name:
     python eeg_et_hr_synchronizer.py <identifier>
+For streaming the data in chunks instead of loading whole recordings (for very long recordings), add a stream flag:
+    python eeg_et_hr_synchronizer.py [<identifier>] <any of the following stream flags>
+        {STREAM_FLAGS}
 For getting this help/usage message:
     python eeg_et_hr_synchronizer.py <any of the following help flags>
         {HELP_FLAGS}
@@ -32,6 +44,7 @@ SYNCHRONIZED_OUTPUT_DIR = "/home/innereye/Documents/synchronized_data"
 # Steady constants:
 EEG_SAMPLE_RATE = 300  # Hz
 ET_SAMPLE_RATE = 60  # Hz
+HR_SAMPLE_RATE = 1  # Hz (nominal, the HR samples are irregular)
 EEG_ELECTRODES = ["F3", "F4", "C3", "C4", "Pz", "P3", "P4", "TRG"]
 ET_COLUMN_FOR_SYNC = "left_x"
 
@@ -44,9 +57,24 @@ ARTIFACT_ELECTRODE = "F3"
 ARTIFACT_EPOCH_LENGTH = 0.5  # seconds
 EPOCH_JUMP = int(ARTIFACT_EPOCH_LENGTH * EEG_SAMPLE_RATE)
 ARTIFACT_DIFFERENCE_THRESHOLD = 100
+ARTIFACT_STATISTIC = "max"  # one of artifact_detection.EPOCH_STATISTICS, compared between consecutive epochs
 EEG_BEGINNING_TIME = 12  # seconds (time for the beginning protocol, before starting real trial)
 ET_BEGINNING_TIME = 20  # seconds (time for the beginning protocol, before starting real trial)
 SHORT_BLINK_SAMPLES_NUM = 10  # after over sampling the ET data, equivalent to / 5 == 2
+ET_RESAMPLING_METHOD = "hold"  # one of resampling.RESAMPLING_METHODS ("repeat" ignores the ET timestamps)
+HR_RESAMPLING_METHOD = "hold"  # "hold" or "linear" (interpolate between the HR samples)
+HR_MAX_HOLD_TIME = 3  # seconds from the nearest HR sample, after which the HR is unknown (NaN)
+HR_MAX_CLOCK_OFFSET_TIME = 3600  # seconds between the HR and ET recordings' starts, beyond which they aren't on a clock
+USE_COMPACT_DTYPES = False  # store EEG electrodes and ET coordinates as float32 and the trigger as int8
+USE_INGESTION_CACHE = True  # keep binary copies of the raw data files (up to INGESTION_CACHE_MAX_BYTES) to memory-map
+STREAMING_CHUNK_SIZE = 300000  # EEG-rate samples held in memory at once in the streaming mode
+ALIGNMENT_METHOD = "onsets"  # "onsets" (end of the last beginning protocol events) or "cross_correlation"
+ALIGNMENT_WINDOW_TIME = 60  # seconds (at the start and at the end of the recording) to cross-correlate events in
+MAX_ALIGNMENT_LAG_TIME = 30  # seconds
+MAX_ALIGNMENT_DRIFT_TIME = 3  # seconds the lag may change between the start and the end of the recording
+ALIGNMENT_EDGE_TIME = 0.1  # seconds of the boxes at the events' ends that are cross-correlated (over the ET jitter)
+OUTPUT_FORMAT = "csv"  # one of output_backends.OUTPUT_FORMATS
+OUTPUT_LAYOUT = None  # one of output_backends.OUTPUT_LAYOUTS, or None for the format's default
 
 
 def get_most_recent_file(dir, type=None, name_identifier=None):
@@ -56,21 +84,12 @@ def get_most_recent_file(dir, type=None, name_identifier=None):
     :param name_identifier: specific substring to look for in file's name (or all if None)
     :return: the most recently modified file in dir, with the specific type
     """
-    if not os.path.isdir(dir):
-        raise ValueError(f"The following is not a directory path: {dir}")
-    files = []
-    for file in os.listdir(dir):
-        file_path = os.path.join(dir, file)
-        if os.path.isfile(file_path):
-            if (type and not file.endswith(type)) or (name_identifier and name_identifier not in file):
-                continue
-            files.append((file_path, os.path.getmtime(file_path)))
-    if not files:
+    file_path = get_recording_index().get_most_recent(dir, type, name_identifier)
+    if file_path is None:
         wanted_type = type + " " if type else ""
         wanted_name = f"with {name_identifier} in their name" if name_identifier else ""
         raise ValueError(f"No {wanted_type}files {wanted_name}in {dir}")
-    files.sort(key=lambda file: file[1], reverse=True)
-    return files[0][0]
+    return file_path
 
 
 def find_data_paths(recording_identifier=None, eeg_data_parent_dir=EEG_DATA_PARENT_DIR,
@@ -79,50 +98,133 @@ def find_data_paths(recording_identifier=None, eeg_data_parent_dir=EEG_DATA_PARE
     Finds the EEG, ET, HR data paths (by this order) based on the recording_identifier.
     If recording_identifier not given, chooses the most recent files.
     """
-    return tuple([get_most_recent_file(parent_dir, type="csv",
-                                       name_identifier=recording_identifier)
-                  for parent_dir in [eeg_data_parent_dir, et_data_parent_dir, hr_data_parent_dir]])
+    data_paths = []
+    for parent_dir in [eeg_data_parent_dir, et_data_parent_dir, hr_data_parent_dir]:
+        # a file with this exact identifier, otherwise the most recent file that contains it
+        data_path = recording_identifier and get_recording_index().find_by_identifier(parent_dir,
+                                                                                      recording_identifier, "csv")
+        data_paths.append(data_path or get_most_recent_file(parent_dir, type="csv",
+                                                            name_identifier=recording_identifier))
+    return tuple(data_paths)
+
+
+def find_all_data_paths(eeg_data_parent_dir=EEG_DATA_PARENT_DIR, et_data_parent_dir=ET_DATA_PARENT_DIR,
+                        hr_data_parent_dir=HR_DATA_PARENT_DIR, pattern=RECORDING_IDENTIFIER_PATTERN):
+    """
+    Finds all the recordings that have both EEG and ET data files, paired by their recording identifier.
+    :return: dict of recording identifier -> (EEG, ET, HR) data paths, where the HR path is None if missing
+    """
+    paths_by_identifier = []
+    for parent_dir in [eeg_data_parent_dir, et_data_parent_dir, hr_data_parent_dir]:
+        paths = {}
+        if parent_dir and os.path.isdir(parent_dir):
+            for name, _ in sorted(get_recording_index().get_files(parent_dir)):
+                if name.endswith("csv"):
+                    paths.setdefault(get_recording_identifier(name, pattern), os.path.join(parent_dir, name))
+        paths_by_identifier.append(paths)
+    eeg_paths, et_paths, hr_paths = paths_by_identifier
+    return {identifier: (eeg_paths[identifier], et_paths[identifier], hr_paths.get(identifier))
+            for identifier in sorted(eeg_paths.keys() & et_paths.keys())}
+
+
+def preprocess_et_data(et_data_path, method=ET_RESAMPLING_METHOD, lazy=False, compact=False, nrows=None):
+    """
+    Resamples the data to fit the EEG sample rate (based on the original timestamp column) and removes
+    the original timestamp column
+    :param et_data_path: path to the ET data file
+    :param method: the resampling method, one of resampling.RESAMPLING_METHODS
+    :param lazy: whether to return an UpsampledETData, that keeps the data at its native rate and only maps
+    indices to the EEG rate, instead of a fully resampled data frame
+    :param compact: whether to store the coordinates as float32
+    :param nrows: number of (native rate) rows to read from the beginning of the file, or None for all of them
+    """
+    et_df = read_csv_cached(et_data_path, nrows, get_ingestion_cache_dir())
+    et_data = UpsampledETData.from_data_frame(et_df, EEG_SAMPLE_RATE, ET_SAMPLE_RATE, method=method,
+                                              dtype=np.float32 if compact else None)
+    return et_data if lazy else et_data.to_frame()
 
 
-def preprocess_et_data(et_data_path):
+def preprocess_eeg_data(eeg_data_path, compact=False, nrows=None):
     """
-    Removes the original timestamp column and duplicates each row to fit the EEG sample rate
+    Names the columns by the right electrodes names (including the trigger)
+    :param eeg_data_path: path to the EEG data file
+    :param compact: whether to store the electrodes as float32 and the trigger as int8
+    :param nrows: number of rows to read from the beginning of the file, or None for all of them
     """
-    df = pd.read_csv(et_data_path).drop("time_ms", axis=1)
-    rows = []
-    for index, row in df.iterrows():
-        rows.extend([row] * (EEG_SAMPLE_RATE // ET_SAMPLE_RATE))  # resample to suit EEG sample rate
-    return pd.DataFrame(rows).reset_index(drop=True)
+    return name_eeg_columns(read_csv_cached(eeg_data_path, nrows, get_ingestion_cache_dir()), compact)
 
 
-def preprocess_eeg_data(eeg_data_path):
+def preprocess_hr_data(hr_data_path, time_origin, method=HR_RESAMPLING_METHOD, compact=False):
     """
-    Names the columns by the right electrodes names (including the trigger)
+    Aligns the (irregular) HR samples to the EEG sample rate grid of the ET data, by their timestamps
+    (the HR and the ET are recorded on the same clock)
+    :param hr_data_path: path to the HR data file
+    :param time_origin: the time (in ms) of the grid's first sample (the ET data's time_origin)
+    :param method: the resampling method, "hold" or "linear"
+    :param compact: whether to store the HR values as float32
+    :return: UpsampledETData of the HR data, indexed like the ET data
+    """
+    if method not in ["hold", "linear"]:
+        raise ValueError(f"Unknown HR resampling method: {method}")
+    hr_df = read_csv_cached(hr_data_path, cache_dir=get_ingestion_cache_dir())
+    if ET_TIME_COLUMN not in hr_df.columns or not pd.api.types.is_numeric_dtype(hr_df[ET_TIME_COLUMN]):
+        raise ValueError(f"The HR data has no numeric {ET_TIME_COLUMN} column: {hr_data_path}")
+    hr_times = hr_df[ET_TIME_COLUMN].dropna()
+    if not len(hr_times) or abs(hr_times.iloc[0] - time_origin) > HR_MAX_CLOCK_OFFSET_TIME * 1000:
+        raise ValueError(f"The HR data's {ET_TIME_COLUMN} isn't on the ET data's clock: {hr_data_path}")
+    return UpsampledETData.from_data_frame(hr_df, EEG_SAMPLE_RATE, HR_SAMPLE_RATE, method, HR_MAX_HOLD_TIME * 1000,
+                                           np.float32 if compact else None, time_origin)
+
+
+def get_ingestion_cache_dir():
+    """
+    :return: directory of the binary cache of the raw data files, or None if USE_INGESTION_CACHE is off
+    """
+    return INGESTION_CACHE_DIR if USE_INGESTION_CACHE else None
+
+
+def name_eeg_columns(df, compact=False):
+    """
+    :param df: raw EEG data frame
+    :param compact: whether to store the electrodes as float32 and the trigger as int8
+    :return: the data frame with the right electrodes names (including the trigger)
     """
-    df = pd.read_csv(eeg_data_path)
     df.columns = EEG_ELECTRODES
+    if compact:
+        df = df.astype({electrode: np.int8 if electrode == "TRG" else np.float32 for electrode in EEG_ELECTRODES})
     return df
 
 
-def get_eeg_artifact_timestamps(eeg_df):
+def get_eeg_artifact_timestamps(eeg_df, search_time=EEG_BEGINNING_TIME):
     """
     :param eeg_df: EEG data frame
+    :param search_time: time (in seconds) from the beginning of the recording to look for artifacts in,
+    or None for the whole recording
     :return: list of (start, end) epoch timestamps which have an artifact,
     based on their max value's difference from the previous one
     """
-    data = eeg_df[ARTIFACT_ELECTRODE]
-    artifact_epochs = []
-    prev_max = data[:EPOCH_JUMP].max()
-    epoch_start = EPOCH_JUMP
-    epoch_end = 2 * EPOCH_JUMP
-    while epoch_end < len(data):
-        cur_max = data[epoch_start:epoch_end].max()
-        if cur_max - prev_max > ARTIFACT_DIFFERENCE_THRESHOLD:
-            artifact_epochs.append((epoch_start, epoch_end))
-        prev_max = cur_max
-        epoch_start = epoch_end
-        epoch_end = epoch_start + EPOCH_JUMP
-    return artifact_epochs
+    return get_eeg_artifact_timestamps_per_electrode(eeg_df, [ARTIFACT_ELECTRODE], search_time)[ARTIFACT_ELECTRODE]
+
+
+def get_eeg_artifact_timestamps_per_electrode(eeg_df, electrodes=EEG_ELECTRODES, search_time=EEG_BEGINNING_TIME,
+                                              epoch_step=EPOCH_JUMP, statistic=ARTIFACT_STATISTIC):
+    """
+    :param eeg_df: EEG data frame
+    :param electrodes: the electrodes to look for artifacts in
+    :param search_time: time (in seconds) from the beginning of the recording to look for artifacts in,
+    or None for the whole recording
+    :param epoch_step: number of samples between the starts of consecutive epochs (overlapping if < EPOCH_JUMP)
+    :param statistic: the epoch statistic to compare, one of artifact_detection.EPOCH_STATISTICS
+    :return: dict of electrode -> list of (start, end) epoch timestamps which have an artifact,
+    based on their statistic's difference from the previous one
+    """
+    max_samples = None if search_time is None else EEG_SAMPLE_RATE * search_time
+    # an epoch must end before the last sample, so one more sample than the searched window is needed
+    data = eeg_df[electrodes][:None if max_samples is None else max_samples + 1].to_numpy()
+    epoch_values = get_epoch_statistics(data, EPOCH_JUMP, epoch_step, max_samples)[statistic]
+    artifact_epochs = get_artifact_epochs(epoch_values, ARTIFACT_DIFFERENCE_THRESHOLD, EPOCH_JUMP, epoch_step)
+    return {electrode: to_timestamps(electrode_artifact_epochs)
+            for electrode, electrode_artifact_epochs in zip(electrodes, artifact_epochs)}
 
 
 def get_eeg_trial_onset_timestamp(eeg_artifact_timestamps):
@@ -145,29 +247,14 @@ def get_beginning_timestamps(timestamps, end_time_of_beginning):
 
 def get_closed_eyes_timestamps(et_df):
     """
-    :param et_df: ET data frame
+    :param et_df: ET data frame (or UpsampledETData)
     :return: list of (start, end) timestamps for closed eyes periods
     """
-    data = et_df[ET_COLUMN_FOR_SYNC]
-    closed_eyes_timestamps = []
-    current_index = 0
-    # advance index until first eye tracking samples (beginning is usually NaN)
-    while np.isnan(data[current_index]):
-        current_index += 1
-    eyes_were_open = True
-    new_start = None
-    while current_index < len(data):
-        if np.isnan(data[current_index]):  # eyes are closed
-            if eyes_were_open:
-                new_start = current_index
-                eyes_were_open = False
-        else:  # eyes are open
-            if not eyes_were_open:
-                if current_index - new_start > SHORT_BLINK_SAMPLES_NUM:  # don't count short blinks
-                    closed_eyes_timestamps.append((new_start, current_index))
-                eyes_were_open = True
-        current_index += 1
-    return closed_eyes_timestamps
+    closed_eyes_mask = get_nan_mask(et_df, [ET_COLUMN_FOR_SYNC])
+    # the beginning is usually NaN until first eye tracking samples, and a period that didn't end isn't counted
+    intervals = get_true_intervals(closed_eyes_mask, min_length=SHORT_BLINK_SAMPLES_NUM + 1,  # don't count short blinks
+                                   drop_leading=True, drop_trailing=True)
+    return to_timestamps(intervals)
 
 
 def get_et_trial_onset_timestamps(closed_eyes_timestamps):
@@ -192,29 +279,232 @@ def get_trial_onset_timestamps(timestamps, end_time_of_beginning):
     return beginning_timestamps[-1][1]
 
 
-def save_synchronized_data(eeg_df, et_df, eeg_trial_onset_timestamp, et_trial_onset_timestamp):
+def get_et_index_map(eeg_df, et_df, eeg_trial_onset_timestamp):
     """
-    Saves the synchronized data of the real trial into both separate and combined CSV files.
+    Aligns the ET data to the EEG data by cross-correlating the EEG artifacts with the closed eyes periods,
+    at the start and at the end of the recording (to correct the drift between the devices' clocks).
     :param eeg_df: EEG data frame
-    :param et_df: ET data frame
+    :param et_df: ET data frame (or UpsampledETData)
+    :param eeg_trial_onset_timestamp: timestamp (index) of the EEG data for the onset of the real trial
+    :return: array of the ET timestamp (index) for every EEG timestamp from the trial onset,
+    or None if no events could be matched
+    """
+    lag, drift = estimate_alignment(get_eeg_artifact_timestamps(eeg_df, search_time=None),
+                                    get_closed_eyes_timestamps(et_df), len(eeg_df), len(et_df),
+                                    ALIGNMENT_WINDOW_TIME * EEG_SAMPLE_RATE, MAX_ALIGNMENT_LAG_TIME * EEG_SAMPLE_RATE,
+                                    MAX_ALIGNMENT_DRIFT_TIME * EEG_SAMPLE_RATE,
+                                    int(ALIGNMENT_EDGE_TIME * EEG_SAMPLE_RATE))
+    if lag is None:
+        return None
+    return get_alignment_index_map(eeg_trial_onset_timestamp, len(eeg_df), lag, drift)
+
+
+def save_synchronized_data(eeg_df, et_df, eeg_trial_onset_timestamp, et_trial_onset_timestamp,
+                           output_format=OUTPUT_FORMAT, layout=OUTPUT_LAYOUT, metadata=None, output_dir=None,
+                           et_index_map=None, hr_data=None):
+    """
+    Saves the synchronized data of the real trial into both separate and combined files
+    (or only a combined file, depending on the layout).
+    :param eeg_df: EEG data frame
+    :param et_df: ET data frame (or UpsampledETData)
     :param eeg_trial_onset_timestamp: timestamp (index) of the EEG data for the onset of the real trial
     :param et_trial_onset_timestamp: timestamp (index) of the ET data for the onset of the real trial
+    :param output_format: one of output_backends.OUTPUT_FORMATS
+    :param layout: one of output_backends.OUTPUT_LAYOUTS, or None for the format's default
+    :param metadata: dict of anything else to save in the sidecar file (e.g. source paths)
+    :param output_dir: the output directory, or None for a new directory named by the current time
+    :param et_index_map: if given, the ET timestamp (index) for every EEG timestamp from the trial onset
+    (see get_et_index_map), used instead of et_trial_onset_timestamp
+    :param hr_data: HR data indexed like the ET data (see preprocess_hr_data), or None if there is no HR data
     :return: the synchronized data frame and the output directory, in case their use is needed
     """
-    trial_eeg = eeg_df[eeg_trial_onset_timestamp:]
-    trial_et = et_df[et_trial_onset_timestamp:]
-    all_trial_data_combined = pd.concat([trial_eeg.reset_index(drop=True), trial_et.reset_index(drop=True)], axis=1)
-
-    output_dir = os.path.join(SYNCHRONIZED_OUTPUT_DIR, datetime.now().strftime("%d%m%Y_%H%M"))
-    if not os.path.exists(output_dir):
-        os.mkdir(output_dir)
-    trial_eeg.to_csv(os.path.join(output_dir, "trial_eeg.csv"))
-    trial_et.to_csv(os.path.join(output_dir, "trial_et.csv"))
-    all_trial_data_combined.to_csv(os.path.join(output_dir, "all_trial_data_combined.csv"))
+    trial_data = {"eeg": eeg_df[eeg_trial_onset_timestamp:]}
+    if et_index_map is None:
+        trial_data["et"] = as_data_frame(et_df[et_trial_onset_timestamp:])
+        et_index_map = et_trial_onset_timestamp + np.arange(max(len(trial_data["eeg"]), len(trial_data["et"])))
+    else:
+        trial_data["et"] = take_samples(et_df, et_index_map)
+    if hr_data is not None:  # on the ET clock, so it is sampled at the ET timestamp of every combined row
+        trial_data["hr"] = take_samples(hr_data, et_index_map)
+    all_trial_data_combined = pd.concat([data.reset_index(drop=True) for data in trial_data.values()], axis=1)
+
+    output_dir = create_output_dir(output_dir)
+    writer = create_synchronized_data_writer(output_dir, eeg_trial_onset_timestamp, et_trial_onset_timestamp,
+                                             output_format, layout, metadata, list(trial_data))
+    writer.write(trial_data, all_trial_data_combined)
+    writer.close()
     print("Synchronized data files were successfully saved in " + output_dir)
     return all_trial_data_combined, output_dir
 
 
+def create_synchronized_data_writer(output_dir, eeg_trial_onset_timestamp, et_trial_onset_timestamp,
+                                    output_format=OUTPUT_FORMAT, layout=OUTPUT_LAYOUT, metadata=None,
+                                    modalities=("eeg", "et")):
+    """
+    :param modalities: the modalities of the data (each one is saved in a separate "trial_<modality>" file in the
+    "separate" layout)
+    :return: a writer of the synchronized data files (see save_synchronized_data for the other parameters)
+    """
+    metadata = {"eeg_trial_onset_timestamp": int(eeg_trial_onset_timestamp),
+                "et_trial_onset_timestamp": int(et_trial_onset_timestamp),
+                "sample_rate": EEG_SAMPLE_RATE, **(metadata or {})}
+    return SynchronizedDataWriter(output_dir, {modality: f"trial_{modality}" for modality in modalities},
+                                  "all_trial_data_combined", output_format, layout, metadata)
+
+
+def create_output_dir(output_dir=None):
+    """
+    :param output_dir: path of the wanted output directory, or None for a new one named by the current time
+    :return: path to the output directory for the synchronized data (after making sure it exists)
+    """
+    if output_dir is None:
+        output_dir = os.path.join(SYNCHRONIZED_OUTPUT_DIR, datetime.now().strftime("%d%m%Y_%H%M"))
+    os.makedirs(output_dir, exist_ok=True)
+    return output_dir
+
+
+def get_trial_onset_timestamps_from_beginning(eeg_data_path, et_data_path, compact=False):
+    """
+    Finds the trial onsets while reading only the beginning protocol part of the data files.
+    :param eeg_data_path: path to the EEG data file
+    :param et_data_path: path to the ET data file
+    :param compact: whether to store the data with compact dtypes
+    :return: the EEG and ET trial onset timestamps (indices)
+    """
+    # the artifacts epochs must end before the last sample read, and so do the closed eyes periods
+    eeg_df = preprocess_eeg_data(eeg_data_path, compact, nrows=EEG_SAMPLE_RATE * EEG_BEGINNING_TIME + 1)
+    et_df = preprocess_et_data(et_data_path, lazy=True, compact=compact, nrows=ET_SAMPLE_RATE * (ET_BEGINNING_TIME + 1))
+    eeg_trial_onset_timestamp = get_eeg_trial_onset_timestamp(get_eeg_artifact_timestamps(eeg_df))
+    et_trial_onset_timestamp = get_et_trial_onset_timestamps(get_closed_eyes_timestamps(et_df))
+    return eeg_trial_onset_timestamp, et_trial_onset_timestamp
+
+
+def rechunk(chunks, chunk_size):
+    """
+    :param chunks: iterable of data frames
+    :param chunk_size: the wanted number of rows in each data frame
+    :return: generator of the same rows in data frames of chunk_size rows (except for the last one)
+    """
+    buffer = []
+    buffered_rows = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered_rows += len(chunk)
+        while buffered_rows >= chunk_size:
+            merged = pd.concat(buffer)
+            yield merged[:chunk_size]
+            buffer = [merged[chunk_size:]]
+            buffered_rows -= chunk_size
+    if buffered_rows:
+        yield pd.concat(buffer)
+
+
+def iter_eeg_chunks(eeg_data_path, start, chunk_size=STREAMING_CHUNK_SIZE, compact=False):
+    """
+    :param eeg_data_path: path to the EEG data file
+    :param start: timestamp (index) to start reading from
+    :param chunk_size: number of samples in each chunk
+    :param compact: whether to store the electrodes as float32 and the trigger as int8
+    :return: generator of the EEG data frame chunks from start, indexed like the whole data frame would be
+    """
+    for chunk in iter_csv_chunks_cached(eeg_data_path, chunk_size, start, get_ingestion_cache_dir()):
+        yield name_eeg_columns(chunk, compact)
+
+
+def iter_et_chunks(et_data_path, start, chunk_size=STREAMING_CHUNK_SIZE, method=ET_RESAMPLING_METHOD, compact=False):
+    """
+    :param et_data_path: path to the ET data file
+    :param start: timestamp (index, in the EEG sample rate) to start from
+    :param chunk_size: number of (EEG sample rate) samples in each chunk
+    :param method: the resampling method, one of resampling.RESAMPLING_METHODS
+    :param compact: whether to store the coordinates as float32
+    :return: generator of the resampled ET data frame chunks from start, indexed like the whole data frame would be
+    """
+    resampler = StreamingETResampler(EEG_SAMPLE_RATE, ET_SAMPLE_RATE, method, dtype=np.float32 if compact else None)
+    native_chunk_size = max(1, chunk_size * ET_SAMPLE_RATE // EEG_SAMPLE_RATE)
+
+    def resampled_chunks():
+        for chunk in iter_csv_chunks_cached(et_data_path, native_chunk_size, 0, get_ingestion_cache_dir()):
+            yield resampler.feed(chunk)
+        yield resampler.flush()
+
+    trial_chunks = (chunk[max(0, start - chunk.index[0]):] for chunk in resampled_chunks() if len(chunk))
+    return rechunk((chunk for chunk in trial_chunks if len(chunk)), chunk_size)
+
+
+def iter_synchronized_chunks(eeg_data_path, et_data_path, eeg_trial_onset_timestamp, et_trial_onset_timestamp,
+                             chunk_size=STREAMING_CHUNK_SIZE, compact=False, hr_data=None):
+    """
+    Reads the real trial data in chunks, without ever loading the whole recordings.
+    :param eeg_data_path: path to the EEG data file
+    :param et_data_path: path to the ET data file
+    :param eeg_trial_onset_timestamp: timestamp (index) of the EEG data for the onset of the real trial
+    :param et_trial_onset_timestamp: timestamp (index) of the ET data for the onset of the real trial
+    :param chunk_size: number of samples in each chunk
+    :param compact: whether to store the data with compact dtypes
+    :param hr_data: HR data indexed like the ET data (see preprocess_hr_data), or None if there is no HR data
+    :return: generator of (dict of modality -> trial chunk, combined chunk) data frames, where the separate chunks
+    are indexed like save_synchronized_data's separate data frames (and are None after their data ended),
+    and the combined chunk is indexed from the trial onset
+    """
+    combined_start = 0
+    et_columns = []
+    eeg_chunks = iter_eeg_chunks(eeg_data_path, eeg_trial_onset_timestamp, chunk_size, compact)
+    et_chunks = iter_et_chunks(et_data_path, et_trial_onset_timestamp, chunk_size, compact=compact)
+    for trial_eeg, trial_et in zip_longest(eeg_chunks, et_chunks):
+        if trial_et is not None:
+            et_columns = trial_et.columns
+        chunk_length = max(len(chunk) for chunk in [trial_eeg, trial_et] if chunk is not None)
+        combined_index = pd.RangeIndex(combined_start, combined_start + chunk_length)
+        trial_chunks = {"eeg": trial_eeg, "et": trial_et}
+        parts = []
+        for chunk, columns in [(trial_eeg, EEG_ELECTRODES), (trial_et, et_columns)]:
+            if chunk is None:  # this data ended before the other one
+                parts.append(pd.DataFrame(np.nan, index=combined_index, columns=columns))
+            else:
+                parts.append(chunk.set_axis(combined_index[:len(chunk)]).reindex(combined_index))
+        if hr_data is not None:  # on the ET clock, so it is sampled at the ET timestamp of every combined row
+            trial_chunks["hr"] = take_samples(hr_data, et_trial_onset_timestamp + combined_index.to_numpy())
+            parts.append(trial_chunks["hr"].set_axis(combined_index))
+        yield trial_chunks, pd.concat(parts, axis=1)
+        combined_start += chunk_length
+
+
+def save_synchronized_data_streaming(eeg_data_path, et_data_path, eeg_trial_onset_timestamp,
+                                     et_trial_onset_timestamp, chunk_size=STREAMING_CHUNK_SIZE, compact=False,
+                                     output_format=OUTPUT_FORMAT, layout=OUTPUT_LAYOUT, output_dir=None,
+                                     hr_data=None, metadata=None):
+    """
+    Saves the synchronized data of the real trial into the same files as save_synchronized_data,
+    while holding only one chunk of the data in memory at a time.
+    See iter_synchronized_chunks and save_synchronized_data for the parameters.
+    :return: the output directory
+    """
+    output_dir = create_output_dir(output_dir)
+    modalities = ["eeg", "et"] + (["hr"] if hr_data is not None else [])
+    writer = create_synchronized_data_writer(output_dir, eeg_trial_onset_timestamp, et_trial_onset_timestamp,
+                                             output_format, layout,
+                                             {"eeg_data_path": eeg_data_path, "et_data_path": et_data_path,
+                                              **(metadata or {})}, modalities)
+    for trial_chunks, combined in iter_synchronized_chunks(eeg_data_path, et_data_path, eeg_trial_onset_timestamp,
+                                                           et_trial_onset_timestamp, chunk_size, compact, hr_data):
+        writer.write(trial_chunks, combined)
+    writer.close()
+    print("Synchronized data files were successfully saved in " + output_dir)
+    return output_dir
+
+
+def pop_flag(flags):
+    """
+    Removes a flag from the argument variables, if it was supplied.
+    :param flags: all the forms of the flag
+    :return: whether the flag was supplied
+    """
+    supplied = any(arg in flags for arg in sys.argv[1:])
+    sys.argv[1:] = [arg for arg in sys.argv[1:] if arg not in flags]
+    return supplied
+
+
 def handle_argv(usage_message=USAGE_MESSAGE):
     """
     Handles the argument variables.
@@ -236,20 +526,75 @@ def handle_argv(usage_message=USAGE_MESSAGE):
         return None
 
 
+def synchronize_recording(eeg_data_path, et_data_path, hr_data_path=None, output_dir=None, streaming=False):
+    """
+    Runs the whole synchronization of one recording.
+    :param eeg_data_path: path to the EEG data file
+    :param et_data_path: path to the ET data file
+    :param hr_data_path: path to the HR data file (or None if there is no HR data)
+    :param output_dir: the output directory, or None for a new directory named by the current time
+    :param streaming: whether to stream the data in chunks instead of loading the whole recordings
+    :return: dict with the trial onset timestamps and the output directory
+    """
+    if streaming:
+        eeg_trial_onset_timestamp, et_trial_onset_timestamp = get_trial_onset_timestamps_from_beginning(
+            eeg_data_path, et_data_path, compact=USE_COMPACT_DTYPES)
+        et_time_origin = preprocess_et_data(et_data_path, lazy=True, nrows=1).time_origin
+        hr_data = get_hr_data(hr_data_path, et_time_origin)
+        hr_metadata = {"hr_data_path": hr_data_path} if hr_data is not None else {}
+        output_dir = save_synchronized_data_streaming(eeg_data_path, et_data_path, eeg_trial_onset_timestamp,
+                                                      et_trial_onset_timestamp, chunk_size=STREAMING_CHUNK_SIZE,
+                                                      compact=USE_COMPACT_DTYPES, output_dir=output_dir,
+                                                      hr_data=hr_data, metadata=hr_metadata)
+    else:
+        eeg_df = preprocess_eeg_data(eeg_data_path, compact=USE_COMPACT_DTYPES)
+        et_df = preprocess_et_data(et_data_path, lazy=True, compact=USE_COMPACT_DTYPES)
+        hr_data = get_hr_data(hr_data_path, et_df.time_origin)
+        hr_metadata = {"hr_data_path": hr_data_path} if hr_data is not None else {}
+        eeg_artifact_timestamps = get_eeg_artifact_timestamps(eeg_df)
+        eeg_trial_onset_timestamp = get_eeg_trial_onset_timestamp(eeg_artifact_timestamps)
+        closed_eyes_timestamps = get_closed_eyes_timestamps(et_df)
+        et_trial_onset_timestamp = get_et_trial_onset_timestamps(closed_eyes_timestamps)
+        et_index_map = None
+        if ALIGNMENT_METHOD == "cross_correlation":
+            et_index_map = get_et_index_map(eeg_df, et_df, eeg_trial_onset_timestamp)
+            if et_index_map is not None and len(et_index_map):
+                et_trial_onset_timestamp = et_index_map[0]
+        _, output_dir = save_synchronized_data(eeg_df, et_df, eeg_trial_onset_timestamp, et_trial_onset_timestamp,
+                                               metadata={"eeg_data_path": eeg_data_path,
+                                                         "et_data_path": et_data_path, **hr_metadata},
+                                               output_dir=output_dir, et_index_map=et_index_map, hr_data=hr_data)
+    return {"eeg_trial_onset_timestamp": int(eeg_trial_onset_timestamp),
+            "et_trial_onset_timestamp": int(et_trial_onset_timestamp), "output_dir": output_dir}
+
+
+def get_hr_data(hr_data_path, et_time_origin):
+    """
+    :param hr_data_path: path to the HR data file (or None if there is no HR data)
+    :param et_time_origin: the time (in ms) of the ET data's first EEG-rate sample (None if the ET data has no
+    timestamps)
+    :return: HR data indexed like the ET data (see preprocess_hr_data), or None if it can't be synchronized
+    """
+    if hr_data_path is None:
+        return None
+    if et_time_origin is None:
+        print("The HR data can't be synchronized without the ET timestamps, so it is not saved")
+        return None
+    try:
+        return preprocess_hr_data(hr_data_path, et_time_origin, compact=USE_COMPACT_DTYPES)
+    except ValueError as error:
+        print(f"{error}\nThe HR data can't be synchronized, so it is not saved")
+        return None
+
+
 def main():
     """
     Main code to run when running the beginning protocol for the synchronization.
     """
+    streaming = pop_flag(STREAM_FLAGS)
     recording_identifier = handle_argv()
     eeg_data_path, et_data_path, hr_data_path = find_data_paths(recording_identifier)
-    eeg_df = preprocess_eeg_data(eeg_data_path)
-    et_df = preprocess_et_data(et_data_path)
-    # hr_df = preprocess_hr_data(hr_data_path)
-    eeg_artifact_timestamps = get_eeg_artifact_timestamps(eeg_df)
-    eeg_trial_onset_timestamp = get_eeg_trial_onset_timestamp(eeg_artifact_timestamps)
-    closed_eyes_timestamps = get_closed_eyes_timestamps(et_df)
-    et_trial_onset_timestamp = get_et_trial_onset_timestamps(closed_eyes_timestamps)
-    save_synchronized_data(eeg_df, et_df, eeg_trial_onset_timestamp, et_trial_onset_timestamp)
+    synchronize_recording(eeg_data_path, et_data_path, hr_data_path, streaming=streaming)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,119 @@
+# Event-locked epochs of the synchronized data (e.g. the EEG and the gaze around every lemon onset).
+# The epochs are a sliding window view of the data, indexed by the events' onsets, so no epoch is copied until it is
+# used: an epoch is a view of the data, and the whole (epochs, channels, samples) array is only built on request, in
+# blocks of epochs (e.g. into a memory-mapped npy file). Baseline correction is applied to the epochs as they are
+# read, and epochs that overlap artifacts found by the artifact detector can be rejected.
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+EPOCHS_BLOCK_SIZE = 1024  # epochs processed at once when building an array of all the epochs
+
+
+def get_overlapping_mask(starts, length, intervals):
+    """
+    :param starts: array of the epochs' start indices
+    :param length: number of samples in an epoch
+    :param intervals: list of (start, end) intervals (e.g. artifact epochs timestamps)
+    :return: boolean array of whether each epoch overlaps any of the intervals
+    """
+    intervals = np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+    # intervals that start before an epoch ends, minus those of them that end before it starts
+    overlapping_num = (np.searchsorted(np.sort(intervals[:, 0]), starts + length, side="left") -
+                       np.searchsorted(np.sort(intervals[:, 1]), starts, side="right"))
+    return overlapping_num > 0
+
+
+class EventEpochs:
+    """
+    Epochs of the data around events, as a sequence of (channels, samples) arrays.
+    """
+
+    def __init__(self, data, onsets, pre_samples, post_samples, baseline=None, rejected_intervals=None):
+        """
+        :param data: array of shape (samples, channels) (e.g. memory-mapped)
+        :param onsets: array of the events' onset indices in the data
+        :param pre_samples: number of samples in an epoch before its onset
+        :param post_samples: number of samples in an epoch from its onset
+        :param baseline: (start, end) of the baseline window, in samples relative to the onset
+        (e.g. (-pre_samples, 0)), whose per channel mean is subtracted from the epoch, or None for no correction
+        :param rejected_intervals: list of (start, end) intervals (e.g. artifact epochs timestamps), so epochs that
+        overlap them are rejected, or None
+        """
+        self.data = data
+        self.pre_samples = pre_samples
+        self.length = pre_samples + post_samples
+        self.baseline = baseline
+        onsets = np.asarray(onsets, dtype=np.int64)
+        starts = onsets - pre_samples
+        is_inside = (starts >= 0) & (starts + self.length <= len(data))
+        if baseline is not None:
+            is_inside &= (onsets + baseline[0] >= 0) & (onsets + baseline[1] <= len(data))
+        is_rejected = np.zeros(len(onsets), dtype=bool)
+        if rejected_intervals is not None:
+            is_rejected = is_inside & get_overlapping_mask(starts, self.length, rejected_intervals)
+        self.onsets = onsets[is_inside & ~is_rejected]
+        self.rejected_onsets = onsets[is_rejected]
+        self.dropped_onsets = onsets[~is_inside]  # epochs that exceed the data
+        self.starts = self.onsets - pre_samples
+        self._baselines = None
+
+    @property
+    def _windows(self):
+        return sliding_window_view(self.data, self.length, axis=0)  # (samples - length + 1, channels, length)
+
+    def __len__(self):
+        return len(self.onsets)
+
+    @property
+    def shape(self):
+        return len(self), self.data.shape[1], self.length
+
+    @property
+    def baselines(self):
+        """
+        :return: array of shape (epochs, channels) of the baseline of every epoch (zeros with no baseline correction)
+        """
+        if self._baselines is None:
+            self._baselines = np.zeros(self.shape[:2])
+            if self.baseline is not None:
+                baseline_length = self.baseline[1] - self.baseline[0]
+                baseline_windows = sliding_window_view(self.data, baseline_length, axis=0)
+                for block_start in range(0, len(self), EPOCHS_BLOCK_SIZE):
+                    block_onsets = self.onsets[block_start:block_start + EPOCHS_BLOCK_SIZE]
+                    self._baselines[block_start:block_start + len(block_onsets)] = \
+                        baseline_windows[block_onsets + self.baseline[0]].mean(axis=2)
+        return self._baselines
+
+    def __getitem__(self, key):
+        """
+        :param key: an epoch number, or a slice / array of epoch numbers
+        :return: the epoch of shape (channels, samples) - a view of the data if there's no baseline correction - or
+        an array of shape (epochs, channels, samples) of the selected epochs
+        """
+        epochs = self._windows[self.starts[key]]
+        if self.baseline is None:
+            return epochs
+        return epochs - self.baselines[key][..., None]
+
+    def __iter__(self):
+        for epoch_number in range(len(self)):
+            yield self[epoch_number]
+
+    def to_array(self, out=None, dtype=None):
+        """
+        :param out: array of shape (epochs, channels, samples) to write the epochs into
+        (e.g. np.lib.format.open_memmap(path, "w+", dtype, epochs.shape)), or None for a new array
+        :param dtype: the dtype of the new array (the data's dtype if None, or a float dtype with baseline correction)
+        :return: array of all the epochs
+        """
+        if out is None:
+            if dtype is None:
+                dtype = self.data.dtype if self.baseline is None else np.result_type(self.data.dtype, np.float32)
+            out = np.empty(self.shape, dtype=dtype)
+        for block_start in range(0, len(self), EPOCHS_BLOCK_SIZE):
+            block = slice(block_start, block_start + EPOCHS_BLOCK_SIZE)
+            out[block] = self._windows[self.starts[block]]
+            if self.baseline is not None:
+                out[block] -= self.baselines[block][..., None]
+        return out
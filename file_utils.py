@@ -0,0 +1,41 @@
+# Helpers for the files that are shared between processes and runs (the caches, the index and the heatmaps).
+
+import os
+import fcntl
+from contextlib import contextmanager
+
+CACHE_ROOT = os.path.join(os.path.expanduser("~"), ".cache", "eeg_et_hr_synchronizer")
+
+
+def atomic_write(path, write, mode="wb"):
+    """
+    Writes a file through a temporary file that replaces it only when it is complete, so concurrent readers get
+    either the whole previous file or the whole new one, never a partial one
+    :param path: path of the file
+    :param write: function that writes the content, given the open temporary file
+    :param mode: the mode to open the temporary file with ("wb" or "w")
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, mode) as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Holds an exclusive lock of a file (e.g. for a read-modify-write update of it) until the context exits, waiting
+    for other processes that hold it. The lock is of a separate ".lock" file next to it, which is left in place
+    :param path: path of the locked file
+    """
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,169 @@
+# Gaze heatmaps of stimuli images, accumulated across presentations, sessions and subjects.
+# The gaze coordinates (in the image's pixels) are binned into a 2D histogram of counts per stimulus. The histograms
+# are saved as compact integer arrays, so new sessions are added to them incrementally and a whole study is
+# aggregated by merging accumulators, without processing the raw data again. Smoothing is only done when rendering.
+
+import os
+import json
+import numpy as np
+import matplotlib
+from PIL import Image
+from file_utils import atomic_write, file_lock
+
+GAZE_HEATMAP_BIN_SIZE = 4  # pixels
+GAZE_HEATMAP_COLORMAP = "jet"
+GAZE_HEATMAP_MAX_ALPHA = 0.6  # opacity of the heatmap where the gaze density is maximal
+COUNTS_KEY_PREFIX = "counts:"
+METADATA_KEY = "metadata"
+
+
+def smooth(values, sigma):
+    """
+    :param values: 2D array
+    :param sigma: standard deviation of the Gaussian kernel (in array cells)
+    :return: the values convolved with a Gaussian kernel (separably, with zeros outside the array)
+    """
+    radius = int(np.ceil(3 * sigma))
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    kernel /= kernel.sum()
+    for axis in range(2):
+        padded = np.pad(values, [(radius, radius) if padded_axis == axis else (0, 0) for padded_axis in range(2)])
+        length = values.shape[axis]
+        values = sum(weight * np.take(padded, np.arange(shift, shift + length), axis=axis)
+                     for shift, weight in enumerate(kernel))
+    return values
+
+
+class GazeHeatmapAccumulator:
+    def __init__(self, size, bin_size=GAZE_HEATMAP_BIN_SIZE):
+        """
+        :param size: (width, height) of the images' coordinates space
+        :param bin_size: width and height (in pixels) of the histograms' bins
+        """
+        self.size = tuple(int(length) for length in size)
+        self.bin_size = int(bin_size)
+        self.shape = (-(-self.size[1] // self.bin_size), -(-self.size[0] // self.bin_size))  # (rows, columns)
+        self.counts = {}  # stimulus name -> 2D array of the gaze samples num in every bin
+        self.presentations = {}  # stimulus name -> number of times it was presented
+        self.sessions = []  # names of the sessions that were added
+
+    def add(self, stimulus, x_coordinates, y_coordinates):
+        """
+        Adds the gaze samples of one presentation of a stimulus
+        :param stimulus: the stimulus name (e.g. its file name)
+        :param x_coordinates: array of the gaze X coordinates in the image (samples outside it are ignored)
+        :param y_coordinates: array of the gaze Y coordinates in the image
+        """
+        x_coordinates, y_coordinates = np.asarray(x_coordinates), np.asarray(y_coordinates)
+        inside = ((x_coordinates >= 0) & (x_coordinates < self.size[0]) &
+                  (y_coordinates >= 0) & (y_coordinates < self.size[1]))
+        bins = (y_coordinates[inside] // self.bin_size) * self.shape[1] + x_coordinates[inside] // self.bin_size
+        counts = np.bincount(bins.astype(np.int64), minlength=self.shape[0] * self.shape[1]).reshape(self.shape)
+        if stimulus in self.counts:
+            self.counts[stimulus] += counts.astype(np.uint32)
+        else:
+            self.counts[stimulus] = counts.astype(np.uint32)
+        self.presentations[stimulus] = self.presentations.get(stimulus, 0) + 1
+
+    def add_session(self, session):
+        """
+        :param session: name of a session whose gaze samples were added
+        """
+        if session in self.sessions:
+            raise ValueError(f"The session was already added to the heatmaps: {session}")
+        self.sessions.append(session)
+
+    def merge(self, other):
+        """
+        Adds the heatmaps of another accumulator (of the same size and bin size) to this one
+        :param other: a GazeHeatmapAccumulator
+        """
+        if other.size != self.size or other.bin_size != self.bin_size:
+            raise ValueError(f"Can't merge heatmaps of size {other.size} and bin size {other.bin_size} "
+                             f"into heatmaps of size {self.size} and bin size {self.bin_size}")
+        already_added = [session for session in other.sessions if session in self.sessions]
+        if already_added:
+            raise ValueError(f"The sessions were already added to the heatmaps: {already_added}")
+        self.sessions.extend(other.sessions)
+        for stimulus, counts in other.counts.items():
+            if stimulus in self.counts:
+                self.counts[stimulus] += counts
+            else:
+                self.counts[stimulus] = counts.copy()
+            self.presentations[stimulus] = self.presentations.get(stimulus, 0) + other.presentations[stimulus]
+
+    def get_density(self, stimulus, sigma=None):
+        """
+        :param stimulus: the stimulus name
+        :param sigma: standard deviation (in pixels) of the Gaussian smoothing, or None for no smoothing
+        :return: 2D float array (of the bins) of the gaze density, normalized so its maximum is 1
+        """
+        density = self.counts[stimulus].astype(np.float64)
+        if sigma:
+            density = smooth(density, sigma / self.bin_size)
+        return density / density.max() if density.max() > 0 else density
+
+    def render(self, stimulus, image, sigma=None, colormap=GAZE_HEATMAP_COLORMAP, max_alpha=GAZE_HEATMAP_MAX_ALPHA):
+        """
+        :param stimulus: the stimulus name
+        :param image: the stimulus image object (of the heatmaps' size)
+        :param sigma: standard deviation (in pixels) of the Gaussian smoothing, or None for no smoothing
+        :param colormap: name of a matplotlib colormap
+        :param max_alpha: opacity of the heatmap where the gaze density is maximal
+        :return: a new RGBA image of the heatmap over the stimulus image
+        """
+        density = self.get_density(stimulus, sigma)
+        colors = matplotlib.colormaps[colormap](density, bytes=True)
+        colors[..., 3] = np.rint(density * max_alpha * 255).astype(np.uint8)
+        binned_size = (self.shape[1] * self.bin_size, self.shape[0] * self.bin_size)
+        heatmap = Image.fromarray(colors, "RGBA").resize(binned_size, Image.NEAREST).crop((0, 0) + self.size)
+        return Image.alpha_composite(image.convert("RGBA").resize(self.size), heatmap)
+
+    def save(self, path):
+        """
+        Saves the heatmaps as a compressed npz file (see atomic_write)
+        :param path: path of the file
+        """
+        metadata = {"size": self.size, "bin_size": self.bin_size, "presentations": self.presentations,
+                    "sessions": self.sessions}
+        arrays = {COUNTS_KEY_PREFIX + stimulus: counts for stimulus, counts in self.counts.items()}
+        atomic_write(path, lambda f: np.savez_compressed(f, **arrays, **{METADATA_KEY: np.array(json.dumps(metadata))}))
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: path of a file saved by save()
+        :return: the GazeHeatmapAccumulator in the file
+        """
+        with np.load(path) as npz_file:
+            metadata = json.loads(str(npz_file[METADATA_KEY]))
+            accumulator = cls(metadata["size"], metadata["bin_size"])
+            accumulator.counts = {key[len(COUNTS_KEY_PREFIX):]: npz_file[key] for key in npz_file.files
+                                  if key.startswith(COUNTS_KEY_PREFIX)}
+        accumulator.presentations = metadata["presentations"]
+        accumulator.sessions = metadata["sessions"]
+        return accumulator
+
+
+def update_heatmaps_file(path, accumulator):
+    """
+    Merges an accumulator (e.g. of a new session) into the heatmaps file, creating it if it doesn't exist.
+    The file is locked during the update, so concurrent updates are applied one after the other
+    :param path: path of the heatmaps file
+    :param accumulator: a GazeHeatmapAccumulator
+    :return: the merged GazeHeatmapAccumulator (that was saved), or the file's accumulator as is if any of the
+    accumulator's sessions was already added to it (e.g. the same recording was processed again)
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with file_lock(path):
+        if not os.path.isfile(path):
+            accumulator.save(path)
+            return accumulator
+        merged = GazeHeatmapAccumulator.load(path)
+        already_added = [session for session in accumulator.sessions if session in merged.sessions]
+        if already_added:
+            print(f"The sessions were already added to the heatmaps, so they were not added again: {already_added}")
+            return merged
+        merged.merge(accumulator)
+        merged.save(path)
+    return merged
@@ -0,0 +1,179 @@
+# A binary cache of the raw data files, so every run after the first one doesn't parse the CSV text again.
+# On the first read a file is parsed and its float64 columns are saved as a single npy file in column-major order (so
+# every column is contiguous), and any other (e.g. integer) column as an npy file of its own dtype, next to a manifest
+# with the source file's path, size and modification time, and the columns' names and dtypes. Later reads memory-map
+# the npy files (if the source file was not changed since), so only the parts of the data that are actually used are
+# read from the disk, and no column is copied. The caches of the least recently used files are evicted beyond
+# INGESTION_CACHE_MAX_BYTES.
+# The files are parsed with pandas' C parser, like without the cache: the pyarrow parser is faster, but it rounds
+# some values differently in the last digit, and the cache must not change the results.
+
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+from file_utils import CACHE_ROOT, atomic_write
+from recording_index import RACY_MTIME_SECONDS
+
+INGESTION_CACHE_DIR = os.path.join(CACHE_ROOT, "ingestion")
+INGESTION_CACHE_MAX_BYTES = 20 * 1024 ** 3  # of binary copies kept in the cache directory
+
+
+def get_manifest_path(path, cache_dir=INGESTION_CACHE_DIR):
+    """
+    :param path: path to a data file
+    :param cache_dir: directory of the cache
+    :return: path of the manifest of the data file's cache
+    """
+    return os.path.join(cache_dir, hashlib.sha1(os.path.abspath(path).encode()).hexdigest() + ".json")
+
+
+def get_cache_files(manifest):
+    """
+    :param manifest: the manifest of a data file's cache
+    :return: list of the names of the cache's npy files
+    """
+    return [manifest["data_file"]] + list(manifest["column_files"].values())
+
+
+def load_cached(path, stat, cache_dir=INGESTION_CACHE_DIR):
+    """
+    :param path: path to a data file
+    :param stat: the data file's os.stat result
+    :param cache_dir: directory of the cache (or None for no cache)
+    :return: data frame of the memory-mapped cache of the file, or None if there's no up to date cache
+    """
+    if cache_dir is None:
+        return None
+    manifest_path = get_manifest_path(path, cache_dir)
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if (manifest["source_path"] != os.path.abspath(path) or manifest["size"] != stat.st_size or
+                manifest["mtime_ns"] != stat.st_mtime_ns):
+            return None
+        data = np.load(os.path.join(cache_dir, manifest["data_file"]), mmap_mode="r")
+        columns = {column: np.load(os.path.join(cache_dir, column_file), mmap_mode="r")
+                   for column, column_file in manifest["column_files"].items()}
+        os.utime(manifest_path)  # marks the cache as recently used, for the eviction
+    except (OSError, ValueError, KeyError):
+        return None  # no cache, or a corrupted one that is just created again
+    if not columns:
+        return pd.DataFrame(data, columns=manifest["columns"], copy=False)
+    float_columns = iter(range(data.shape[1]))
+    return pd.DataFrame({column: columns[column] if column in columns else data[:, next(float_columns)]
+                         for column in manifest["columns"]}, copy=False)
+
+
+def evict(cache_dir=INGESTION_CACHE_DIR, max_bytes=INGESTION_CACHE_MAX_BYTES, kept_manifest_path=None):
+    """
+    Removes the caches of the least recently used data files, until the cache directory is within max_bytes
+    :param cache_dir: directory of the cache
+    :param max_bytes: maximal total size of the caches' npy files
+    :param kept_manifest_path: the manifest of a cache that is never removed (e.g. the one that was just saved)
+    """
+    caches = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".json"):
+            continue
+        manifest_path = os.path.join(cache_dir, name)
+        try:
+            with open(manifest_path, "r") as f:
+                files = [os.path.join(cache_dir, file) for file in get_cache_files(json.load(f))]
+            caches.append((os.path.getmtime(manifest_path), manifest_path, files,
+                           sum(os.path.getsize(file) for file in files if os.path.isfile(file))))
+        except (OSError, ValueError, KeyError):
+            continue  # e.g. removed by another process meanwhile
+    total_bytes = sum(cache[3] for cache in caches)
+    for _, manifest_path, files, nbytes in sorted(caches):
+        if total_bytes <= max_bytes:
+            break
+        if manifest_path == kept_manifest_path:
+            continue
+        for file in [manifest_path] + files:  # the manifest first, so no reader finds a partial cache
+            if os.path.isfile(file):
+                os.remove(file)
+        total_bytes -= nbytes
+
+
+def save_cache(path, stat, df, cache_dir=INGESTION_CACHE_DIR, max_bytes=INGESTION_CACHE_MAX_BYTES):
+    """
+    Saves the cache of the data file (see atomic_write), and evicts old caches beyond max_bytes
+    :param path: path to a data file
+    :param stat: the data file's os.stat result, before it was parsed
+    :param df: the parsed data frame of the file
+    :param cache_dir: directory of the cache
+    :param max_bytes: maximal total size of the caches in the directory
+    """
+    if cache_dir is None or not all(pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes):
+        return  # only numeric data files are cached
+    manifest_path = get_manifest_path(path, cache_dir)
+    file_prefix = f"{os.path.splitext(os.path.basename(manifest_path))[0]}_{stat.st_size}_{stat.st_mtime_ns}"
+    float_columns = [column for column, dtype in df.dtypes.items() if dtype == np.float64]
+    column_files = {str(column): f"{file_prefix}_{column_number}.npy"
+                    for column_number, (column, dtype) in enumerate(df.dtypes.items()) if dtype != np.float64}
+    manifest = {"source_path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                "columns": [str(column) for column in df.columns], "dtypes": [str(dtype) for dtype in df.dtypes],
+                "data_file": f"{file_prefix}.npy", "column_files": column_files}
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.isfile(manifest_path):  # the cache of a previous version of the file
+            with open(manifest_path, "r") as f:
+                previous_files = set(get_cache_files(json.load(f))) - set(get_cache_files(manifest))
+            for previous_file in previous_files:
+                if os.path.isfile(os.path.join(cache_dir, previous_file)):
+                    os.remove(os.path.join(cache_dir, previous_file))
+        atomic_write(os.path.join(cache_dir, manifest["data_file"]),
+                     lambda f: np.save(f, np.asfortranarray(df[float_columns].to_numpy(dtype=np.float64))))
+        for column, dtype in df.dtypes.items():
+            if dtype != np.float64:
+                atomic_write(os.path.join(cache_dir, column_files[str(column)]),
+                             lambda f: np.save(f, df[column].to_numpy()))
+        atomic_write(manifest_path, lambda f: json.dump(manifest, f), "w")
+        evict(cache_dir, max_bytes, manifest_path)
+    except (OSError, ValueError, KeyError):
+        pass  # without a cache the file is just parsed again on the next read (e.g. in a read-only home directory)
+
+
+def read_csv_cached(path, nrows=None, cache_dir=INGESTION_CACHE_DIR):
+    """
+    :param path: path to a CSV file
+    :param nrows: number of rows to read from the beginning of the file, or None for all of them
+    :param cache_dir: directory of the cache (or None to just parse the file)
+    :return: data frame of the file, memory-mapped from the cache if it is up to date.
+    Only whole files are cached, so the beginning of a file without a cache is just parsed
+    """
+    stat = os.stat(path)
+    df = load_cached(path, stat, cache_dir)
+    if df is not None:
+        return df if nrows is None else df[:nrows]
+    if nrows is not None:
+        return pd.read_csv(path, nrows=nrows)
+    df = pd.read_csv(path)
+    parsed_stat = os.stat(path)
+    is_changed = (parsed_stat.st_size, parsed_stat.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns)
+    # a file that was modified too recently may still be written to, within the same modification time
+    if not is_changed and time.time() - stat.st_mtime_ns / 1e9 >= RACY_MTIME_SECONDS:
+        save_cache(path, stat, df, cache_dir)
+    return df
+
+
+def iter_csv_chunks_cached(path, chunk_size, start=0, cache_dir=INGESTION_CACHE_DIR):
+    """
+    :param path: path to a CSV file
+    :param chunk_size: number of rows in each chunk
+    :param start: row to start reading from
+    :param cache_dir: directory of the cache (or None to just parse the file)
+    :return: generator of the data frame chunks of the file from start, indexed by their row number, sliced from the
+    memory-mapped cache if it is up to date, otherwise parsed one by one (without creating a cache)
+    """
+    df = load_cached(path, os.stat(path), cache_dir)
+    if df is None:
+        for chunk in pd.read_csv(path, chunksize=chunk_size, skiprows=range(1, start + 1)):
+            chunk.index += start
+            yield chunk
+        return
+    for chunk_start in range(start, len(df), chunk_size):
+        yield df[chunk_start:chunk_start + chunk_size]
@@ -0,0 +1,58 @@
+# ET is Eye Tracker
+# Detection of intervals (runs) where a boolean condition holds, e.g. closed eyes (NaN coordinates) or winks.
+# All intervals are (start, end) index pairs, where end is exclusive (the first index after the interval).
+
+import numpy as np
+
+
+def get_true_intervals(mask, min_length=None, max_length=None, drop_leading=False, drop_trailing=False):
+    """
+    :param mask: 1D boolean array
+    :param min_length: minimal number of samples in an interval (or None)
+    :param max_length: maximal number of samples in an interval (or None)
+    :param drop_leading: whether to drop an interval that starts at the first sample
+    (its real start is unknown, e.g. before the tracker found the eyes)
+    :param drop_trailing: whether to drop an interval that lasts until the last sample (it didn't end yet)
+    :return: array of shape (intervals_num, 2) with the (start, end) indices of the intervals where mask is True
+    """
+    mask = np.asarray(mask, dtype=bool)
+    edges = np.flatnonzero(np.diff(mask.astype(np.int8), prepend=0, append=0))
+    intervals = edges.reshape(-1, 2)  # rises and falls alternate, starting with a rise
+    if drop_leading and len(intervals) and intervals[0, 0] == 0:
+        intervals = intervals[1:]
+    if drop_trailing and len(intervals) and intervals[-1, 1] == len(mask):
+        intervals = intervals[:-1]
+    lengths = intervals[:, 1] - intervals[:, 0]
+    if min_length is not None:
+        intervals = intervals[lengths >= min_length]
+        lengths = intervals[:, 1] - intervals[:, 0]
+    if max_length is not None:
+        intervals = intervals[lengths <= max_length]
+    return intervals
+
+
+def get_nan_mask(df, columns):
+    """
+    :param df: data frame
+    :param columns: column names
+    :return: boolean array of the samples where all the given columns are NaN
+    """
+    return np.logical_and.reduce([np.isnan(np.asarray(df[column], dtype=np.float64)) for column in columns])
+
+
+def get_valid_mask(df, columns):
+    """
+    :param df: data frame
+    :param columns: column names
+    :return: boolean array of the samples where none of the given columns is NaN
+    """
+    return ~np.logical_or.reduce([np.isnan(np.asarray(df[column], dtype=np.float64)) for column in columns])
+
+
+def to_timestamps(intervals, offset=0):
+    """
+    :param intervals: array of (start, end) indices
+    :param offset: index to add to all the timestamps
+    :return: list of (start, end) tuples of ints, as used by the synchronization functions
+    """
+    return [(int(start) + offset, int(end) + offset) for start, end in intervals]
@@ -14,10 +14,16 @@
 
 import os
 import numpy as np
-from PIL import Image, ImageDraw
+from PIL import ImageDraw
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from eeg_et_hr_synchronizer import handle_argv, find_data_paths, preprocess_eeg_data, preprocess_et_data, \
-    save_synchronized_data, get_most_recent_file, EEG_SAMPLE_RATE, ET_SAMPLE_RATE
+    save_synchronized_data, get_most_recent_file, get_eeg_artifact_timestamps_per_electrode, EEG_SAMPLE_RATE, \
+    ET_SAMPLE_RATE, EEG_ELECTRODES, USE_COMPACT_DTYPES, SYNCHRONIZED_OUTPUT_DIR
+from event_epochs import EventEpochs
+from gaze_heatmaps import GazeHeatmapAccumulator, update_heatmaps_file
+from interval_detection import get_true_intervals, get_nan_mask, get_valid_mask
+from stimulus_cache import StimulusCache, STIMULUS_CACHE_DIR, STIMULUS_CACHE_MAX_BYTES
 
 # Paths:
 LEMONS_EEG_DATA_PARENT_DIR = "/home/innereye/innereye/Datasets/Lemons/EEG"
@@ -43,6 +49,23 @@ MIN_BEGINNING_PROTOCOL_WINK_SAMPLES = MIN_BEGINNING_PROTOCOL_WINK_TIME * EEG_SAM
 GAZE_MARK_COLOR = (255, 0, 0)  # red in RGB
 GAZE_MARK_RADIUS = 3  # pixels
 
+# Rendering:
+RENDER_WORKERS = None  # processes for rendering the gaze marks over the images (None for the number of CPUs)
+RENDER_TASKS_PER_WORKER_CALL = 16  # images sent to a rendering process at once
+CACHE_RESIZED_STIMULI_FILES = True  # whether to also keep the resized stimuli in files, for other processes and runs
+
+# Gaze heatmaps:
+GAZE_HEATMAPS_PATH = os.path.join(SYNCHRONIZED_OUTPUT_DIR, "lemons_gaze_heatmaps.npz")  # accumulated over sessions
+GAZE_HEATMAP_SMOOTHING_SIGMA = 10  # pixels (None for no smoothing)
+
+# Lemon epochs:
+LEMON_EPOCH_PRE_TIME = 0.2  # seconds before a lemon onset
+LEMON_EPOCH_POST_TIME = 0.8  # seconds from a lemon onset
+LEMON_EPOCH_BASELINE_CORRECTION = True  # whether to subtract the mean of the EEG before the onset from its epoch
+REJECT_ARTIFACT_LEMON_EPOCHS = True  # whether to reject the epochs that overlap EEG artifacts
+LEMON_EPOCH_EEG_CHANNELS = [electrode for electrode in EEG_ELECTRODES if electrode != "TRG"]
+LEMON_EPOCH_GAZE_COLUMNS = ["left_x", "left_y", "right_x", "right_y"]
+
 
 def get_lemon_onset_timestamps(eeg_df):
     """
@@ -66,7 +89,7 @@ def get_trial_images_paths():
 
 def get_gaze_center(sample):
     """
-    :param sample: ET data frame sample
+    :param sample: ET data frame sample (or a data frame, for the coordinates of all its samples)
     :return: tuple with the coordinates of the center between the 2 eyes' gaze
     """
     return ((sample["left_x"] + sample["right_x"]) / 2 * SCREEN_WIDTH,
@@ -75,23 +98,23 @@ def get_gaze_center(sample):
 
 def is_located_inside_image(gaze_center):
     """
-    :param gaze_center: tuple with the coordinates of the center between the 2 eyes' gaze
-    :return: whether this point is in the target image boundaries
+    :param gaze_center: tuple with the coordinates of the center between the 2 eyes' gaze (or arrays of coordinates)
+    :return: whether this point is in the target image boundaries (or a boolean array for arrays of coordinates)
     """
-    return (LEMON_LEFT_EDGE_ON_SCREEN < gaze_center[0] < LEMON_RIGHT_EDGE_ON_SCREEN and
-            LEMON_TOP_EDGE_ON_SCREEN < gaze_center[1] < LEMON_BOTTOM_EDGE_ON_SCREEN)
+    return ((LEMON_LEFT_EDGE_ON_SCREEN < gaze_center[0]) & (gaze_center[0] < LEMON_RIGHT_EDGE_ON_SCREEN) &
+            (LEMON_TOP_EDGE_ON_SCREEN < gaze_center[1]) & (gaze_center[1] < LEMON_BOTTOM_EDGE_ON_SCREEN))
 
 
 def adjust_screen_coordinates_to_image(gaze_center, image):
     """
     :param gaze_center: tuple with the coordinates of the center between the 2 eyes' gaze
-    (in relation to the total screen)
-    :param image: the target image object
+    (in relation to the total screen), or arrays of coordinates
+    :param image: the target image object (or its (width, height) size)
     :return: an adjustment of the coordinates to only the target image
     """
-    image_width, image_height = image.size
-    return (int((gaze_center[0] - LEMON_LEFT_EDGE_ON_SCREEN) / LEMON_WIDTH * image_width),
-            int((gaze_center[1] - LEMON_TOP_EDGE_ON_SCREEN) / LEMON_HEIGHT * image_height))
+    image_width, image_height = image if isinstance(image, tuple) else image.size
+    return (np.trunc((gaze_center[0] - LEMON_LEFT_EDGE_ON_SCREEN) / LEMON_WIDTH * image_width).astype(int),
+            np.trunc((gaze_center[1] - LEMON_TOP_EDGE_ON_SCREEN) / LEMON_HEIGHT * image_height).astype(int))
 
 
 def add_gaze_mark_to_image(draw, x_coordinate, y_coordinate):
@@ -108,86 +131,207 @@ def add_gaze_mark_to_image(draw, x_coordinate, y_coordinate):
     # image.putpixel((x_coordinate, y_coordinate), GAZE_MARK_COLOR)
 
 
-def save_et_locations_over_images(sync_df, output_dir):
+def get_lemon_segments(sync_df, images_num):
+    """
+    :param sync_df: synchronized data frame for both ET and EEG data
+    :param images_num: number of images that were used in the trial
+    :return: list of (image index, start, end) timestamps (positions) of every lemon that was shown and finished
+    """
+    # synchronized data starts at a real event (lemon is shown), and the rest start when the trigger drops
+    starts = np.concatenate([[0], get_lemon_onset_timestamps(sync_df)])[:images_num]  # more if the app was closed
+    all_ends = np.flatnonzero(sync_df.TRG.diff().to_numpy() == 1)
+    next_starts = np.append(starts[1:], len(sync_df))
+    ends_positions = np.searchsorted(all_ends, starts, side="right")
+    segments = []
+    for image_index, (start, next_start, end_position) in enumerate(zip(starts, next_starts, ends_positions)):
+        if end_position < len(all_ends) and all_ends[end_position] < next_start:  # otherwise the lemon never finished
+            segments.append((image_index, int(start), int(all_ends[end_position])))
+    return segments
+
+
+def render_gaze_marks_over_image(image_path, output_path, gaze_x, gaze_y):
+    """
+    Saves a copy of the image with a gaze mark at every given coordinate
+    :param image_path: path to the target image
+    :param output_path: path to save the marked image to
+    :param gaze_x: array of the gaze X coordinates on the screen (inside the image boundaries)
+    :param gaze_y: array of the gaze Y coordinates on the screen (inside the image boundaries)
+    """
+    image, draw = create_new_image_objects(image_path)
+    x_coordinates, y_coordinates = adjust_screen_coordinates_to_image((gaze_x, gaze_y), image)
+    for x_coordinate, y_coordinate in zip(x_coordinates.tolist(), y_coordinates.tolist()):
+        add_gaze_mark_to_image(draw, x_coordinate, y_coordinate)
+    image.save(output_path)
+
+
+def get_lemons_gaze_coordinates(sync_df, all_image_paths):
+    """
+    :param sync_df: synchronized data frame for both ET and EEG data
+    :param all_image_paths: list of paths for the images that were used in the trial
+    :return: list of (image index, gaze X coordinates, gaze Y coordinates) of every lemon that was shown and finished,
+    with the screen coordinates of its ET samples that are inside the image boundaries
+    """
+    gaze_x, gaze_y = (coordinates.to_numpy() for coordinates in get_gaze_center(sync_df))
+    is_marked = is_located_inside_image((gaze_x, gaze_y))
+    is_marked &= sync_df.index.to_numpy() % int(EEG_SAMPLE_RATE / ET_SAMPLE_RATE) == 0  # ET data is resampled
+    is_marked &= sync_df.TRG.diff().fillna(0).to_numpy() == 0  # not on the lemons' start and end samples
+    lemons_gaze_coordinates = []
+    for image_index, start, end in get_lemon_segments(sync_df, len(all_image_paths)):
+        marked_positions = start + np.flatnonzero(is_marked[start:end])
+        lemons_gaze_coordinates.append((image_index, gaze_x[marked_positions], gaze_y[marked_positions]))
+    return lemons_gaze_coordinates
+
+
+def save_et_locations_over_images(sync_df, output_dir, workers=RENDER_WORKERS):
     """
     Saves the ET coordinates over the images used for the RSVP trial
     :param sync_df: synchronized data frame for both ET and EEG data
     :param output_dir: the output directory
+    :param workers: number of processes for rendering the images (None for the number of CPUs)
     """
-    sync_df["diff"] = sync_df.TRG.diff()
-    image_index = 0
-    currently_processing_image = True  # synchronized data starts at a real event (lemon is shown)
     all_image_paths = get_trial_images_paths()
-    image, draw = create_new_image_objects(all_image_paths[0])
-    for index, row in sync_df.iterrows():
-        if row["diff"] == 1:  # lemon finished
-            image.save(os.path.join(output_dir, f"{image_index}_" + os.path.basename(all_image_paths[image_index])))
-            currently_processing_image = False
-        elif row["diff"] == -1:  # a new lemon starts
-            image_index += 1
-            if image_index >= len(all_image_paths):  # caused by manual closure of the app
-                break
-            image, draw = create_new_image_objects(all_image_paths[image_index])
-            currently_processing_image = True
-        else:  # == 0, or nan for the first sample
-            if (not currently_processing_image or
-                    index % int(EEG_SAMPLE_RATE / ET_SAMPLE_RATE) != 0):  # ET data is resampled
-                continue
-            gaze_center = get_gaze_center(row)
-            if not is_located_inside_image(gaze_center):
-                continue
-            x_coordinate, y_coordinate = adjust_screen_coordinates_to_image(gaze_center, image)
-            add_gaze_mark_to_image(draw, x_coordinate, y_coordinate)
-            # image.show()  # can be uncommented-out for debugging
+    tasks = []
+    for image_index, gaze_x, gaze_y in get_lemons_gaze_coordinates(sync_df, all_image_paths):
+        output_path = os.path.join(output_dir, f"{image_index}_" + os.path.basename(all_image_paths[image_index]))
+        tasks.append((all_image_paths[image_index], output_path, gaze_x, gaze_y))
+    tasks.sort(key=lambda task: task[0])  # a repeated stimulus is rendered by the same process, from its cache
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(render_gaze_marks_over_image, *zip(*tasks), chunksize=RENDER_TASKS_PER_WORKER_CALL))
     print("All gazes were successfully visually recorded on images!")
 
 
+def update_gaze_heatmaps(sync_df, session, heatmaps_path=None):
+    """
+    Adds the gaze samples of the trial to the heatmaps of the images, accumulated over all the sessions
+    :param sync_df: synchronized data frame for both ET and EEG data
+    :param session: name of the session, unique across all the sessions (e.g. the ET data's full path), as a session
+    is only added once
+    :param heatmaps_path: path of the heatmaps file (GAZE_HEATMAPS_PATH if None)
+    :return: the updated GazeHeatmapAccumulator
+    """
+    all_image_paths = get_trial_images_paths()
+    image_size = (int(LEMON_WIDTH), int(LEMON_HEIGHT))
+    accumulator = GazeHeatmapAccumulator(image_size)
+    accumulator.add_session(session)
+    for image_index, gaze_x, gaze_y in get_lemons_gaze_coordinates(sync_df, all_image_paths):
+        accumulator.add(os.path.basename(all_image_paths[image_index]),
+                        *adjust_screen_coordinates_to_image((gaze_x, gaze_y), image_size))
+    return update_heatmaps_file(heatmaps_path or GAZE_HEATMAPS_PATH, accumulator)
+
+
+def save_gaze_heatmaps(heatmaps, stimuli_paths, output_dir, sigma=GAZE_HEATMAP_SMOOTHING_SIGMA):
+    """
+    Saves the gaze heatmaps over the images
+    :param heatmaps: a GazeHeatmapAccumulator
+    :param stimuli_paths: paths of the images to save the heatmaps of (if they have one)
+    :param output_dir: the output directory
+    :param sigma: standard deviation (in pixels) of the heatmaps' smoothing, or None for no smoothing
+    """
+    for image_path in sorted(set(stimuli_paths)):
+        stimulus = os.path.basename(image_path)
+        if stimulus not in heatmaps.counts:
+            continue
+        image = heatmaps.render(stimulus, get_stimulus_cache().get(image_path), sigma)
+        image.save(os.path.join(output_dir, "heatmap_" + os.path.splitext(stimulus)[0] + ".png"))
+    print("All gaze heatmaps were successfully saved!")
+
+
+def get_eeg_artifact_intervals(sync_df, electrodes=LEMON_EPOCH_EEG_CHANNELS):
+    """
+    :param sync_df: synchronized data frame for both ET and EEG data
+    :param electrodes: the electrodes to look for artifacts in
+    :return: list of (start, end) timestamps (positions) of the artifact epochs in any of the electrodes
+    """
+    artifact_timestamps = get_eeg_artifact_timestamps_per_electrode(sync_df, electrodes, search_time=None)
+    return [timestamps for electrode_timestamps in artifact_timestamps.values() for timestamps in electrode_timestamps]
+
+
+def get_lemon_epochs(sync_df, columns, baseline_correction=LEMON_EPOCH_BASELINE_CORRECTION, rejected_intervals=None,
+                     pre_time=LEMON_EPOCH_PRE_TIME, post_time=LEMON_EPOCH_POST_TIME):
+    """
+    :param sync_df: synchronized data frame for both ET and EEG data
+    :param columns: the columns (channels) of the epochs
+    :param baseline_correction: whether to subtract the mean of the samples before the onset from every epoch
+    :param rejected_intervals: list of (start, end) timestamps (positions) that epochs overlapping them are rejected
+    (e.g. get_eeg_artifact_intervals), or None
+    :param pre_time: time (in seconds) of an epoch before its lemon onset
+    :param post_time: time (in seconds) of an epoch from its lemon onset
+    :return: EventEpochs of the data around every lemon onset after the first one. The synchronized data starts at
+    the first lemon's onset, so there is no data before it to epoch
+    """
+    onsets = get_lemon_onset_timestamps(sync_df)
+    pre_samples = int(pre_time * EEG_SAMPLE_RATE)
+    return EventEpochs(sync_df[columns].to_numpy(), onsets, pre_samples, int(post_time * EEG_SAMPLE_RATE),
+                       (-pre_samples, 0) if baseline_correction else None, rejected_intervals)
+
+
+def save_lemon_epochs(sync_df, output_dir, reject_artifacts=REJECT_ARTIFACT_LEMON_EPOCHS):
+    """
+    Saves the (epochs, channels, samples) arrays of the EEG and of the gaze around every lemon onset
+    (as npy files that can be memory-mapped), and the onsets of the epochs
+    :param sync_df: synchronized data frame for both ET and EEG data
+    :param output_dir: the output directory
+    :param reject_artifacts: whether to reject the epochs that overlap EEG artifacts
+    """
+    rejected_intervals = get_eeg_artifact_intervals(sync_df) if reject_artifacts else None
+    for name, columns, baseline_correction in [("eeg", LEMON_EPOCH_EEG_CHANNELS, LEMON_EPOCH_BASELINE_CORRECTION),
+                                               ("gaze", LEMON_EPOCH_GAZE_COLUMNS, False)]:
+        epochs = get_lemon_epochs(sync_df, columns, baseline_correction, rejected_intervals)
+        dtype = np.result_type(epochs.data.dtype, np.float32)
+        epochs.to_array(np.lib.format.open_memmap(os.path.join(output_dir, f"lemon_epochs_{name}.npy"), "w+",
+                                                  dtype, epochs.shape))
+    np.save(os.path.join(output_dir, "lemon_epochs_onsets.npy"), epochs.onsets)
+    print(f"{len(epochs)} lemon epochs were saved ({len(epochs.rejected_onsets)} rejected because of artifacts)")
+
+
+_stimulus_cache = None
+
+
+def get_stimulus_cache():
+    """
+    :return: the shared stimulus cache of this process, of images resized to the lemon's size on the screen
+    """
+    global _stimulus_cache
+    if _stimulus_cache is None:
+        _stimulus_cache = StimulusCache((LEMON_WIDTH, LEMON_HEIGHT), STIMULUS_CACHE_MAX_BYTES,
+                                        STIMULUS_CACHE_DIR if CACHE_RESIZED_STIMULI_FILES else None)
+    return _stimulus_cache
+
+
 def create_new_image_objects(image_path):
     """
     :param image_path: path to a new target image
     :return: the image object after being resized to screen dimension
     and its respective draw image that allows adding dots to it
     """
-    image = Image.open(image_path)
-    image.resize((int(LEMON_RIGHT_EDGE_ON_SCREEN - LEMON_LEFT_EDGE_ON_SCREEN),
-                  int(LEMON_BOTTOM_EDGE_ON_SCREEN - LEMON_TOP_EDGE_ON_SCREEN)))
+    image = get_stimulus_cache().get_copy(image_path)
     draw = ImageDraw.Draw(image)
     return image, draw
 
 
-def left_eye_winks(sample):
+def get_left_eye_winks_mask(et_df):
     """
-    :param sample: a row from the ET data frame
-    :return: whether the left eye was closed and the right one was open during that sample
+    :param et_df: ET data frame (or UpsampledETData)
+    :return: boolean array of whether the left eye was closed and the right one was open during each sample
     """
-    return (np.isnan(sample["left_x"]) and np.isnan(sample["left_y"]) and
-            not np.isnan(sample["right_x"]) and not np.isnan(sample["right_y"]))
+    return get_nan_mask(et_df, ["left_x", "left_y"]) & get_valid_mask(et_df, ["right_x", "right_y"])
 
 
-def get_et_trial_onset_timestamp_by_wink(et_df):
+def get_et_trial_onset_timestamp_by_wink(et_df, min_wink_samples=None):
     """
-    :param et_df: ET data frame
+    :param et_df: ET data frame (or UpsampledETData)
+    :param min_wink_samples: minimal length of a wink to be considered as the beginning protocol
+    (e.g. MIN_BEGINNING_PROTOCOL_WINK_SAMPLES), or None to consider all winks
     :return: end timestamp (index) for the winking phase before real trial onsets
     """
-    data = et_df[:ET_BEGINNING_TIME * EEG_SAMPLE_RATE]
-    wink_timestamps = []
-    current_index = 0
-    currently_winking = False
-    new_start = None
-    while current_index < len(data):
-        if left_eye_winks(data.loc[current_index]):
-            if not currently_winking:
-                new_start = current_index
-                currently_winking = True
-        else:  # eyes are open
-            if currently_winking:
-                wink_timestamps.append((new_start, current_index))
-                currently_winking = False
-        current_index += 1
-    if not wink_timestamps:
+    wink_mask = get_left_eye_winks_mask(et_df[:ET_BEGINNING_TIME * EEG_SAMPLE_RATE])
+    wink_intervals = get_true_intervals(wink_mask, min_length=min_wink_samples,
+                                        drop_trailing=True)  # a wink that didn't end isn't counted
+    if not len(wink_intervals):
         return ET_BEGINNING_TIME * EEG_SAMPLE_RATE
-    # index [0] will be the longest wink, and its index [1] will be the end timestamp
-    return sorted(wink_timestamps, key=lambda pair: pair[1] - pair[0], reverse=True)[0][1]
+    # the first longest wink, and its end timestamp
+    return int(wink_intervals[np.argmax(wink_intervals[:, 1] - wink_intervals[:, 0]), 1])
 
 
 def main():
@@ -197,13 +341,18 @@ def main():
     recording_identifier = handle_argv(usage_message="")
     eeg_data_path, et_data_path, _ = find_data_paths(recording_identifier,
                                                      eeg_data_parent_dir=LEMONS_EEG_DATA_PARENT_DIR)
-    eeg_df = preprocess_eeg_data(eeg_data_path)
-    et_df = preprocess_et_data(et_data_path)
+    eeg_df = preprocess_eeg_data(eeg_data_path, compact=USE_COMPACT_DTYPES)
+    et_df = preprocess_et_data(et_data_path, lazy=True, compact=USE_COMPACT_DTYPES)
     lemon_onset_timestamps = get_lemon_onset_timestamps(eeg_df)
     eeg_trial_onset_timestamp = lemon_onset_timestamps[0] if len(lemon_onset_timestamps) > 0 else 0
     et_trial_onset_timestamp = get_et_trial_onset_timestamp_by_wink(et_df)
-    sync_df, output_dir = save_synchronized_data(eeg_df, et_df, eeg_trial_onset_timestamp, et_trial_onset_timestamp)
+    sync_df, output_dir = save_synchronized_data(eeg_df, et_df, eeg_trial_onset_timestamp, et_trial_onset_timestamp,
+                                                 metadata={"eeg_data_path": eeg_data_path,
+                                                           "et_data_path": et_data_path})
     save_et_locations_over_images(sync_df, output_dir)
+    heatmaps = update_gaze_heatmaps(sync_df, os.path.abspath(et_data_path))
+    save_gaze_heatmaps(heatmaps, get_trial_images_paths(), output_dir)
+    save_lemon_epochs(sync_df, output_dir)
 
 
 if __name__ == '__main__':
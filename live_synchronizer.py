@@ -0,0 +1,358 @@
+# ET is Eye Tracker
+# Real-time (online) synchronization, while the EEG and ET recorders are still appending to their data files.
+# The files are tailed, and the beginning protocol events are detected incrementally, only in the newly received data:
+# the EEG epochs are compared to the last epoch of the previous data, and a closed eyes period that didn't end yet is
+# kept open until it does, so every poll costs the size of its new data (with the same events as the detectors of
+# eeg_et_hr_synchronizer on all the data received so far). The onsets are locked as soon as the protocol is
+# complete - all of its events were detected, or its time has passed - and from then on every EEG-rate frame that
+# has both EEG and ET data is emitted right away, to a callback or a queue.
+
+import os
+import io
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+from artifact_detection import get_epoch_statistics, get_epochs_num, get_artifact_epochs
+from eeg_et_hr_synchronizer import find_data_paths, name_eeg_columns, get_beginning_timestamps, \
+    get_trial_onset_timestamps, create_output_dir, create_synchronized_data_writer, EEG_SAMPLE_RATE, ET_SAMPLE_RATE, \
+    EEG_BEGINNING_TIME, ET_BEGINNING_TIME, ET_RESAMPLING_METHOD, EEG_ELECTRODES, ARTIFACT_ELECTRODE, EPOCH_JUMP, \
+    ARTIFACT_DIFFERENCE_THRESHOLD, ARTIFACT_STATISTIC, ET_COLUMN_FOR_SYNC, SHORT_BLINK_SAMPLES_NUM
+from interval_detection import get_true_intervals, get_nan_mask, to_timestamps
+from resampling import StreamingETResampler
+
+BEGINNING_PROTOCOL_EVENTS_NUM = 3  # presses / closed eyes periods; None to always wait for the whole protocol time
+POLL_INTERVAL = 0.02  # seconds between reads of the data files
+IDLE_TIMEOUT = 5  # seconds without new data after which the recording is considered to be over
+REPLAY_CHUNK_DURATION = 0.02  # seconds of data written at once when replaying a recording
+
+
+class CsvTailer:
+    """
+    Reads the rows that were appended to a CSV file since the last read (the file may not exist yet).
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the CSV file
+        """
+        self.path = path
+        self.rows_num = 0  # number of rows read so far
+        self._file = None
+        self._header = None
+        self._partial_line = ""
+
+    def read_new_rows(self):
+        """
+        :return: data frame of the complete rows that were appended since the last read (possibly empty),
+        indexed by their row number in the file, or None if the file or its header isn't there yet
+        """
+        if self._file is None:
+            if not os.path.isfile(self.path):
+                return None
+            self._file = open(self.path, "r")
+        text = self._partial_line + self._file.read()
+        complete_end = text.rfind("\n") + 1
+        self._partial_line = text[complete_end:]
+        lines = text[:complete_end]
+        if self._header is None:
+            if not lines:
+                return None
+            header_end = lines.index("\n") + 1
+            self._header, lines = lines[:header_end], lines[header_end:]
+        df = pd.read_csv(io.StringIO(self._header + lines))
+        df.index += self.rows_num
+        self.rows_num += len(df)
+        return df
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class ArtifactDetector:
+    """
+    Detects the EEG artifacts of the beginning protocol (like get_eeg_artifact_timestamps) in data that arrives in
+    consecutive chunks. Only the samples of the epoch that isn't complete yet and the statistic of the last complete
+    epoch are kept between chunks.
+    """
+
+    def __init__(self, search_time=EEG_BEGINNING_TIME):
+        """
+        :param search_time: time (in seconds) from the beginning of the recording to look for artifacts in
+        """
+        self.max_samples = EEG_SAMPLE_RATE * search_time
+        self.samples_num = 0  # number of samples received so far
+        self.timestamps = []  # (start, end) timestamps of the artifacts detected so far
+        self._epochs_num = 0  # number of epochs whose statistic was computed
+        self._last_value = None  # the statistic of the last epoch, of shape (1, 1)
+        self._pending = np.empty((0, 1))  # the samples from the start of the next epoch
+
+    def feed(self, eeg_chunk):
+        """
+        :param eeg_chunk: EEG data frame with the next samples
+        """
+        self.samples_num += len(eeg_chunk)
+        if self._epochs_num * EPOCH_JUMP >= self.max_samples:
+            return
+        self._pending = np.concatenate([self._pending, eeg_chunk[[ARTIFACT_ELECTRODE]].to_numpy(dtype=np.float64)])
+        new_epochs_num = get_epochs_num(self.samples_num, EPOCH_JUMP, max_samples=self.max_samples) - self._epochs_num
+        if new_epochs_num <= 0:
+            return
+        # an epoch must end before the last sample, which is the first sample of the next one
+        values = get_epoch_statistics(self._pending[:new_epochs_num * EPOCH_JUMP + 1], EPOCH_JUMP)[ARTIFACT_STATISTIC]
+        first_epoch = self._epochs_num
+        if self._last_value is not None:  # the first new epoch is compared to the last previous one
+            values = np.concatenate([self._last_value, values])
+            first_epoch -= 1
+        artifact_epochs = get_artifact_epochs(values, ARTIFACT_DIFFERENCE_THRESHOLD, EPOCH_JUMP)[0]
+        self.timestamps.extend(to_timestamps(artifact_epochs, first_epoch * EPOCH_JUMP))
+        self._last_value = values[-1:]
+        self._pending = self._pending[new_epochs_num * EPOCH_JUMP:]
+        self._epochs_num += new_epochs_num
+
+
+class ClosedEyesDetector:
+    """
+    Detects the closed eyes periods (like get_closed_eyes_timestamps) in ET data that arrives in consecutive chunks.
+    Only the start of the period that didn't end yet is kept between chunks.
+    """
+
+    def __init__(self):
+        self.samples_num = 0  # number of samples received so far
+        self.timestamps = []  # (start, end) timestamps of the closed eyes periods detected so far
+        self._open_start = None  # the start of the closed eyes period that lasts until the last sample received
+
+    def feed(self, et_chunk):
+        """
+        :param et_chunk: ET data frame (at the EEG sample rate) with the next samples
+        """
+        intervals = get_true_intervals(get_nan_mask(et_chunk, [ET_COLUMN_FOR_SYNC])) + self.samples_num
+        if self._open_start is not None:
+            if len(intervals) and intervals[0, 0] == self.samples_num:  # the open period continues
+                intervals[0, 0] = self._open_start
+            elif len(et_chunk):
+                intervals = np.concatenate([[[self._open_start, self.samples_num]], intervals])
+            else:
+                return
+        self.samples_num += len(et_chunk)
+        self._open_start = None
+        if len(intervals) and intervals[-1, 1] == self.samples_num:  # didn't end yet
+            self._open_start = intervals[-1, 0]
+            intervals = intervals[:-1]
+        # the beginning is usually NaN until first eye tracking samples, and short blinks aren't counted
+        intervals = intervals[(intervals[:, 0] > 0) & (intervals[:, 1] - intervals[:, 0] > SHORT_BLINK_SAMPLES_NUM)]
+        self.timestamps.extend(to_timestamps(intervals))
+
+
+def lock_trial_onset(timestamps, end_time_of_beginning, received_samples_num, events_num=BEGINNING_PROTOCOL_EVENTS_NUM):
+    """
+    :param timestamps: list of (start, end) timestamps of the events detected so far
+    :param end_time_of_beginning: the required time (in seconds) of the beginning protocol
+    :param received_samples_num: number of (EEG sample rate) samples received so far
+    :param events_num: number of events in the beginning protocol (or None to wait for the whole protocol time)
+    :return: the trial onset timestamp if the beginning protocol is complete, otherwise None
+    """
+    beginning_timestamps = get_beginning_timestamps(timestamps, EEG_SAMPLE_RATE * end_time_of_beginning)
+    protocol_time_passed = received_samples_num > EEG_SAMPLE_RATE * end_time_of_beginning
+    if protocol_time_passed or (events_num is not None and len(beginning_timestamps) >= events_num):
+        return get_trial_onset_timestamps(timestamps, end_time_of_beginning)
+    return None
+
+
+class LiveSynchronizer:
+    """
+    Synchronizes EEG and ET data files while they are being recorded.
+    """
+
+    def __init__(self, eeg_data_path, et_data_path, callback=None, frames_queue=None,
+                 events_num=BEGINNING_PROTOCOL_EVENTS_NUM, method=ET_RESAMPLING_METHOD):
+        """
+        :param eeg_data_path: path to the (growing) EEG data file
+        :param et_data_path: path to the (growing) ET data file
+        :param callback: function to call with every data frame of newly synchronized frames
+        :param frames_queue: queue to put every data frame of newly synchronized frames into
+        :param events_num: number of events in the beginning protocol (or None to wait for the whole protocol time)
+        :param method: the ET resampling method, one of resampling.RESAMPLING_METHODS
+        """
+        self.callback = callback
+        self.frames_queue = frames_queue
+        self.events_num = events_num
+        self.eeg_trial_onset_timestamp = None
+        self.et_trial_onset_timestamp = None
+        self.frames_num = 0  # number of synchronized frames emitted so far
+        self._eeg_tailer = CsvTailer(eeg_data_path)
+        self._et_tailer = CsvTailer(et_data_path)
+        self._et_resampler = StreamingETResampler(EEG_SAMPLE_RATE, ET_SAMPLE_RATE, method)
+        self._artifact_detector = ArtifactDetector()
+        self._closed_eyes_detector = ClosedEyesDetector()
+        self._eeg_chunks = []  # received and not yet emitted data, indexed by EEG-rate timestamps
+        self._et_chunks = []
+
+    @property
+    def is_locked(self):
+        return self.eeg_trial_onset_timestamp is not None and self.et_trial_onset_timestamp is not None
+
+    def _lock_onsets(self):
+        if self.eeg_trial_onset_timestamp is None and self._artifact_detector.samples_num:
+            self.eeg_trial_onset_timestamp = lock_trial_onset(self._artifact_detector.timestamps, EEG_BEGINNING_TIME,
+                                                              self._artifact_detector.samples_num, self.events_num)
+        if self.et_trial_onset_timestamp is None and self._closed_eyes_detector.samples_num:
+            self.et_trial_onset_timestamp = lock_trial_onset(self._closed_eyes_detector.timestamps, ET_BEGINNING_TIME,
+                                                             self._closed_eyes_detector.samples_num, self.events_num)
+        if self.is_locked:  # the data before the onsets is not needed anymore
+            self._eeg_chunks = [pd.concat(self._eeg_chunks).loc[self.eeg_trial_onset_timestamp:]]
+            self._et_chunks = [pd.concat(self._et_chunks).loc[self.et_trial_onset_timestamp:]]
+            print(f"Trial onsets were locked: EEG {self.eeg_trial_onset_timestamp}, "
+                  f"ET {self.et_trial_onset_timestamp}")
+
+    def _emit_frames(self):
+        eeg_df = pd.concat(self._eeg_chunks)
+        et_df = pd.concat(self._et_chunks)
+        frames_num = min(len(eeg_df), len(et_df))
+        if not frames_num:
+            return
+        frames = pd.concat([eeg_df[:frames_num].reset_index(drop=True), et_df[:frames_num].reset_index(drop=True)],
+                           axis=1)
+        frames.index += self.frames_num
+        self._eeg_chunks = [eeg_df[frames_num:]]
+        self._et_chunks = [et_df[frames_num:]]
+        self.frames_num += frames_num
+        if self.callback is not None:
+            self.callback(frames)
+        if self.frames_queue is not None:
+            self.frames_queue.put(frames)
+
+    def step(self):
+        """
+        Reads the new data from the files, and emits the frames that can be synchronized.
+        :return: whether any new data was read
+        """
+        new_eeg = self._eeg_tailer.read_new_rows()
+        new_et = self._et_tailer.read_new_rows()
+        received = False
+        if new_eeg is not None and len(new_eeg):
+            self._eeg_chunks.append(name_eeg_columns(new_eeg))
+            if self.eeg_trial_onset_timestamp is None:
+                self._artifact_detector.feed(self._eeg_chunks[-1])
+            received = True
+        if new_et is not None and len(new_et):
+            self._et_chunks.append(self._et_resampler.feed(new_et))
+            if self.et_trial_onset_timestamp is None:
+                self._closed_eyes_detector.feed(self._et_chunks[-1])
+            received = True
+        if received and not self.is_locked:
+            self._lock_onsets()
+        if self.is_locked:
+            self._emit_frames()
+        return received
+
+    def run(self, stop_event=None, idle_timeout=IDLE_TIMEOUT, poll_interval=POLL_INTERVAL):
+        """
+        Synchronizes the data until the recording is over (or stop_event is set).
+        :param stop_event: a threading / multiprocessing Event to stop on (or None)
+        :param idle_timeout: seconds without new data after which the recording is considered to be over
+        :param poll_interval: seconds between reads of the data files
+        """
+        last_data_time = time.monotonic()
+        while stop_event is None or not stop_event.is_set():
+            if self.step():
+                last_data_time = time.monotonic()
+            elif time.monotonic() - last_data_time > idle_timeout:
+                break
+            time.sleep(poll_interval)
+        if self.is_locked:  # the ET samples held back for resampling
+            self._et_chunks.append(self._et_resampler.flush())
+            self._emit_frames()
+        self._eeg_tailer.close()
+        self._et_tailer.close()
+
+
+def replay_recording(source_path, destination_path, sample_rate, speed=1, chunk_duration=REPLAY_CHUNK_DURATION):
+    """
+    Writes a recorded data file into a new file at the pace it was recorded in, like a recorder would.
+    :param source_path: path to the recorded data file
+    :param destination_path: path to the file to write
+    :param sample_rate: the sample rate of the data (Hz)
+    :param speed: replay speed (1 is real-time)
+    :param chunk_duration: seconds of data written at once
+    """
+    with open(source_path, "r") as source:
+        lines = source.readlines()
+    rows_per_chunk = max(1, int(sample_rate * chunk_duration))
+    start_time = time.monotonic()
+    with open(destination_path, "w") as destination:
+        destination.write(lines[0])
+        destination.flush()
+        for chunk_start in range(1, len(lines), rows_per_chunk):
+            destination.writelines(lines[chunk_start:chunk_start + rows_per_chunk])
+            destination.flush()
+            wake_time = start_time + (chunk_start - 1 + rows_per_chunk) / sample_rate / speed
+            time.sleep(max(0, wake_time - time.monotonic()))
+
+
+def start_replay_processes(eeg_data_path, et_data_path, destination_dir, speed=1, eeg_delay=0):
+    """
+    Replays a recorded session in background processes, to test the live synchronization offline.
+    :param eeg_data_path: path to the recorded EEG data file
+    :param et_data_path: path to the recorded ET data file
+    :param destination_dir: directory to write the replayed files into
+    :param speed: replay speed (1 is real-time)
+    :param eeg_delay: seconds to wait after starting the ET replay before starting the EEG replay
+    :return: the replayed (EEG, ET) data paths, and the replay processes
+    """
+    replayed_paths = [os.path.join(destination_dir, "replayed_eeg.csv"), os.path.join(destination_dir,
+                                                                                      "replayed_et.csv")]
+    et_process = multiprocessing.Process(target=replay_recording,
+                                         args=(et_data_path, replayed_paths[1], ET_SAMPLE_RATE, speed))
+    et_process.start()
+    time.sleep(eeg_delay / speed)
+    eeg_process = multiprocessing.Process(target=replay_recording,
+                                          args=(eeg_data_path, replayed_paths[0], EEG_SAMPLE_RATE, speed))
+    eeg_process.start()
+    return replayed_paths, [eeg_process, et_process]
+
+
+def main():
+    """
+    Main code to run for synchronizing a recording while it is being recorded (or a replay of a recorded one),
+    saving the synchronized frames as they arrive.
+    """
+    parser = argparse.ArgumentParser(description="Synchronizes EEG and ET data files while they are being recorded")
+    parser.add_argument("identifier", nargs="?", default=None,
+                        help="substring of the data files' names (default: the most recent files)")
+    parser.add_argument("--replay", action="store_true",
+                        help="replay the (already recorded) data files instead of waiting for the recorders")
+    parser.add_argument("--speed", type=float, default=1, help="replay speed (1 is real-time)")
+    args = parser.parse_args()
+    eeg_data_path, et_data_path, _ = find_data_paths(args.identifier)
+    replay_processes = []
+    if args.replay:
+        replay_dir = tempfile.mkdtemp()
+        (eeg_data_path, et_data_path), replay_processes = start_replay_processes(eeg_data_path, et_data_path,
+                                                                                 replay_dir, args.speed)
+    writers = []
+
+    def save_frames(frames):
+        if not writers:  # the onsets are locked once frames are emitted
+            writers.append(create_synchronized_data_writer(create_output_dir(),
+                                                           synchronizer.eeg_trial_onset_timestamp,
+                                                           synchronizer.et_trial_onset_timestamp, layout="combined"))
+        writers[0].write({"eeg": frames[EEG_ELECTRODES], "et": frames[frames.columns.drop(EEG_ELECTRODES)]}, frames)
+
+    synchronizer = LiveSynchronizer(eeg_data_path, et_data_path, callback=save_frames)
+    synchronizer.run()
+    for process in replay_processes:
+        process.join()
+    if not writers:
+        print("The beginning protocol was not completed")
+        sys.exit(1)
+    writers[0].close()
+    print(f"{synchronizer.frames_num} synchronized frames were saved in {writers[0].output_dir}")
+
+
+if __name__ == '__main__':
+    main()
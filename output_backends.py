@@ -0,0 +1,263 @@
+# Output backends for the synchronized data.
+# Every backend writes a data frame in chunks (so it can be used both for whole data frames and for streaming),
+# and a JSON sidecar file describes the output: format, layout, the columns of each modality and any metadata
+# (onsets, sample rate, source paths, ...), so the data can be loaded back without knowing how it was saved.
+
+import os
+import json
+import zipfile
+import numpy as np
+import pandas as pd
+
+OUTPUT_FORMATS = ["csv", "parquet", "npz", "npy"]
+OUTPUT_LAYOUTS = ["separate", "combined"]  # "separate" adds a file per modality to the combined file
+FILE_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "npz": ".npz", "npy": ".npy"}
+SIDECAR_FILE_NAME = "metadata.json"
+NPY_HEADER_LENGTH = 128  # fixed, so the header can be rewritten with the final shape after streaming the data
+NPZ_WRITE_BLOCK_ROWS = 1000000
+
+
+def get_float_dtype(dtype):
+    """
+    :param dtype: a numeric dtype
+    :return: the smallest float dtype that can hold its values and NaN (for padding)
+    """
+    return np.result_type(dtype, np.float32)
+
+
+class CsvWriter:
+    def __init__(self, path, index=False):
+        """
+        :param path: output file path
+        :param index: whether to write the data frame's index as the first column
+        """
+        self.path = path
+        self.index = index
+        self._written = False
+
+    def write(self, df):
+        df.to_csv(self.path, mode="a" if self._written else "w", header=not self._written, index=self.index)
+        self._written = True
+
+    def close(self):
+        if not self._written:
+            open(self.path, "w").close()
+
+
+class ParquetWriter:
+    def __init__(self, path):
+        """
+        :param path: output file path
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Saving to parquet requires pyarrow (pip install pyarrow)")
+        self.path = path
+        self._pyarrow = pyarrow
+        self._writer = None
+        self._dtypes = None
+
+    def write(self, df):
+        if self._writer is None:
+            self._dtypes = {column: get_float_dtype(dtype) for column, dtype in df.dtypes.items()}
+            table = self._pyarrow.Table.from_pandas(df.astype(self._dtypes), preserve_index=False)
+            self._writer = self._pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        else:
+            table = self._pyarrow.Table.from_pandas(df.astype(self._dtypes), preserve_index=False,
+                                                    schema=self._writer.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def get_npy_header(dtype, shape):
+    """
+    :return: the bytes of an npy (version 1.0) header of exactly NPY_HEADER_LENGTH bytes
+    """
+    header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": shape}
+    prefix = np.lib.format.magic(1, 0)
+    text_length = NPY_HEADER_LENGTH - len(prefix) - 2  # 2 bytes for the header length itself
+    text = repr(header).ljust(text_length - 1) + "\n"
+    return prefix + text_length.to_bytes(2, "little") + text.encode("latin1")
+
+
+class NpyWriter:
+    """
+    Writes a 2D array (samples, columns) of a single float dtype, that can be memory-mapped with
+    np.load(path, mmap_mode="r"). The column names are saved in the sidecar file.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: output file path
+        """
+        self.path = path
+        self.columns = None
+        self.dtype = None
+        self.rows_num = 0
+        self._file = None
+
+    def write(self, df):
+        if self._file is None:
+            self.columns = list(df.columns)
+            self.dtype = get_float_dtype(np.result_type(*df.dtypes)) if len(df.columns) else np.dtype(np.float64)
+            self._file = open(self.path, "wb")
+            self._file.write(get_npy_header(self.dtype, (0, len(self.columns))))
+        self._file.write(np.ascontiguousarray(df.to_numpy(dtype=self.dtype)).tobytes())
+        self.rows_num += len(df)
+
+    def close(self):
+        if self._file is None:
+            np.save(self.path, np.empty((0, 0)))
+            return
+        self._file.seek(0)
+        self._file.write(get_npy_header(self.dtype, (self.rows_num, len(self.columns))))
+        self._file.close()
+
+
+class NpzWriter:
+    """
+    Writes a compressed npz file with an array per column.
+    The data is first streamed into a temporary npy file, and compressed column by column when closing.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: output file path
+        """
+        self.path = path
+        self._npy_writer = NpyWriter(path + ".tmp.npy")
+
+    def write(self, df):
+        self._npy_writer.write(df)
+
+    def close(self):
+        self._npy_writer.close()
+        data = np.load(self._npy_writer.path, mmap_mode="r")
+        with zipfile.ZipFile(self.path, "w", compression=zipfile.ZIP_DEFLATED) as npz_file:
+            for column_index, column in enumerate(self._npy_writer.columns or []):
+                with npz_file.open(f"{column}.npy", "w", force_zip64=True) as column_file:
+                    np.lib.format.write_array_header_1_0(column_file, {
+                        "descr": np.lib.format.dtype_to_descr(data.dtype), "fortran_order": False,
+                        "shape": (len(data),)})
+                    for block_start in range(0, len(data), NPZ_WRITE_BLOCK_ROWS):
+                        block = data[block_start:block_start + NPZ_WRITE_BLOCK_ROWS, column_index]
+                        column_file.write(np.ascontiguousarray(block).tobytes())
+        del data
+        os.remove(self._npy_writer.path)
+
+
+def create_writer(path_without_extension, output_format, index=False):
+    """
+    :param path_without_extension: output file path, without the file extension
+    :param output_format: one of OUTPUT_FORMATS
+    :param index: whether to write the index (CSV only)
+    :return: a writer object with write(df) and close() methods
+    """
+    path = path_without_extension + FILE_EXTENSIONS[output_format]
+    if output_format == "csv":
+        return CsvWriter(path, index)
+    if output_format == "parquet":
+        return ParquetWriter(path)
+    if output_format == "npz":
+        return NpzWriter(path)
+    return NpyWriter(path)
+
+
+class SynchronizedDataWriter:
+    """
+    Writes the synchronized data (given in one or more chunks) in the requested format and layout,
+    and its sidecar file.
+    """
+
+    def __init__(self, output_dir, modalities_file_names, combined_file_name, output_format="csv", layout=None,
+                 metadata=None):
+        """
+        :param output_dir: the output directory
+        :param modalities_file_names: dict of modality name -> its file name (without extension) in "separate" layout
+        :param combined_file_name: file name (without extension) for the combined data
+        :param output_format: one of OUTPUT_FORMATS
+        :param layout: one of OUTPUT_LAYOUTS, or None for "separate" in CSV (the original layout, including the
+        index column in each file) and "combined" otherwise
+        :param metadata: dict of anything else to save in the sidecar file (must be JSON serializable)
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        layout = layout or ("separate" if output_format == "csv" else "combined")
+        if layout not in OUTPUT_LAYOUTS:
+            raise ValueError(f"Unknown output layout: {layout}")
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.layout = layout
+        self.metadata = metadata or {}
+        index = output_format == "csv" and layout == "separate"
+        self._combined_file_name = combined_file_name
+        self._combined_writer = create_writer(os.path.join(output_dir, combined_file_name), output_format, index)
+        self._modalities_writers = {}
+        if layout == "separate":
+            self._modalities_writers = {modality: create_writer(os.path.join(output_dir, file_name), output_format,
+                                                                index)
+                                        for modality, file_name in modalities_file_names.items()}
+        self._modalities_file_names = modalities_file_names
+        self._modalities_columns = {}
+        self._combined_columns = None
+        self._rows_num = 0
+
+    def write(self, modalities_chunks, combined_chunk):
+        """
+        :param modalities_chunks: dict of modality name -> its data frame chunk (or None if its data ended)
+        :param combined_chunk: data frame chunk of all the modalities combined
+        """
+        for modality, chunk in modalities_chunks.items():
+            if chunk is None:
+                continue
+            self._modalities_columns.setdefault(modality, [str(column) for column in chunk.columns])
+            if modality in self._modalities_writers:
+                self._modalities_writers[modality].write(chunk)
+        if self._combined_columns is None:
+            self._combined_columns = [str(column) for column in combined_chunk.columns]
+        self._combined_writer.write(combined_chunk)
+        self._rows_num += len(combined_chunk)
+
+    def close(self):
+        for writer in list(self._modalities_writers.values()) + [self._combined_writer]:
+            writer.close()
+        extension = FILE_EXTENSIONS[self.output_format]
+        sidecar = {"format": self.output_format, "layout": self.layout,
+                   "index_column": self.output_format == "csv" and self.layout == "separate",
+                   "rows": self._rows_num, "combined_file": self._combined_file_name + extension,
+                   "modalities_files": {modality: file_name + extension
+                                        for modality, file_name in self._modalities_file_names.items()
+                                        if modality in self._modalities_writers},
+                   "combined_columns": self._combined_columns or [],
+                   "modalities_columns": self._modalities_columns, **self.metadata}
+        with open(os.path.join(self.output_dir, SIDECAR_FILE_NAME), "w") as f:
+            json.dump(sidecar, f, indent=4)
+
+
+def load_synchronized_data(output_dir, modality=None, mmap=True):
+    """
+    :param output_dir: a directory with synchronized data saved by SynchronizedDataWriter
+    :param modality: a modality name (e.g. "eeg"), to get only its columns of the combined data, or None for all
+    :param mmap: whether to memory-map npy files instead of reading them
+    :return: the combined data frame (or its modality columns subset)
+    """
+    with open(os.path.join(output_dir, SIDECAR_FILE_NAME), "r") as f:
+        sidecar = json.load(f)
+    path = os.path.join(output_dir, sidecar["combined_file"])
+    columns = None if modality is None else sidecar["modalities_columns"][modality]
+    if sidecar["format"] == "csv":
+        df = pd.read_csv(path, index_col=0 if sidecar["index_column"] else None)
+    elif sidecar["format"] == "parquet":
+        df = pd.read_parquet(path, columns=columns)
+    elif sidecar["format"] == "npz":
+        with np.load(path) as npz_file:
+            df = pd.DataFrame({column: npz_file[column] for column in (columns or npz_file.files)})
+    else:
+        df = pd.DataFrame(np.load(path, mmap_mode="r" if mmap else None), columns=sidecar["combined_columns"],
+                          copy=False)
+    return df if columns is None else df[columns]
@@ -0,0 +1,182 @@
+# Parameter sweep of the beginning protocol detection, for calibrating its constants over a whole archive.
+# Every session is loaded once, and everything that doesn't depend on the swept parameters is computed once: the EEG
+# epochs' statistics (once per epoch length) and the closed eyes periods with their lengths. Then all the
+# combinations of the parameters are evaluated at once, as broadcast comparisons of these arrays, into a table of
+# the detected events' number and trial onset for every combination. Sessions are swept in parallel.
+
+import os
+import argparse
+import traceback
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from artifact_detection import get_epoch_statistics, get_epochs_num
+from eeg_et_hr_synchronizer import find_all_data_paths, preprocess_eeg_data, preprocess_et_data, \
+    EEG_SAMPLE_RATE, ARTIFACT_ELECTRODE, ARTIFACT_STATISTIC, \
+    ARTIFACT_DIFFERENCE_THRESHOLD, ARTIFACT_EPOCH_LENGTH, SHORT_BLINK_SAMPLES_NUM, EEG_BEGINNING_TIME, \
+    ET_BEGINNING_TIME, ET_COLUMN_FOR_SYNC, EEG_DATA_PARENT_DIR, ET_DATA_PARENT_DIR, HR_DATA_PARENT_DIR, \
+    SYNCHRONIZED_OUTPUT_DIR, RECORDING_IDENTIFIER_PATTERN
+from interval_detection import get_true_intervals, get_nan_mask
+
+EEG_SWEEP_FILE_NAME = "eeg_parameter_sweep.csv"
+ET_SWEEP_FILE_NAME = "et_parameter_sweep.csv"
+
+
+def get_last_events(is_event, ends, beginning_ends):
+    """
+    :param is_event: boolean array of shape (..., events) of whether every candidate event is detected
+    :param ends: array of the candidate events' end timestamps (indices)
+    :param beginning_ends: array of shape (...) of the end timestamp (index) of the beginning protocol, which is the
+    trial onset if no event was detected
+    :return: arrays of shape (...) of the number of detected events and of the trial onset timestamp (the end of the
+    last detected event, like get_trial_onset_timestamps)
+    """
+    events_num = is_event.sum(axis=-1)
+    if not is_event.shape[-1]:
+        return events_num, np.broadcast_to(beginning_ends, events_num.shape).astype(np.int64)
+    last_event = is_event.shape[-1] - 1 - np.argmax(is_event[..., ::-1], axis=-1)
+    return events_num, np.where(events_num > 0, ends[last_event], beginning_ends).astype(np.int64)
+
+
+def sweep_eeg_parameters(eeg_df, thresholds, epoch_lengths, beginning_times):
+    """
+    :param eeg_df: EEG data frame (of at least the longest beginning time)
+    :param thresholds: values of ARTIFACT_DIFFERENCE_THRESHOLD
+    :param epoch_lengths: values of ARTIFACT_EPOCH_LENGTH (seconds)
+    :param beginning_times: values of EEG_BEGINNING_TIME (seconds)
+    :return: data frame with the artifacts number and the EEG trial onset for every combination of the parameters
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    beginning_ends = EEG_SAMPLE_RATE * np.asarray(beginning_times)
+    # an epoch must end before the last sample, so one more sample than the longest beginning is needed
+    data = eeg_df[[ARTIFACT_ELECTRODE]][:int(beginning_ends.max()) + 1].to_numpy()
+    tables = []
+    for epoch_length in epoch_lengths:
+        epoch_samples = int(epoch_length * EEG_SAMPLE_RATE)
+        # the statistics of the epochs don't depend on the beginning time, which only limits the epochs num
+        epoch_values = get_epoch_statistics(data, epoch_samples, max_samples=int(beginning_ends.max()))
+        differences = np.diff(epoch_values[ARTIFACT_STATISTIC][:, 0])  # epoch i + 1 compared to epoch i
+        ends = (np.arange(len(differences)) + 2) * epoch_samples
+        epochs_nums = np.array([get_epochs_num(len(data), epoch_samples, max_samples=int(beginning_end))
+                                for beginning_end in beginning_ends])
+        # (beginning times, epochs): the epoch was searched and ended within the beginning protocol
+        is_in_beginning = ((np.arange(len(differences)) + 1 < epochs_nums[:, None]) &
+                           (ends <= beginning_ends[:, None]))
+        # (thresholds, beginning times, epochs)
+        is_artifact = (differences > thresholds[:, None, None]) & is_in_beginning
+        events_num, onsets = get_last_events(is_artifact, ends, beginning_ends)
+        grid = np.meshgrid(thresholds, beginning_times, indexing="ij")
+        tables.append(pd.DataFrame({"artifact_difference_threshold": grid[0].ravel(),
+                                    "artifact_epoch_length": epoch_length, "eeg_beginning_time": grid[1].ravel(),
+                                    "events_num": events_num.ravel(), "eeg_trial_onset_timestamp": onsets.ravel()}))
+    return pd.concat(tables, ignore_index=True)
+
+
+def sweep_et_parameters(et_df, short_blink_samples_nums, beginning_times):
+    """
+    :param et_df: ET data frame (or UpsampledETData)
+    :param short_blink_samples_nums: values of SHORT_BLINK_SAMPLES_NUM
+    :param beginning_times: values of ET_BEGINNING_TIME (seconds)
+    :return: data frame with the closed eyes periods number and the ET trial onset for every combination of the
+    parameters
+    """
+    short_blink_samples_nums = np.asarray(short_blink_samples_nums)
+    beginning_ends = EEG_SAMPLE_RATE * np.asarray(beginning_times)
+    # all the closed eyes periods (see get_closed_eyes_timestamps), and only their minimal length is swept
+    intervals = get_true_intervals(get_nan_mask(et_df, [ET_COLUMN_FOR_SYNC]), drop_leading=True, drop_trailing=True)
+    lengths, ends = intervals[:, 1] - intervals[:, 0], intervals[:, 1]
+    # (short blink samples nums, beginning times, periods)
+    is_closed_eyes = ((lengths > short_blink_samples_nums[:, None, None]) &
+                      (ends <= beginning_ends[None, :, None]))
+    events_num, onsets = get_last_events(is_closed_eyes, ends, beginning_ends)
+    grid = np.meshgrid(short_blink_samples_nums, beginning_times, indexing="ij")
+    return pd.DataFrame({"short_blink_samples_num": grid[0].ravel(), "et_beginning_time": grid[1].ravel(),
+                         "events_num": events_num.ravel(), "et_trial_onset_timestamp": onsets.ravel()})
+
+
+def sweep_session(identifier, eeg_data_path, et_data_path, parameters):
+    """
+    :param identifier: the recording identifier
+    :param eeg_data_path: path to the EEG data file
+    :param et_data_path: path to the ET data file
+    :param parameters: dict of the swept values of every parameter (see sweep_all_recordings)
+    :return: the EEG and the ET sweep data frames of the session
+    """
+    eeg_df = preprocess_eeg_data(eeg_data_path, nrows=EEG_SAMPLE_RATE * max(parameters["eeg_beginning_times"]) + 1)
+    et_df = preprocess_et_data(et_data_path, lazy=True)
+    eeg_sweep = sweep_eeg_parameters(eeg_df, parameters["thresholds"], parameters["epoch_lengths"],
+                                     parameters["eeg_beginning_times"])
+    et_sweep = sweep_et_parameters(et_df, parameters["short_blink_samples_nums"], parameters["et_beginning_times"])
+    eeg_sweep.insert(0, "identifier", identifier)
+    et_sweep.insert(0, "identifier", identifier)
+    return eeg_sweep, et_sweep
+
+
+def sweep_all_recordings(parameters, eeg_data_parent_dir=EEG_DATA_PARENT_DIR, et_data_parent_dir=ET_DATA_PARENT_DIR,
+                         output_dir=SYNCHRONIZED_OUTPUT_DIR, workers=None, pattern=RECORDING_IDENTIFIER_PATTERN):
+    """
+    Sweeps the parameters over all the recordings in the data directories, in parallel.
+    :param parameters: dict of the swept values of every parameter: "thresholds", "epoch_lengths",
+    "eeg_beginning_times", "short_blink_samples_nums" and "et_beginning_times"
+    :param output_dir: the directory to save the sweep tables in
+    :param workers: maximal number of processes (or None for the number of CPUs)
+    :param pattern: regular expression of the recording identifier in the files' names
+    :return: the EEG and the ET sweep data frames of all the recordings (also saved in output_dir)
+    """
+    all_data_paths = find_all_data_paths(eeg_data_parent_dir, et_data_parent_dir, HR_DATA_PARENT_DIR, pattern)
+    eeg_sweeps, et_sweeps = [], []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(sweep_session, identifier, eeg_data_path, et_data_path, parameters): identifier
+                   for identifier, (eeg_data_path, et_data_path, _) in all_data_paths.items()}
+        for future in as_completed(futures):
+            try:
+                eeg_sweep, et_sweep = future.result()
+            except Exception:
+                print(f"{futures[future]}: failed\n{traceback.format_exc()}")
+                continue
+            eeg_sweeps.append(eeg_sweep)
+            et_sweeps.append(et_sweep)
+    if not eeg_sweeps:
+        raise ValueError("No recording could be swept")
+    eeg_sweep = pd.concat(eeg_sweeps, ignore_index=True).sort_values("identifier", kind="stable", ignore_index=True)
+    et_sweep = pd.concat(et_sweeps, ignore_index=True).sort_values("identifier", kind="stable", ignore_index=True)
+    os.makedirs(output_dir, exist_ok=True)
+    eeg_sweep.to_csv(os.path.join(output_dir, EEG_SWEEP_FILE_NAME), index=False)
+    et_sweep.to_csv(os.path.join(output_dir, ET_SWEEP_FILE_NAME), index=False)
+    return eeg_sweep, et_sweep
+
+
+def main():
+    """
+    Main code to run for sweeping the beginning protocol detection parameters over all the recordings.
+    """
+    parser = argparse.ArgumentParser(description="Sweeps the beginning protocol detection parameters over all the "
+                                                 "recordings in the data directories")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[ARTIFACT_DIFFERENCE_THRESHOLD],
+                        help="values of ARTIFACT_DIFFERENCE_THRESHOLD")
+    parser.add_argument("--epoch-lengths", type=float, nargs="+", default=[ARTIFACT_EPOCH_LENGTH],
+                        help="values of ARTIFACT_EPOCH_LENGTH (seconds)")
+    parser.add_argument("--eeg-beginning-times", type=int, nargs="+", default=[EEG_BEGINNING_TIME],
+                        help="values of EEG_BEGINNING_TIME (seconds)")
+    parser.add_argument("--short-blink-samples-nums", type=int, nargs="+", default=[SHORT_BLINK_SAMPLES_NUM],
+                        help="values of SHORT_BLINK_SAMPLES_NUM")
+    parser.add_argument("--et-beginning-times", type=int, nargs="+", default=[ET_BEGINNING_TIME],
+                        help="values of ET_BEGINNING_TIME (seconds)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of processes (default: CPUs num)")
+    parser.add_argument("--eeg-dir", default=EEG_DATA_PARENT_DIR)
+    parser.add_argument("--et-dir", default=ET_DATA_PARENT_DIR)
+    parser.add_argument("--output-dir", default=SYNCHRONIZED_OUTPUT_DIR)
+    parser.add_argument("--pattern", default=RECORDING_IDENTIFIER_PATTERN,
+                        help="regular expression of the recording identifier in the files' names")
+    args = parser.parse_args()
+    parameters = {"thresholds": args.thresholds, "epoch_lengths": args.epoch_lengths,
+                  "eeg_beginning_times": args.eeg_beginning_times,
+                  "short_blink_samples_nums": args.short_blink_samples_nums,
+                  "et_beginning_times": args.et_beginning_times}
+    eeg_sweep, et_sweep = sweep_all_recordings(parameters, args.eeg_dir, args.et_dir, args.output_dir, args.workers,
+                                               args.pattern)
+    print(f"{len(eeg_sweep)} EEG and {len(et_sweep)} ET parameter combinations were saved in {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# A persistent index of the recording files in the data directories.
+# Each directory's listing (with the files' modification times) is cached on disk, and is only scanned again when
+# the directory's own modification time changes (a file was added, removed or renamed), so finding the recording of
+# an identifier doesn't list the directory each time. The files that match a search are kept from the newest to the
+# oldest by their modification times in the scan, so only the newest one is stat'ed to check it still exists (falling
+# back to the next one if it was removed since the scan). A file that is written in place doesn't change its
+# directory's modification time, so an older file that is modified after the scan is only found once the directory
+# itself changes.
+
+import os
+import re
+import json
+import time
+from file_utils import CACHE_ROOT, atomic_write
+
+RECORDING_INDEX_PATH = os.path.join(CACHE_ROOT, "recording_index.json")
+RECORDING_IDENTIFIER_PATTERN = r"\d[\d_-]*\d"  # the recording time in the files' names, shared by all the modalities
+RACY_MTIME_SECONDS = 2  # a directory modified this close to its scan may change again within the same mtime
+
+
+def get_recording_identifier(file_name, pattern=RECORDING_IDENTIFIER_PATTERN):
+    """
+    :param file_name: name of a data file
+    :param pattern: regular expression of the identifier part of the name
+    :return: the recording identifier in the file's name (or the whole name without its extension, if not found)
+    """
+    name = os.path.splitext(os.path.basename(file_name))[0]
+    match = re.search(pattern, name)
+    return match.group() if match else name
+
+
+class RecordingIndex:
+    def __init__(self, index_path=RECORDING_INDEX_PATH, pattern=RECORDING_IDENTIFIER_PATTERN):
+        """
+        :param index_path: path of the index file (or None to keep the index only in memory)
+        :param pattern: regular expression of the recording identifier in the files' names
+        """
+        self.index_path = index_path
+        self.pattern = pattern
+        self._dirs = {}  # dir path -> {"mtime_ns", "racy", "files": [[name, mtime], ...] from newest to oldest}
+        self._identifiers = {}  # dir path -> {identifier -> [names from newest to oldest]}
+        self._matches = {}  # dir path -> {(type, name identifier) -> [names from newest to oldest]}
+        if index_path and os.path.isfile(index_path):
+            try:
+                with open(index_path, "r") as f:
+                    index = json.load(f)
+                if index.get("pattern") == pattern:
+                    self._dirs = index["dirs"]
+            except (OSError, ValueError, KeyError):
+                self._dirs = {}  # a corrupted index is just rebuilt
+
+    def _scan(self, dir, dir_mtime_ns):
+        files = []
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    files.append([entry.name, entry.stat().st_mtime])
+        files.sort(key=lambda file: file[1], reverse=True)
+        racy = time.time() - dir_mtime_ns / 1e9 < RACY_MTIME_SECONDS
+        self._dirs[dir] = {"mtime_ns": dir_mtime_ns, "racy": racy, "files": files}
+        self._identifiers.pop(dir, None)
+        self._matches.pop(dir, None)
+        self.save()
+
+    def get_files(self, dir):
+        """
+        :param dir: directory path
+        :return: list of [file name, modification time] of the files in dir, from the newest to the oldest
+        """
+        if not os.path.isdir(dir):
+            raise ValueError(f"The following is not a directory path: {dir}")
+        dir = os.path.abspath(dir)
+        dir_mtime_ns = os.stat(dir).st_mtime_ns
+        cached = self._dirs.get(dir)
+        if cached is None or cached["mtime_ns"] != dir_mtime_ns or cached["racy"]:
+            self._scan(dir, dir_mtime_ns)
+        return self._dirs[dir]["files"]
+
+    @staticmethod
+    def _get_first_existing(dir, names):
+        """
+        :param dir: directory path
+        :param names: names of files in dir, from the newest to the oldest
+        :return: path of the newest file that still exists, or None if none of them exists
+        """
+        for name in names:
+            path = os.path.join(dir, name)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def get_most_recent(self, dir, type=None, name_identifier=None):
+        """
+        :param dir: directory path
+        :param type: specific file type to look for (or all if None)
+        :param name_identifier: specific substring to look for in file's name (or all if None)
+        :return: path of the most recently modified file in dir that matches (see the module's comment), or None if
+        there is none
+        """
+        files = self.get_files(dir)
+        dir = os.path.abspath(dir)
+        matches = self._matches.setdefault(dir, {})
+        if (type, name_identifier) not in matches:
+            matches[(type, name_identifier)] = [
+                name for name, _ in files
+                if not (type and not name.endswith(type)) and not (name_identifier and name_identifier not in name)]
+        return self._get_first_existing(dir, matches[(type, name_identifier)])
+
+    def find_by_identifier(self, dir, identifier, type=None):
+        """
+        :param dir: directory path
+        :param identifier: recording identifier (see get_recording_identifier)
+        :param type: specific file type to look for (or all if None)
+        :return: path of the most recently modified file in dir with this exact identifier, or None if there is none
+        """
+        files = self.get_files(dir)
+        dir = os.path.abspath(dir)
+        if dir not in self._identifiers:
+            identifiers = {}
+            for name, _ in files:
+                identifiers.setdefault(get_recording_identifier(name, self.pattern), []).append(name)
+            self._identifiers[dir] = identifiers
+        return self._get_first_existing(dir, [name for name in self._identifiers[dir].get(identifier, [])
+                                              if not type or name.endswith(type)])
+
+    def save(self):
+        """
+        Saves the index file (see atomic_write)
+        """
+        if not self.index_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            atomic_write(self.index_path, lambda f: json.dump({"pattern": self.pattern, "dirs": self._dirs}, f), "w")
+        except OSError:
+            pass  # without an index file the directories are just scanned again by the next process
+
+
+_recording_index = None
+
+
+def get_recording_index():
+    """
+    :return: the shared recording index of this process
+    """
+    global _recording_index
+    if _recording_index is None:
+        _recording_index = RecordingIndex(RECORDING_INDEX_PATH)
+    return _recording_index
@@ -0,0 +1,364 @@
+# ET is Eye Tracker
+# Resampling of the ET data onto the EEG sample grid.
+# Instead of assuming the tracker ran at exactly its nominal rate, every EEG-rate grid point is mapped to the ET
+# samples around it by the ET's own timestamps, so dropped frames and jitter don't shift the rest of the recording.
+# Other timestamped data on the same clock (e.g. HR) is resampled onto the same grid, by giving it the ET's grid
+# origin, so a single EEG-rate index refers to the same time in all of them.
+
+import numpy as np
+import pandas as pd
+
+ET_TIME_COLUMN = "time_ms"
+RESAMPLING_METHODS = ["repeat", "hold", "linear", "nearest"]
+TIMESTAMP_TOLERANCE_MS = 1e-3  # grid points closer than this to an ET timestamp are considered to have reached it
+
+
+def get_resampling_grid(times, target_rate, source_rate):
+    """
+    :param times: sorted ET timestamps (in ms)
+    :param target_rate: the sample rate to resample to (Hz)
+    :param source_rate: the nominal sample rate of the timestamps (Hz)
+    :return: timestamps (in ms) of the target rate grid, from the first sample until the nominal end of the last one
+    """
+    if len(times) == 0:
+        return np.empty(0)
+    span = times[-1] - times[0] + 1000 / source_rate  # the last sample lasts one nominal period
+    samples_num = int(np.ceil(span * target_rate / 1000 - TIMESTAMP_TOLERANCE_MS))
+    return times[0] + np.arange(samples_num) * (1000 / target_rate)
+
+
+def get_resampling_indices(times, grid, method="hold"):
+    """
+    :param times: sorted source timestamps (in ms)
+    :param grid: target timestamps (in ms)
+    :param method: "hold" (last sample at or before each grid point), "nearest" or "linear"
+    :return: array of source indices for every grid point, and for "linear" also the weight of the next
+    source sample (None otherwise)
+    """
+    if method not in ["hold", "linear", "nearest"]:
+        raise ValueError(f"Unknown resampling method: {method}")
+    last_index = len(times) - 1
+    indices = np.searchsorted(times, grid + TIMESTAMP_TOLERANCE_MS, side="right") - 1
+    np.clip(indices, 0, last_index, out=indices)
+    if method == "hold":
+        return indices, None
+    next_indices = np.minimum(indices + 1, last_index)
+    time_since = grid - times[indices]
+    time_until = times[next_indices] - grid
+    if method == "nearest":
+        return np.where(time_until < time_since, next_indices, indices), None
+    durations = times[next_indices] - times[indices]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = np.where(durations > 0, time_since / durations, 0)
+    np.clip(weights, 0, 1, out=weights)
+    return indices, weights
+
+
+def apply_resampling_indices(values, indices, weights=None):
+    """
+    :param values: 1D array of source values
+    :param indices: source index for every target sample (see get_resampling_indices)
+    :param weights: weights of the next source sample for linear interpolation (or None)
+    :return: the resampled values
+    """
+    if weights is None:
+        return values[indices]
+    current = values[indices]
+    following = values[np.minimum(indices + 1, len(values) - 1)]
+    # exact hits keep their value even when the next sample is NaN
+    return np.where(weights == 0, current, current + (following - current) * weights)
+
+
+def get_dropped_frames_mask(times, grid, indices, weights, max_hold_ms):
+    """
+    :param times: sorted source timestamps (in ms)
+    :param grid: target timestamps (in ms)
+    :param indices: source index for every target sample (see get_resampling_indices)
+    :param weights: weights of the next source sample for linear interpolation (or None)
+    :param max_hold_ms: maximal distance (in ms) of a target sample from the source samples it is based on
+    :return: boolean array of the target samples that are inside dropped frames
+    """
+    stale = np.abs(grid - times[indices]) > max_hold_ms
+    if weights is not None:  # interpolating into a gap is as bad as holding through it
+        gaps = times[np.minimum(indices + 1, len(times) - 1)] - times[indices]
+        stale |= (weights > 0) & (gaps > max_hold_ms)
+    return stale
+
+
+def resample_values(values, indices, weights=None, stale=None):
+    """
+    :param values: 1D array of source values
+    :param indices: source index for every target sample (see get_resampling_indices)
+    :param weights: weights of the next source sample for linear interpolation (or None)
+    :param stale: boolean array of target samples to set to NaN (see get_dropped_frames_mask), or None
+    :return: the resampled values
+    """
+    resampled = apply_resampling_indices(values, indices, weights)
+    if stale is not None and stale.any():
+        resampled = np.where(stale, np.nan, resampled)
+    return resampled
+
+
+class UpsampledETData:
+    """
+    ET data that is kept at its native rate, but is accessed as if it was resampled to the EEG rate.
+    The EEG-rate -> native index mapping is computed only for the samples that are actually accessed,
+    so slicing is free (the new object shares the native arrays) and columns are resampled on access.
+    """
+
+    def __init__(self, columns, times, target_rate, source_rate, method="hold", max_hold_ms=None,
+                 start=0, stop=None, time_origin=None):
+        """
+        :param columns: dict of column name -> native rate values (sorted by time)
+        :param times: sorted native timestamps (in ms), or None for the "repeat" method
+        :param target_rate: the EEG sample rate (Hz)
+        :param source_rate: the nominal ET sample rate (Hz)
+        :param method: one of RESAMPLING_METHODS
+        :param max_hold_ms: see resample_et_to_eeg_rate
+        :param start: first EEG-rate index this object refers to
+        :param stop: end EEG-rate index this object refers to (or None for the end of the data)
+        :param time_origin: the time (in ms) of EEG-rate index 0, e.g. another UpsampledETData's time_origin to
+        share its grid (the first timestamp if None)
+        """
+        if method not in RESAMPLING_METHODS:
+            raise ValueError(f"Unknown resampling method: {method}")
+        if method == "repeat" and target_rate % source_rate != 0:
+            raise ValueError(f"Can't repeat rows to resample from {source_rate} Hz to {target_rate} Hz")
+        self._columns = columns
+        self._times = times
+        self.time_origin = time_origin
+        if time_origin is None and method != "repeat" and len(times):
+            self.time_origin = times[0]
+        self.target_rate = target_rate
+        self.source_rate = source_rate
+        self.method = method
+        self.max_hold_ms = max_hold_ms
+        full_length = self._get_full_length()
+        self.start = min(start, full_length)
+        self.stop = full_length if stop is None else max(self.start, min(stop, full_length))
+
+    @classmethod
+    def from_data_frame(cls, et_df, target_rate, source_rate, method="hold", max_hold_ms=None, dtype=None,
+                        time_origin=None):
+        """
+        :param et_df: raw ET data frame
+        :param dtype: if given, the native values are stored with this dtype (e.g. np.float32)
+        :param time_origin: see __init__
+        :return: an UpsampledETData of the whole recording (see resample_et_to_eeg_rate for the other parameters)
+        """
+        if ET_TIME_COLUMN not in et_df.columns:
+            method = "repeat"
+        times = order = None
+        if method != "repeat":
+            times = et_df[ET_TIME_COLUMN].to_numpy(dtype=np.float64)
+            if np.any(np.diff(times) < 0):  # out of order samples, caused by jitter in the tracker's clock
+                order = np.argsort(times, kind="stable")
+                times = times[order]
+        columns = {}
+        for column in et_df.columns.drop(ET_TIME_COLUMN, errors="ignore"):
+            values = et_df[column].to_numpy(dtype=dtype)
+            columns[column] = values[order] if order is not None else values
+        return cls(columns, times, target_rate, source_rate, method, max_hold_ms, time_origin=time_origin)
+
+    def _get_full_length(self):
+        native_length = len(next(iter(self._columns.values()))) if self._columns else 0
+        if self.method == "repeat" or native_length == 0:
+            return native_length * (self.target_rate // self.source_rate if self.method == "repeat" else 1)
+        return len(get_resampling_grid(np.array([self.time_origin, self._times[-1]]), self.target_rate,
+                                       self.source_rate))
+
+    @property
+    def columns(self):
+        return pd.Index(list(self._columns))
+
+    @property
+    def nbytes(self):
+        """
+        :return: the memory used by the native arrays (which is all the memory this object holds)
+        """
+        arrays = list(self._columns.values()) + ([self._times] if self._times is not None else [])
+        return sum(array.nbytes for array in arrays)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, key):
+        """
+        :param key: a slice of EEG-rate indices (returns a view), a column name (returns a Series)
+        or a list of column names (returns a data frame)
+        """
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("Only contiguous slices of the ET data are supported")
+            return UpsampledETData(self._columns, self._times, self.target_rate, self.source_rate, self.method,
+                                   self.max_hold_ms, self.start + start, self.start + stop, self.time_origin)
+        if isinstance(key, str):
+            return pd.Series(self._resample_column(key), index=pd.RangeIndex(self.start, self.stop), name=key)
+        return self.to_frame(key)
+
+    def get_native_indices(self, start=None, stop=None):
+        """
+        :param start: first EEG-rate index (relative to this object, 0 by default)
+        :param stop: end EEG-rate index (relative to this object, its length by default)
+        :return: the native sample index of every EEG-rate sample in the range, the weights of the following native
+        samples for the "linear" method (or None), and a mask of samples inside dropped frames (or None)
+        """
+        return self.get_native_indices_at(np.arange(0 if start is None else start,
+                                                    len(self) if stop is None else stop))
+
+    def get_native_indices_at(self, positions):
+        """
+        :param positions: array of EEG-rate indices (relative to this object), e.g. an alignment index map
+        :return: same as get_native_indices, for these samples
+        """
+        positions = self.start + np.asarray(positions)
+        if self.method == "repeat":
+            return positions // (self.target_rate // self.source_rate), None, None
+        grid = self.time_origin + positions * (1000 / self.target_rate)
+        indices, weights = get_resampling_indices(self._times, grid, self.method)
+        stale = None
+        if self.max_hold_ms is not None:
+            stale = get_dropped_frames_mask(self._times, grid, indices, weights, self.max_hold_ms)
+        return indices, weights, stale
+
+    def take(self, positions):
+        """
+        :param positions: array of EEG-rate indices (relative to this object), e.g. an alignment index map
+        :return: data frame of the resampled data at these indices (NaN for indices outside the data),
+        computed in one pass straight from the native data
+        """
+        positions = np.asarray(positions)
+        inside = (positions >= 0) & (positions < len(self))
+        native_indices = self.get_native_indices_at(np.where(inside, positions, 0))
+        return pd.DataFrame({column: np.where(inside, self._resample_column(column, native_indices), np.nan)
+                             for column in self._columns}, index=self.start + positions)
+
+    def _resample_column(self, column, native_indices=None):
+        return resample_values(self._columns[column], *(native_indices or self.get_native_indices()))
+
+    def to_frame(self, columns=None):
+        """
+        :param columns: columns to include (all by default)
+        :return: the resampled data as a data frame, indexed by the EEG-rate indices
+        """
+        columns = list(self._columns) if columns is None else columns
+        native_indices = self.get_native_indices()  # shared by all the columns
+        return pd.DataFrame({column: self._resample_column(column, native_indices) for column in columns},
+                            index=pd.RangeIndex(self.start, self.stop))
+
+
+def as_data_frame(et_data):
+    """
+    :param et_data: ET data frame or UpsampledETData
+    :return: the data as a data frame
+    """
+    return et_data.to_frame() if isinstance(et_data, UpsampledETData) else et_data
+
+
+def take_samples(et_data, positions):
+    """
+    :param et_data: ET data frame or UpsampledETData
+    :param positions: array of indices (relative to the start of et_data)
+    :return: data frame of the samples at these indices (NaN for indices outside the data)
+    """
+    if isinstance(et_data, UpsampledETData):
+        return et_data.take(positions)
+    positions = np.asarray(positions)
+    inside = (positions >= 0) & (positions < len(et_data))
+    if not inside.any():
+        return pd.DataFrame(np.nan, index=positions, columns=et_data.columns)
+    samples = et_data.iloc[np.where(inside, positions, 0)].where(inside[:, None])
+    return samples.set_axis(et_data.index[0] + positions)
+
+
+def resample_et_to_eeg_rate(et_df, target_rate, source_rate, method="hold", max_hold_ms=None):
+    """
+    Resamples the ET data onto the EEG sample grid, and removes the original timestamp column.
+    :param et_df: raw ET data frame
+    :param target_rate: the EEG sample rate (Hz)
+    :param source_rate: the nominal ET sample rate (Hz)
+    :param method: one of RESAMPLING_METHODS. "repeat" duplicates each row target_rate / source_rate times,
+    ignoring the timestamps (also used when there is no timestamp column)
+    :param max_hold_ms: if given, grid points further than this from their source sample (inside dropped frames)
+    are set to NaN
+    :return: data frame of the resampled ET data
+    """
+    return UpsampledETData.from_data_frame(et_df, target_rate, source_rate, method, max_hold_ms).to_frame()
+
+
+class StreamingETResampler:
+    """
+    Resamples ET data that arrives in consecutive chunks (of a file that is too big to be read at once, or that is
+    still being written), with the same results as resample_et_to_eeg_rate on the whole data.
+    A grid point is only resampled once the ET sample after it has arrived, so only the last sample is kept
+    between chunks.
+    """
+
+    def __init__(self, target_rate, source_rate, method="hold", max_hold_ms=None, dtype=None):
+        """
+        See resample_et_to_eeg_rate and UpsampledETData.from_data_frame for the parameters
+        """
+        if method not in RESAMPLING_METHODS:
+            raise ValueError(f"Unknown resampling method: {method}")
+        if method == "repeat" and target_rate % source_rate != 0:
+            raise ValueError(f"Can't repeat rows to resample from {source_rate} Hz to {target_rate} Hz")
+        self.target_rate = target_rate
+        self.source_rate = source_rate
+        self.method = method
+        self.max_hold_ms = max_hold_ms
+        self.dtype = dtype
+        self.samples_num = 0  # number of resampled samples returned so far
+        self._first_time = None
+        self._last_chunk = None  # the last ET sample received, as a data frame
+
+    def _resample_until(self, chunk, end_index):
+        times = chunk[ET_TIME_COLUMN].to_numpy(dtype=np.float64)
+        grid = self._first_time + np.arange(self.samples_num, end_index) * (1000 / self.target_rate)
+        indices, weights = get_resampling_indices(times, grid, self.method)
+        stale = None
+        if self.max_hold_ms is not None:
+            stale = get_dropped_frames_mask(times, grid, indices, weights, self.max_hold_ms)
+        resampled = pd.DataFrame({column: resample_values(chunk[column].to_numpy(dtype=self.dtype),
+                                                          indices, weights, stale)
+                                  for column in chunk.columns.drop(ET_TIME_COLUMN)},
+                                 index=pd.RangeIndex(self.samples_num, max(self.samples_num, end_index)))
+        self.samples_num = max(self.samples_num, end_index)
+        return resampled
+
+    def feed(self, et_chunk):
+        """
+        :param et_chunk: raw ET data frame with the next samples
+        :return: data frame of the newly resampled ET data (indexed by the EEG-rate indices)
+        """
+        if self.method == "repeat" or ET_TIME_COLUMN not in et_chunk.columns:
+            self.method = "repeat"
+            ratio = self.target_rate // self.source_rate
+            resampled = pd.DataFrame({column: np.repeat(et_chunk[column].to_numpy(dtype=self.dtype), ratio)
+                                      for column in et_chunk.columns.drop(ET_TIME_COLUMN, errors="ignore")},
+                                     index=pd.RangeIndex(self.samples_num, self.samples_num + len(et_chunk) * ratio))
+            self.samples_num += len(resampled)
+            return resampled
+        if self._last_chunk is not None:
+            et_chunk = pd.concat([self._last_chunk, et_chunk], ignore_index=True)
+        et_chunk = et_chunk.sort_values(ET_TIME_COLUMN, kind="stable", ignore_index=True)
+        if not len(et_chunk):
+            return et_chunk.drop(ET_TIME_COLUMN, axis=1)
+        times = et_chunk[ET_TIME_COLUMN].to_numpy(dtype=np.float64)
+        if self._first_time is None:
+            self._first_time = times[0]
+        # grid points before the last sample (they can't be affected by samples that didn't arrive yet)
+        end_index = int(np.ceil((times[-1] - TIMESTAMP_TOLERANCE_MS - self._first_time) * self.target_rate / 1000))
+        self._last_chunk = et_chunk.iloc[-1:]
+        return self._resample_until(et_chunk, end_index)
+
+    def flush(self):
+        """
+        :return: data frame of the resampled ET data until the nominal end of the last sample
+        """
+        if self._last_chunk is None:
+            return pd.DataFrame()
+        last_time = self._last_chunk[ET_TIME_COLUMN].iloc[0]
+        end_index = len(get_resampling_grid(np.array([self._first_time, last_time]),
+                                            self.target_rate, self.source_rate))
+        return self._resample_until(self._last_chunk, end_index)
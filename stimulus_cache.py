@@ -0,0 +1,112 @@
+# A cache of the decoded stimuli images, already resized to their size on the screen.
+# RSVP lists repeat the same stimuli many times, within a session and across sessions, so every image is decoded and
+# resized once: the results are kept in memory (with a least recently used eviction, bounded by their total size),
+# and optionally also saved in a directory, keyed by the source image's path and modification time, so other
+# processes and later runs load the small resized file instead of decoding the original. The files of an image's
+# previous modification times are deleted when it is saved again, so the directory doesn't grow with stale files.
+
+import os
+import glob
+import hashlib
+from collections import OrderedDict
+from PIL import Image
+from file_utils import CACHE_ROOT, atomic_write
+
+STIMULUS_CACHE_DIR = os.path.join(CACHE_ROOT, "stimuli")
+STIMULUS_CACHE_MAX_BYTES = 256 * 1024 * 1024  # of decoded images kept in memory
+
+
+def get_image_nbytes(image):
+    """
+    :param image: an image object
+    :return: the (approximate) memory size of its decoded pixels
+    """
+    return image.width * image.height * len(image.getbands())
+
+
+class StimulusCache:
+    def __init__(self, size, max_bytes=STIMULUS_CACHE_MAX_BYTES, cache_dir=None):
+        """
+        :param size: (width, height) to resize the images to
+        :param max_bytes: maximal total size of the decoded images kept in memory
+        :param cache_dir: directory for the resized images files (or None to keep them only in memory)
+        """
+        self.size = tuple(int(length) for length in size)
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()  # image path -> (modification time, resized image), from oldest to newest used
+
+    def _get_cache_file_prefix(self, image_path):
+        key = f"{os.path.abspath(image_path)}:{self.size[0]}x{self.size[1]}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest())
+
+    def _get_cache_file_path(self, image_path, mtime_ns):
+        return f"{self._get_cache_file_prefix(image_path)}_{mtime_ns}.png"
+
+    def _remove_stale_files(self, image_path, mtime_ns):
+        cache_file_path = self._get_cache_file_path(image_path, mtime_ns)
+        for stale_path in glob.glob(f"{glob.escape(self._get_cache_file_prefix(image_path))}_*.png"):
+            if stale_path != cache_file_path:
+                try:
+                    os.remove(stale_path)
+                except OSError:
+                    pass  # already removed by another process
+
+    def _load(self, image_path, mtime_ns):
+        cache_file_path = self._get_cache_file_path(image_path, mtime_ns) if self.cache_dir else None
+        if cache_file_path and os.path.isfile(cache_file_path):
+            try:
+                image = Image.open(cache_file_path)
+                image.load()  # also closes the file
+                return image
+            except OSError:
+                pass  # a corrupted file is just created again
+        with Image.open(image_path) as image:
+            image = image.resize(self.size)
+        if cache_file_path:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                atomic_write(cache_file_path, lambda f: image.save(f, format="PNG"))
+                self._remove_stale_files(image_path, mtime_ns)
+            except OSError:
+                pass  # the image is still kept in memory, and is just resized again by other processes
+        return image
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self._images) > 1:
+            _, (_, image) = self._images.popitem(last=False)
+            self.nbytes -= get_image_nbytes(image)
+
+    def get(self, image_path):
+        """
+        :param image_path: path to a stimulus image
+        :return: the resized image, shared with the cache (must not be modified, see get_copy)
+        """
+        mtime_ns = os.stat(image_path).st_mtime_ns
+        cached = self._images.get(image_path)
+        if cached is not None and cached[0] == mtime_ns:
+            self._images.move_to_end(image_path)
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        if cached is not None:  # the image file was changed
+            self.nbytes -= get_image_nbytes(self._images.pop(image_path)[1])
+        image = self._load(image_path, mtime_ns)
+        self._images[image_path] = (mtime_ns, image)
+        self.nbytes += get_image_nbytes(image)
+        self._evict()
+        return image
+
+    def get_copy(self, image_path):
+        """
+        :param image_path: path to a stimulus image
+        :return: a copy of the resized image, that can be drawn on
+        """
+        return self.get(image_path).copy()
+
+    def clear(self):
+        self._images.clear()
+        self.nbytes = 0
@@ -0,0 +1,230 @@
+# Synthetic recordings, in the same files layout as the real ones, for testing and benchmarking without real data.
+# A session has an EEG file (the EEG_ELECTRODES columns) and an ET file (time_ms and the eyes' gaze coordinates), with
+# the events the pipeline looks for: F3 artifacts of the beginning protocol presses, closed eyes periods at the same
+# times (or a left eye wink until the trial onsets, as in the lemons demo), short blinks, and TRG lemon pulses.
+# The files are written in chunks, so sessions of hours are generated with a bounded memory.
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from PIL import Image
+from alignment import get_event_train
+from eeg_et_hr_synchronizer import EEG_SAMPLE_RATE, ET_SAMPLE_RATE, EEG_ELECTRODES, ARTIFACT_ELECTRODE, \
+    ET_BEGINNING_TIME
+from resampling import ET_TIME_COLUMN
+
+SYNTHETIC_PROTOCOLS = ["closed_eyes", "wink"]  # closing both eyes at every press, or winking until the trial onsets
+SYNTHETIC_IDENTIFIER = "20000101_0000"  # the recording identifier in the files' names
+SYNTHETIC_ET_START_TIME_MS = 946684800000  # the ET clock's time of the first ET sample
+SYNTHETIC_ET_LEAD_TIME = 3  # seconds the ET recording started before the EEG recording
+SYNTHETIC_PRESS_TIMES = [1, 3, 5]  # seconds from the EEG recording's start (all within EEG_BEGINNING_TIME)
+SYNTHETIC_PRESS_TIME = 0.3  # seconds
+SYNTHETIC_PRESS_AMPLITUDE = 300  # added to the artifact electrode during a press
+SYNTHETIC_CLOSED_EYES_TIME = 0.5  # seconds from every press (so they end with its artifact epoch)
+SYNTHETIC_WINK_TIME = 3  # seconds of winking before the trial onsets
+SYNTHETIC_TRIAL_ONSET_TIME = 10  # seconds from the EEG recording's start to the first lemon
+SYNTHETIC_LEMON_TIME = 0.2  # seconds a lemon is shown (the trigger is 0)
+SYNTHETIC_LEMON_GAP_TIME = 0.1  # seconds between lemons (the trigger is 1)
+SYNTHETIC_BLINKS_PER_MINUTE = 15  # after the trial onsets and the ET beginning protocol
+SYNTHETIC_BLINK_TIME = 0.15  # seconds
+SYNTHETIC_DROPOUT_PROBABILITY = 0.002  # of a single lost ET sample (shorter than a short blink)
+SYNTHETIC_FIXATION_TIME = 0.3  # seconds of an average fixation
+SYNTHETIC_EEG_NOISE = 10  # standard deviation of the electrodes' signal
+SYNTHETIC_STIMULI_NUM = 20
+SYNTHETIC_STIMULUS_SIZE = (400, 300)  # (width, height) of the stimuli images files
+GENERATION_CHUNK_TIME = 60  # seconds of data generated at once
+EEG_DIR_NAME = "EEG"
+ET_DIR_NAME = "ET"
+STIMULI_DIR_NAME = "stim"
+STIMULI_LISTS_DIR_NAME = "outputLists"
+
+
+def get_intervals_mask(intervals, start, length):
+    """
+    :param intervals: array of shape (intervals, 2) of (start, end) sample indices
+    :param start: index of the first sample of the mask
+    :param length: number of samples in the mask
+    :return: boolean array of whether each sample from start is inside any of the intervals
+    """
+    return get_event_train(np.asarray(intervals).reshape(-1, 2) - start, length) > 0
+
+
+def get_lemon_intervals(duration, rate=EEG_SAMPLE_RATE, trial_onset_time=SYNTHETIC_TRIAL_ONSET_TIME,
+                        lemon_time=SYNTHETIC_LEMON_TIME, gap_time=SYNTHETIC_LEMON_GAP_TIME):
+    """
+    :param duration: duration (in seconds) of the EEG recording
+    :param rate: the EEG sample rate
+    :return: array of shape (lemons, 2) of the (start, end) EEG sample indices of every lemon, until a second before
+    the recording ends (see generate_session for the other parameters)
+    """
+    starts = np.arange(trial_onset_time, duration - 1 - lemon_time, lemon_time + gap_time)
+    return np.rint(np.column_stack([starts, starts + lemon_time]) * rate).astype(np.int64)
+
+
+def write_eeg_file(path, duration, rate=EEG_SAMPLE_RATE, press_times=SYNTHETIC_PRESS_TIMES,
+                   lemon_intervals=None, seed=0):
+    """
+    :param path: path of the EEG file
+    :param duration: duration (in seconds) of the recording
+    :param rate: the sample rate
+    :param press_times: times (in seconds) of the beginning protocol presses, each one an artifact in the
+    ARTIFACT_ELECTRODE
+    :param lemon_intervals: array of (start, end) sample indices of the lemons, when the trigger is 0
+    :param seed: seed of the random signal
+    """
+    rng = np.random.default_rng(seed)
+    samples_num = int(duration * rate)
+    press_starts = np.rint(np.asarray(press_times) * rate).astype(np.int64)
+    press_intervals = np.column_stack([press_starts, press_starts + int(SYNTHETIC_PRESS_TIME * rate)])
+    lemon_intervals = np.empty((0, 2)) if lemon_intervals is None else lemon_intervals
+    electrodes = [electrode for electrode in EEG_ELECTRODES if electrode != "TRG"]
+    chunk_size = GENERATION_CHUNK_TIME * rate
+    for chunk_start in range(0, samples_num, chunk_size):
+        length = min(chunk_size, samples_num - chunk_start)
+        chunk = pd.DataFrame(rng.normal(0, SYNTHETIC_EEG_NOISE, (length, len(electrodes))), columns=electrodes)
+        chunk[ARTIFACT_ELECTRODE] += SYNTHETIC_PRESS_AMPLITUDE * get_intervals_mask(press_intervals, chunk_start,
+                                                                                   length)
+        chunk["TRG"] = (~get_intervals_mask(lemon_intervals, chunk_start, length)).astype(np.int64)
+        chunk[EEG_ELECTRODES].to_csv(path, mode="w" if chunk_start == 0 else "a", header=chunk_start == 0,
+                                     index=False, float_format="%.4f")
+
+
+def get_gaze_coordinates(rng, length, rate):
+    """
+    :param rng: numpy random generator
+    :param length: number of samples
+    :param rate: the sample rate
+    :return: arrays of the X and Y normalized screen coordinates of fixations around the screen's center
+    """
+    fixations_num = int(length / (SYNTHETIC_FIXATION_TIME * rate)) + 1
+    fixation_numbers = np.minimum(np.sort(rng.integers(0, fixations_num, length)), fixations_num - 1)
+    centers = rng.normal(0.5, 0.15, (fixations_num, 2))
+    return centers[fixation_numbers].T + rng.normal(0, 0.005, (2, length))
+
+
+def write_et_file(path, duration, rate=ET_SAMPLE_RATE, protocol="closed_eyes", press_times=SYNTHETIC_PRESS_TIMES,
+                  trial_onset_time=SYNTHETIC_TRIAL_ONSET_TIME, lead_time=SYNTHETIC_ET_LEAD_TIME, seed=0):
+    """
+    :param path: path of the ET file
+    :param duration: duration (in seconds) of the EEG recording (the ET recording is lead_time longer)
+    :param rate: the sample rate
+    :param protocol: one of SYNTHETIC_PROTOCOLS
+    :param press_times: times (in seconds, on the EEG recording's clock) of the beginning protocol presses
+    :param trial_onset_time: time (in seconds, on the EEG recording's clock) of the first lemon
+    :param lead_time: time (in seconds) the ET recording started before the EEG recording
+    :param seed: seed of the random gaze
+    """
+    if protocol not in SYNTHETIC_PROTOCOLS:
+        raise ValueError(f"Unknown synthetic protocol: {protocol}")
+    rng = np.random.default_rng(seed + 1)  # independent of the EEG signal
+    samples_num = int((duration + lead_time) * rate)
+    trial_onset = int(round((trial_onset_time + lead_time) * rate))
+    if protocol == "closed_eyes":
+        press_starts = np.rint((np.asarray(press_times) + lead_time) * rate).astype(np.int64)
+        closed_eyes_intervals = np.column_stack([press_starts, press_starts + int(SYNTHETIC_CLOSED_EYES_TIME * rate)])
+        wink_intervals = np.empty((0, 2))
+    else:
+        closed_eyes_intervals = np.empty((0, 2))
+        wink_intervals = np.array([[trial_onset - int(SYNTHETIC_WINK_TIME * rate), trial_onset]])
+    # blinks in the beginning protocol would be detected as closed eyes periods, so there are none
+    blinks_start = max(trial_onset, ET_BEGINNING_TIME * rate)
+    blinks_num = rng.poisson(SYNTHETIC_BLINKS_PER_MINUTE * max(0, samples_num - blinks_start) / rate / 60)
+    blink_starts = np.sort(rng.integers(blinks_start, max(blinks_start, samples_num) + 1, blinks_num))
+    blink_intervals = np.column_stack([blink_starts, blink_starts + int(SYNTHETIC_BLINK_TIME * rate)])
+    closed_eyes_intervals = np.concatenate([[[0, int(0.1 * rate)]],  # until the first eye tracking samples
+                                            closed_eyes_intervals, blink_intervals])
+    chunk_size = GENERATION_CHUNK_TIME * rate
+    for chunk_start in range(0, samples_num, chunk_size):
+        length = min(chunk_size, samples_num - chunk_start)
+        positions = np.arange(chunk_start, chunk_start + length)
+        chunk = pd.DataFrame({ET_TIME_COLUMN: SYNTHETIC_ET_START_TIME_MS + positions * 1000 / rate +
+                              rng.uniform(-1, 1, length)})  # the ET timestamps jitter
+        gaze_x, gaze_y = get_gaze_coordinates(rng, length, rate)
+        for eye, offset in [("left", -0.01), ("right", 0.01)]:
+            chunk[f"{eye}_x"], chunk[f"{eye}_y"] = gaze_x + offset, gaze_y.copy()
+        closed = get_intervals_mask(closed_eyes_intervals, chunk_start, length) | \
+            (rng.random(length) < SYNTHETIC_DROPOUT_PROBABILITY)
+        chunk.loc[closed, ["left_x", "left_y", "right_x", "right_y"]] = np.nan
+        chunk.loc[get_intervals_mask(wink_intervals, chunk_start, length), ["left_x", "left_y"]] = np.nan
+        chunk.to_csv(path, mode="w" if chunk_start == 0 else "a", header=chunk_start == 0, index=False)
+
+
+def write_stimuli(output_dir, lemons_num, stimuli_num=SYNTHETIC_STIMULI_NUM, size=SYNTHETIC_STIMULUS_SIZE, seed=0):
+    """
+    Writes stimuli images, and a list of the images that were shown in the trial (in the RSVP app's records format)
+    :param output_dir: directory to write the STIMULI_DIR_NAME and STIMULI_LISTS_DIR_NAME directories in
+    :param lemons_num: number of lemons that were shown (the stimuli are repeated in a cycle)
+    :param stimuli_num: number of different images
+    :param size: (width, height) of the images
+    :param seed: seed of the images' colors
+    :return: the stimuli images directory, and the stimuli lists directory
+    """
+    rng = np.random.default_rng(seed)
+    images_dir = os.path.join(output_dir, STIMULI_DIR_NAME)
+    lists_dir = os.path.join(output_dir, STIMULI_LISTS_DIR_NAME)
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(lists_dir, exist_ok=True)
+    names = [f"lemon_{stimulus_number}.png" for stimulus_number in range(stimuli_num)]
+    for name in names:
+        pixels = rng.integers(0, 256, (size[1] // 10, size[0] // 10, 3), dtype=np.uint8)
+        Image.fromarray(pixels, "RGB").resize(size, Image.NEAREST).save(os.path.join(images_dir, name))
+    with open(os.path.join(lists_dir, f"{SYNTHETIC_IDENTIFIER}.txt"), "w") as f:
+        f.writelines(f"{names[lemon_number % stimuli_num]} {'target' if lemon_number % 10 == 0 else 'distractor'}\n"
+                     for lemon_number in range(lemons_num))
+    return images_dir, lists_dir
+
+
+def generate_session(output_dir, duration, eeg_rate=EEG_SAMPLE_RATE, et_rate=ET_SAMPLE_RATE, protocol="closed_eyes",
+                     identifier=SYNTHETIC_IDENTIFIER, stimuli_num=None, seed=0):
+    """
+    Writes the EEG and ET files of a synthetic session, in the EEG_DIR_NAME and ET_DIR_NAME directories
+    :param output_dir: the parent directory of the data directories
+    :param duration: duration (in seconds) of the EEG recording
+    :param eeg_rate: the EEG sample rate
+    :param et_rate: the ET sample rate
+    :param protocol: one of SYNTHETIC_PROTOCOLS
+    :param identifier: the recording identifier in the files' names
+    :param stimuli_num: number of stimuli images to also write (see write_stimuli), or None for no images
+    :param seed: seed of the random data
+    :return: dict with the paths of the files, and the times (in seconds) and indices of the embedded events
+    """
+    eeg_data_path = os.path.join(output_dir, EEG_DIR_NAME, f"EEG_{identifier}.csv")
+    et_data_path = os.path.join(output_dir, ET_DIR_NAME, f"ET_{identifier}.csv")
+    os.makedirs(os.path.dirname(eeg_data_path), exist_ok=True)
+    os.makedirs(os.path.dirname(et_data_path), exist_ok=True)
+    lemon_intervals = get_lemon_intervals(duration, eeg_rate)
+    write_eeg_file(eeg_data_path, duration, eeg_rate, lemon_intervals=lemon_intervals, seed=seed)
+    write_et_file(et_data_path, duration, et_rate, protocol, seed=seed)
+    session = {"eeg_data_path": eeg_data_path, "et_data_path": et_data_path, "protocol": protocol,
+               "press_times": SYNTHETIC_PRESS_TIMES, "et_lead_time": SYNTHETIC_ET_LEAD_TIME,
+               "trial_onset_time": SYNTHETIC_TRIAL_ONSET_TIME, "lemon_onsets": lemon_intervals[:, 0]}
+    if stimuli_num:
+        session["images_dir"], session["images_lists_dir"] = write_stimuli(output_dir, len(lemon_intervals),
+                                                                           stimuli_num, seed=seed)
+    return session
+
+
+def main():
+    """
+    Main code to run for generating synthetic sessions.
+    """
+    parser = argparse.ArgumentParser(description="Generates synthetic EEG and ET recordings")
+    parser.add_argument("output_dir", help="the parent directory of the EEG and ET data directories")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="minutes of every recording")
+    parser.add_argument("-n", "--sessions", type=int, default=1, help="number of sessions")
+    parser.add_argument("--eeg-rate", type=int, default=EEG_SAMPLE_RATE)
+    parser.add_argument("--et-rate", type=int, default=ET_SAMPLE_RATE)
+    parser.add_argument("--protocol", choices=SYNTHETIC_PROTOCOLS, default="closed_eyes")
+    parser.add_argument("--stimuli", type=int, default=0, help="number of stimuli images to write (for the demo)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for session_number in range(args.sessions):
+        identifier = f"{SYNTHETIC_IDENTIFIER[:-len(str(session_number))]}{session_number}"
+        session = generate_session(args.output_dir, args.duration * 60, args.eeg_rate, args.et_rate, args.protocol,
+                                   identifier, args.stimuli, args.seed + session_number)
+        print(f"{identifier}: {session['eeg_data_path']}, {session['et_data_path']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the modules are in the repo's root
+
+import recording_index  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def recording_index_path(tmp_path_factory):
+    """
+    Keeps the recording index of the tests' data directories apart from the real recordings' index
+    """
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        path = str(tmp_path_factory.mktemp("recording_index") / "recording_index.json")
+        monkeypatch.setattr(recording_index, "RECORDING_INDEX_PATH", path)
+        monkeypatch.setattr(recording_index, "_recording_index", None)
+        yield path
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from alignment import get_event_train, get_edge_train, get_lag, estimate_alignment, get_alignment_index_map
+
+LENGTH = 300000
+WINDOW_LENGTH = 18000
+MAX_LAG = 9000
+MAX_DRIFT_LAG = 900
+EDGE_LENGTH = 30
+LAG = 1234
+DRIFT = 2e-3  # 600 samples over the recording
+
+
+def get_events(rng, starts_range, events_num, min_length, max_length):
+    starts = np.sort(rng.choice(np.arange(*starts_range, 500), events_num, replace=False))
+    return np.stack([starts, starts + rng.integers(min_length, max_length, events_num)], axis=1)
+
+
+def get_other_events(reference_events, rng, lag=LAG, drift=DRIFT, jitter=5):
+    """
+    :return: the matching events of the other stream, which last longer (like the closed eyes periods around the EEG
+    artifacts' epochs), and end at the reference events' ends mapped by the lag and the drift (with jitter)
+    """
+    ends = np.rint(reference_events[:, 1] * (1 + drift) + lag).astype(np.int64) + rng.integers(-jitter, jitter + 1,
+                                                                                                len(reference_events))
+    return np.stack([ends - rng.integers(150, 600, len(ends)), ends], axis=1)
+
+
+def test_event_train():
+    train = get_event_train([(2, 5), (4, 7), (9, 12), (-3, 1)], 10)
+    np.testing.assert_array_equal(train, [1, 0, 1, 1, 1, 1, 1, 0, 0, 1])
+    np.testing.assert_array_equal(get_event_train([], 3), [0, 0, 0])
+    np.testing.assert_array_equal(get_edge_train([(0, 2), (1, 6)], 8, 2), [0, 0, 1, 1, 0, 0, 1, 1])
+
+
+def test_lag_of_equal_boxes():
+    reference = get_event_train([(100, 150), (400, 420), (700, 790)], 1000)
+    other = get_event_train([(137, 187), (437, 457), (737, 827)], 1000)
+    assert get_lag(reference, other, -200, 200) == 37
+    assert get_lag(reference, other, -200, -100) is None  # no events overlap at these lags
+    assert get_lag(reference, np.zeros(1000), -200, 200) is None
+
+
+def test_lag_of_boxes_of_different_lengths_is_biased():
+    # the same events that last longer in the other stream: the middle of the best lags range isn't their ends' lag,
+    # which is why estimate_alignment correlates the events' ends
+    reference = get_event_train([(100, 150), (400, 450)], 1000)
+    other = get_event_train([(87, 187), (387, 487)], 1000)
+    assert get_lag(reference, other, -200, 200) == 12
+    assert get_lag(get_edge_train([(100, 150), (400, 450)], 1000, 10),
+                   get_edge_train([(87, 187), (387, 487)], 1000, 10), -200, 200) == 37
+
+
+def test_ambiguous_lag():
+    reference = get_edge_train([(100, 150)], 1000, 10)
+    other = get_edge_train([(160, 200), (230, 260)], 1000, 10)  # two candidates for a single event
+    assert get_lag(reference, other, -200, 200) == 50
+    assert get_lag(reference, other, -200, 200, max_ambiguity=0.8) is None
+    assert get_lag(reference, other, 0, 80, max_ambiguity=0.8) == 50
+    # only a third of the reference's events are matched
+    reference = get_edge_train([(100, 150), (400, 450), (700, 750)], 1000, 10)
+    assert get_lag(reference, other, 0, 80, min_match=0.5) is None
+
+
+def test_estimate_alignment_with_distractors():
+    rng = np.random.default_rng(0)
+    reference_events = np.concatenate([get_events(rng, (0, WINDOW_LENGTH), 6, 30, 100),
+                                       get_events(rng, (LENGTH - WINDOW_LENGTH, LENGTH - 1000), 6, 30, 100)])
+    other_events = get_other_events(reference_events, rng)
+    # blinks of the other stream only, in both windows
+    distractors = np.concatenate([get_events(rng, (0, WINDOW_LENGTH + MAX_LAG), 4, 30, 60),
+                                  get_events(rng, (LENGTH - WINDOW_LENGTH, LENGTH), 4, 30, 60)])
+    lag, drift = estimate_alignment(reference_events, np.concatenate([other_events, distractors]), LENGTH, LENGTH + 2000, WINDOW_LENGTH,
+                                    MAX_LAG, MAX_DRIFT_LAG, EDGE_LENGTH)
+    assert drift == pytest.approx(DRIFT, abs=2e-5)
+    assert lag == pytest.approx(LAG, abs=10)
+    index_map = get_alignment_index_map(0, LENGTH, lag, drift)
+    expected_index_map = np.rint(np.arange(LENGTH) * (1 + DRIFT) + LAG)
+    assert np.abs(index_map - expected_index_map).max() <= 10
+
+
+def test_unmatched_end_window_has_no_drift():
+    rng = np.random.default_rng(1)
+    reference_events = np.concatenate([get_events(rng, (0, WINDOW_LENGTH), 6, 30, 100),
+                                       get_events(rng, (LENGTH - WINDOW_LENGTH, LENGTH - 1000), 6, 30, 100)])
+    other_events = get_other_events(reference_events, rng)
+    # only 2 of the 6 end events were recorded by the other stream
+    lag, drift = estimate_alignment(reference_events, other_events[:8], LENGTH, LENGTH + 2000, WINDOW_LENGTH,
+                                    MAX_LAG, MAX_DRIFT_LAG, EDGE_LENGTH)
+    assert drift == 0 and lag == pytest.approx(LAG, abs=DRIFT * WINDOW_LENGTH)  # the start window's lag
+    # the end events drifted further than the maximal drift lag
+    far_other_events = get_other_events(reference_events, rng, drift=0.01)
+    lag, drift = estimate_alignment(reference_events, far_other_events, LENGTH, LENGTH + 5000, WINDOW_LENGTH,
+                                    MAX_LAG, MAX_DRIFT_LAG, EDGE_LENGTH)
+    assert drift == 0
+
+
+def test_alignment_index_map():
+    np.testing.assert_array_equal(get_alignment_index_map(10, 14, 5), [15, 16, 17, 18])
+    np.testing.assert_array_equal(get_alignment_index_map(0, 3, -1.4, 0.5), [-1, 0, 2])
@@ -0,0 +1,47 @@
+import os
+import time
+import pytest
+import eeg_et_hr_synchronizer
+from batch_synchronizer import synchronize_all_recordings
+from output_backends import SIDECAR_FILE_NAME
+from synthetic_sessions import generate_session, EEG_DIR_NAME, ET_DIR_NAME, SYNTHETIC_IDENTIFIER
+
+SESSION_DURATION = 40  # seconds
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(eeg_et_hr_synchronizer, "INGESTION_CACHE_DIR", str(tmp_path / "ingestion_cache"))
+    data_dir = str(tmp_path / "data")
+    generate_session(data_dir, SESSION_DURATION)
+    return data_dir
+
+
+def get_statuses(data_dir, output_dir):
+    results = synchronize_all_recordings(os.path.join(data_dir, EEG_DIR_NAME), os.path.join(data_dir, ET_DIR_NAME),
+                                         None, output_dir, workers=1)
+    return [result["status"] for result in results]
+
+
+def test_up_to_date_session_is_skipped(data_dir, tmp_path):
+    output_dir = str(tmp_path / "output")
+    assert get_statuses(data_dir, output_dir) == ["done"]
+    assert get_statuses(data_dir, output_dir) == ["skipped"]
+    # a data file that was modified after the output was saved
+    sidecar_path = os.path.join(output_dir, SYNTHETIC_IDENTIFIER, SIDECAR_FILE_NAME)
+    os.utime(sidecar_path, (time.time() - 60, time.time() - 60))
+    os.utime(os.path.join(data_dir, ET_DIR_NAME, f"ET_{SYNTHETIC_IDENTIFIER}.csv"))
+    assert get_statuses(data_dir, output_dir) == ["done"]
+    assert get_statuses(data_dir, output_dir) == ["skipped"]
+
+
+def test_corrupted_sidecar_is_synchronized_again(data_dir, tmp_path):
+    output_dir = str(tmp_path / "output")
+    assert get_statuses(data_dir, output_dir) == ["done"]
+    sidecar_path = os.path.join(output_dir, SYNTHETIC_IDENTIFIER, SIDECAR_FILE_NAME)
+    with open(sidecar_path, "r") as f:
+        content = f.read()
+    with open(sidecar_path, "w") as f:
+        f.write(content[:len(content) // 2])  # truncated
+    assert get_statuses(data_dir, output_dir) == ["done"]
+    assert get_statuses(data_dir, output_dir) == ["skipped"]
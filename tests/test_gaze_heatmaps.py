@@ -0,0 +1,36 @@
+import os
+import numpy as np
+from gaze_heatmaps import GazeHeatmapAccumulator, update_heatmaps_file
+
+
+def get_session_accumulator(session, seed):
+    rng = np.random.default_rng(seed)
+    accumulator = GazeHeatmapAccumulator((120, 80), bin_size=4)
+    accumulator.add_session(session)
+    for stimulus in ["a.png", "b.png"]:
+        accumulator.add(stimulus, rng.uniform(-10, 130, 500), rng.uniform(-10, 90, 500))
+    return accumulator
+
+
+def test_incremental_updates_equal_merging_together(tmp_path):
+    path = str(tmp_path / "new_dir" / "heatmaps.npz")  # the directory doesn't exist yet
+    update_heatmaps_file(path, get_session_accumulator("first", 0))
+    incremental = update_heatmaps_file(path, get_session_accumulator("second", 1))
+    together = get_session_accumulator("first", 0)
+    together.merge(get_session_accumulator("second", 1))
+    loaded = GazeHeatmapAccumulator.load(path)
+    for accumulator in [incremental, loaded]:
+        assert accumulator.sessions == together.sessions
+        assert accumulator.presentations == together.presentations
+        assert accumulator.counts.keys() == together.counts.keys()
+        for stimulus, counts in together.counts.items():
+            np.testing.assert_array_equal(accumulator.counts[stimulus], counts)
+
+
+def test_added_session_is_skipped(tmp_path):
+    path = str(tmp_path / "heatmaps.npz")
+    update_heatmaps_file(path, get_session_accumulator("first", 0))
+    modified_time = os.path.getmtime(path)
+    merged = update_heatmaps_file(path, get_session_accumulator("first", 0))
+    assert merged.sessions == ["first"] and merged.presentations == {"a.png": 1, "b.png": 1}
+    assert os.path.getmtime(path) == modified_time
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+import eeg_et_hr_synchronizer
+from eeg_et_hr_synchronizer import preprocess_eeg_data, preprocess_et_data, get_eeg_artifact_timestamps, \
+    get_closed_eyes_timestamps, get_eeg_trial_onset_timestamp, get_et_trial_onset_timestamps, save_synchronized_data
+from live_synchronizer import CsvTailer, ArtifactDetector, ClosedEyesDetector, LiveSynchronizer, \
+    start_replay_processes
+from synthetic_sessions import generate_session
+
+SESSION_DURATION = 30  # seconds
+REPLAY_SPEED = 10
+
+
+@pytest.fixture(scope="module")
+def session(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(eeg_et_hr_synchronizer, "INGESTION_CACHE_DIR",
+                            str(tmp_path_factory.mktemp("ingestion_cache")))
+        yield generate_session(str(tmp_path_factory.mktemp("data")), SESSION_DURATION, seed=1)
+
+
+def get_random_chunks(df, rng, chunks_num=50):
+    bounds = [0, *np.sort(rng.choice(np.arange(1, len(df)), chunks_num, replace=False)), len(df)]
+    return [df.iloc[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def test_incremental_detectors_match_offline(session):
+    rng = np.random.default_rng(0)
+    eeg_df = preprocess_eeg_data(session["eeg_data_path"])
+    et_df = preprocess_et_data(session["et_data_path"])
+    # every prefix of the data has the same events as the offline detectors on it
+    artifact_detector = ArtifactDetector()
+    for chunk in get_random_chunks(eeg_df, rng):
+        artifact_detector.feed(chunk)
+        assert artifact_detector.timestamps == get_eeg_artifact_timestamps(eeg_df[:artifact_detector.samples_num])
+    assert artifact_detector.timestamps == get_eeg_artifact_timestamps(eeg_df)
+    closed_eyes_detector = ClosedEyesDetector()
+    for chunk in get_random_chunks(et_df, rng):
+        closed_eyes_detector.feed(chunk)
+        assert closed_eyes_detector.timestamps == get_closed_eyes_timestamps(et_df[:closed_eyes_detector.samples_num])
+    assert len(closed_eyes_detector.timestamps) > 3
+
+
+def test_replay_matches_offline(session, tmp_path):
+    eeg_df = preprocess_eeg_data(session["eeg_data_path"])
+    et_df = preprocess_et_data(session["et_data_path"], lazy=True)
+    eeg_trial_onset_timestamp = get_eeg_trial_onset_timestamp(get_eeg_artifact_timestamps(eeg_df))
+    et_trial_onset_timestamp = get_et_trial_onset_timestamps(get_closed_eyes_timestamps(et_df))
+    offline_df, _ = save_synchronized_data(eeg_df, et_df, eeg_trial_onset_timestamp, et_trial_onset_timestamp,
+                                           output_dir=str(tmp_path / "offline"))
+
+    (eeg_data_path, et_data_path), processes = start_replay_processes(
+        session["eeg_data_path"], session["et_data_path"], str(tmp_path), REPLAY_SPEED, eeg_delay=1)
+    frames = []
+    synchronizer = LiveSynchronizer(eeg_data_path, et_data_path, callback=frames.append)
+    synchronizer.run(idle_timeout=1, poll_interval=0.005)
+    for process in processes:
+        process.join()
+    assert (synchronizer.eeg_trial_onset_timestamp, synchronizer.et_trial_onset_timestamp) == \
+        (eeg_trial_onset_timestamp, et_trial_onset_timestamp)
+    assert len(frames) > 1
+    live_df = pd.concat(frames)
+    frames_num = min(len(eeg_df) - eeg_trial_onset_timestamp, len(et_df) - et_trial_onset_timestamp)
+    assert len(live_df) == frames_num
+    pd.testing.assert_frame_equal(live_df, offline_df[:frames_num], check_dtype=False)
+
+
+def test_csv_tailer(tmp_path):
+    path = str(tmp_path / "data.csv")
+    tailer = CsvTailer(path)
+    assert tailer.read_new_rows() is None  # not created yet
+    with open(path, "w") as f:
+        f.write("a,b")
+        f.flush()
+        assert tailer.read_new_rows() is None  # a partial header
+        f.write("\n1,2\n3,")
+        f.flush()
+        pd.testing.assert_frame_equal(tailer.read_new_rows(), pd.DataFrame({"a": [1], "b": [2]}))
+        assert tailer.read_new_rows().empty
+        f.write("4\n5,6\n")
+        f.flush()
+        pd.testing.assert_frame_equal(tailer.read_new_rows(), pd.DataFrame({"a": [3, 5], "b": [4, 6]}, index=[1, 2]))
+    tailer.close()
@@ -0,0 +1,83 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from output_backends import SynchronizedDataWriter, load_synchronized_data, OUTPUT_FORMATS, OUTPUT_LAYOUTS, \
+    SIDECAR_FILE_NAME
+
+ROWS_NUM = 2500
+CHUNK_SIZE = 997  # doesn't divide the rows num
+METADATA = {"eeg_trial_onset_timestamp": 1234, "et_trial_onset_timestamp": 1200, "sample_rate": 300}
+
+
+@pytest.fixture(scope="module")
+def trial_data():
+    rng = np.random.default_rng(0)
+    eeg_df = pd.DataFrame({"Fp1": rng.normal(0, 50, ROWS_NUM), "O2": rng.normal(0, 50, ROWS_NUM),
+                           "Trigger": rng.integers(0, 2, ROWS_NUM)})
+    et_df = pd.DataFrame({"x": rng.uniform(0, 1920, ROWS_NUM - 100), "y": rng.uniform(0, 1080, ROWS_NUM - 100)})
+    et_df.iloc[50:80] = np.nan  # closed eyes
+    combined_df = pd.concat([eeg_df, et_df], axis=1)  # the ET data ends first, so it is padded with NaN
+    return {"eeg": eeg_df, "et": et_df}, combined_df
+
+
+def write(output_dir, trial_data, output_format, layout):
+    modalities_data, combined_df = trial_data
+    os.makedirs(output_dir, exist_ok=True)
+    writer = SynchronizedDataWriter(output_dir, {modality: f"trial_{modality}" for modality in modalities_data},
+                                    "all_trial_data_combined", output_format, layout, METADATA)
+    for start in range(0, ROWS_NUM, CHUNK_SIZE):
+        writer.write({modality: data[start:start + CHUNK_SIZE] if start < len(data) else None
+                      for modality, data in modalities_data.items()}, combined_df[start:start + CHUNK_SIZE])
+    writer.close()
+
+
+def read_modality_file(output_dir, sidecar, modality):
+    path = os.path.join(output_dir, sidecar["modalities_files"][modality])
+    if sidecar["format"] == "csv":
+        return pd.read_csv(path, index_col=0)
+    if sidecar["format"] == "parquet":
+        return pd.read_parquet(path)
+    if sidecar["format"] == "npz":
+        with np.load(path) as npz_file:
+            return pd.DataFrame({column: npz_file[column] for column in npz_file.files})
+    return pd.DataFrame(np.load(path), columns=sidecar["modalities_columns"][modality])
+
+
+@pytest.fixture(scope="module")
+def baseline_dir(tmp_path_factory, trial_data):
+    output_dir = str(tmp_path_factory.mktemp("baseline"))
+    write(output_dir, trial_data, "csv", "separate")
+    return output_dir
+
+
+@pytest.mark.parametrize("layout", OUTPUT_LAYOUTS)
+@pytest.mark.parametrize("output_format", OUTPUT_FORMATS)
+def test_round_trip(trial_data, baseline_dir, tmp_path, output_format, layout):
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+    output_dir = str(tmp_path / "output")
+    write(output_dir, trial_data, output_format, layout)
+    with open(os.path.join(output_dir, SIDECAR_FILE_NAME), "r") as f:
+        sidecar = json.load(f)
+    assert (sidecar["format"], sidecar["layout"], sidecar["rows"]) == (output_format, layout, ROWS_NUM)
+    assert sidecar["modalities_columns"] == {"eeg": ["Fp1", "O2", "Trigger"], "et": ["x", "y"]}
+    assert {key: sidecar[key] for key in METADATA} == METADATA
+
+    baseline = load_synchronized_data(baseline_dir).reset_index(drop=True)
+    pd.testing.assert_frame_equal(baseline, trial_data[1], check_dtype=False)
+    pd.testing.assert_frame_equal(load_synchronized_data(output_dir).reset_index(drop=True), baseline,
+                                  check_dtype=False)
+    pd.testing.assert_frame_equal(load_synchronized_data(output_dir, "et").reset_index(drop=True),
+                                  baseline[["x", "y"]], check_dtype=False)
+
+    if layout == "combined":
+        assert not sidecar["modalities_files"]
+        return
+    with open(os.path.join(baseline_dir, SIDECAR_FILE_NAME), "r") as f:
+        baseline_sidecar = json.load(f)
+    for modality in ["eeg", "et"]:
+        pd.testing.assert_frame_equal(read_modality_file(output_dir, sidecar, modality).reset_index(drop=True),
+                                      read_modality_file(baseline_dir, baseline_sidecar, modality)
+                                      .reset_index(drop=True), check_dtype=False)
@@ -0,0 +1,60 @@
+import os
+import time
+import pytest
+import recording_index
+from recording_index import RecordingIndex
+
+
+def write_files(dir, names_ages):
+    """
+    Writes files with modification times that are older than RACY_MTIME_SECONDS, so the directory's scan is reused
+    """
+    now = time.time()
+    for name, age in names_ages.items():
+        open(os.path.join(dir, name), "w").close()
+        os.utime(os.path.join(dir, name), (now - age, now - age))
+    set_dir_age(dir, min(names_ages.values()))
+
+
+def set_dir_age(dir, age):
+    os.utime(dir, (time.time() - age, time.time() - age))
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data_dir = str(tmp_path / "data")
+    os.makedirs(data_dir)
+    write_files(data_dir, {"EEG_2020_1.csv": 300, "EEG_2020_2.csv": 200, "EEG_2020_3.txt": 100})
+    return data_dir
+
+
+def test_most_recent(data_dir, tmp_path, monkeypatch):
+    index = RecordingIndex(str(tmp_path / "index.json"))
+    assert index.get_most_recent(data_dir) == os.path.join(data_dir, "EEG_2020_3.txt")
+    assert index.get_most_recent(data_dir, "csv") == os.path.join(data_dir, "EEG_2020_2.csv")
+    assert index.get_most_recent(data_dir, "csv", "_1") == os.path.join(data_dir, "EEG_2020_1.csv")
+    assert index.get_most_recent(data_dir, "npy") is None
+    assert index.find_by_identifier(data_dir, "2020_1") == os.path.join(data_dir, "EEG_2020_1.csv")
+    # a new index of the same file doesn't scan the directory again
+    index = RecordingIndex(str(tmp_path / "index.json"))
+    monkeypatch.setattr(index, "_scan", None)
+    checked_paths = []
+    is_file = os.path.isfile
+    monkeypatch.setattr(recording_index.os.path, "isfile", lambda path: checked_paths.append(path) or is_file(path))
+    assert index.get_most_recent(data_dir, "csv") == os.path.join(data_dir, "EEG_2020_2.csv")
+    assert checked_paths == [os.path.join(data_dir, "EEG_2020_2.csv")]  # only the newest file is checked
+
+
+def test_most_recent_after_changes(data_dir):
+    index = RecordingIndex(None)
+    assert index.get_most_recent(data_dir, "csv") == os.path.join(data_dir, "EEG_2020_2.csv")
+    # removed, without a change of the directory's modification time (e.g. of a coarse mtime file system)
+    os.remove(os.path.join(data_dir, "EEG_2020_2.csv"))
+    set_dir_age(data_dir, 100)
+    assert index.get_most_recent(data_dir, "csv") == os.path.join(data_dir, "EEG_2020_1.csv")
+    # written in place, which is found once the directory changes
+    os.utime(os.path.join(data_dir, "EEG_2020_1.csv"), (time.time() - 50, time.time() - 50))
+    assert index.get_most_recent(data_dir) == os.path.join(data_dir, "EEG_2020_3.txt")
+    write_files(data_dir, {"EEG_2020_4.csv": 400})
+    assert index.get_most_recent(data_dir) == os.path.join(data_dir, "EEG_2020_1.csv")
+    assert index.get_most_recent(data_dir, "csv", "_4") == os.path.join(data_dir, "EEG_2020_4.csv")
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+from resampling import resample_et_to_eeg_rate, StreamingETResampler, ET_TIME_COLUMN, RESAMPLING_METHODS
+
+TARGET_RATE = 200  # Hz
+SOURCE_RATE = 100  # Hz
+JITTERED_TIMES = [0, 10.5, 19, 31]  # ms, so the grid is 0, 5, ..., 40 ms
+
+
+def get_et_df(times, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({ET_TIME_COLUMN: times, "x": rng.uniform(0, 1000, len(times)),
+                         "y": rng.uniform(0, 1000, len(times))})
+
+
+def resample_by_duplicating_rows(et_df, target_rate, source_rate):
+    """
+    The original resampling, which duplicated every row
+    """
+    df = et_df.drop(ET_TIME_COLUMN, axis=1)
+    rows = []
+    for index, row in df.iterrows():
+        rows.extend([row] * (target_rate // source_rate))
+    return pd.DataFrame(rows).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("method", ["repeat", "hold"])
+def test_ideal_timestamps_match_row_duplication(method):
+    et_df = get_et_df(np.arange(100) * 1000 / 60)
+    expected = resample_by_duplicating_rows(et_df, 300, 60)
+    pd.testing.assert_frame_equal(resample_et_to_eeg_rate(et_df, 300, 60, method), expected, check_index_type=False)
+
+
+@pytest.mark.parametrize("method, expected", [
+    ("hold", [0, 0, 0, 1, 2, 2, 2, 3, 3]),
+    ("nearest", [0, 0, 1, 2, 2, 2, 3, 3, 3]),  # a tie keeps the earlier sample
+    ("linear", np.interp(np.arange(9) * 5, JITTERED_TIMES, np.arange(4))),
+])
+def test_jittered_timestamps(method, expected):
+    et_df = pd.DataFrame({ET_TIME_COLUMN: JITTERED_TIMES, "x": np.arange(4.0)})
+    np.testing.assert_allclose(resample_et_to_eeg_rate(et_df, TARGET_RATE, SOURCE_RATE, method)["x"], expected)
+
+
+def test_out_of_order_timestamps_are_sorted():
+    et_df = pd.DataFrame({ET_TIME_COLUMN: [0, 19, 10.5, 31], "x": [0.0, 2, 1, 3]})
+    np.testing.assert_array_equal(resample_et_to_eeg_rate(et_df, TARGET_RATE, SOURCE_RATE, "hold")["x"],
+                                  [0, 0, 0, 1, 2, 2, 2, 3, 3])
+
+
+@pytest.mark.parametrize("method, expected_nan_positions", [
+    ("hold", [8, 9, 10, 11]),  # more than 15 ms after the sample at 20 ms
+    ("linear", [5, 6, 7, 8, 9, 10, 11]),  # interpolated between the samples at 20 and 60 ms
+])
+def test_dropped_frames_are_nan(method, expected_nan_positions):
+    et_df = pd.DataFrame({ET_TIME_COLUMN: [0, 10, 20, 60, 70], "x": np.arange(5.0)})  # the grid is 0, 5, ..., 75 ms
+    resampled = resample_et_to_eeg_rate(et_df, TARGET_RATE, SOURCE_RATE, method, max_hold_ms=15)
+    assert len(resampled) == 16
+    np.testing.assert_array_equal(np.flatnonzero(resampled["x"].isna()), expected_nan_positions)
+
+
+@pytest.mark.parametrize("method", RESAMPLING_METHODS)
+@pytest.mark.parametrize("max_hold_ms", [None, 25])
+def test_streaming_matches_one_shot(method, max_hold_ms):
+    rng = np.random.default_rng(1)
+    times = np.cumsum(rng.uniform(8, 12, 1000))
+    times[500:] += 100  # dropped frames
+    et_df = get_et_df(times)
+    expected = resample_et_to_eeg_rate(et_df, TARGET_RATE, SOURCE_RATE, method, max_hold_ms)
+    resampler = StreamingETResampler(TARGET_RATE, SOURCE_RATE, method, max_hold_ms)
+    # a first chunk of a single sample, an empty chunk and random chunks
+    bounds = [0, 1, *np.sort(rng.choice(np.arange(2, len(et_df)), 20, replace=False)), len(et_df)]
+    bounds.insert(5, bounds[4])
+    chunks = [resampler.feed(et_df.iloc[start:stop]) for start, stop in zip(bounds[:-1], bounds[1:])]
+    resampled = pd.concat(chunks + [resampler.flush()])
+    pd.testing.assert_frame_equal(resampled, expected, check_index_type=False)
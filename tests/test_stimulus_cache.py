@@ -0,0 +1,20 @@
+import os
+from PIL import Image
+from stimulus_cache import StimulusCache
+
+
+def test_changed_image_replaces_its_cache_file(tmp_path):
+    image_path = str(tmp_path / "stimulus.png")
+    cache_dir = str(tmp_path / "cache")
+    Image.new("RGB", (40, 30), "red").save(image_path)
+    assert StimulusCache((20, 15), cache_dir=cache_dir).get(image_path).getpixel((0, 0)) == (255, 0, 0)
+    Image.new("RGB", (40, 30), "blue").save(image_path)
+    os.utime(image_path, ns=(0, os.stat(image_path).st_mtime_ns + 10 ** 9))
+    assert StimulusCache((20, 15), cache_dir=cache_dir).get(image_path).getpixel((0, 0)) == (0, 0, 255)
+    assert len(os.listdir(cache_dir)) == 1
+    # other sizes of the same image are kept
+    StimulusCache((10, 5), cache_dir=cache_dir).get(image_path)
+    assert len(os.listdir(cache_dir)) == 2
+    cache = StimulusCache((20, 15), cache_dir=cache_dir)
+    cache.get(image_path)
+    assert len(os.listdir(cache_dir)) == 2
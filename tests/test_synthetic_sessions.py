@@ -0,0 +1,118 @@
+# End to end checks of the pipeline over short synthetic sessions, against the events embedded in them.
+
+import os
+import filecmp
+import numpy as np
+import pandas as pd
+import pytest
+import eeg_et_hr_synchronizer
+from eeg_et_hr_synchronizer import preprocess_eeg_data, preprocess_et_data, get_eeg_artifact_timestamps, \
+    get_eeg_artifact_timestamps_per_electrode, get_eeg_trial_onset_timestamp, get_closed_eyes_timestamps, \
+    get_et_trial_onset_timestamps, get_beginning_timestamps, get_trial_onset_timestamps, synchronize_recording, \
+    get_et_index_map, EEG_SAMPLE_RATE, ET_SAMPLE_RATE, ARTIFACT_ELECTRODE, ARTIFACT_EPOCH_LENGTH
+from ingestion_cache import read_csv_cached
+from lemons_demo_with_eeg_et_sync import get_lemon_onset_timestamps, get_et_trial_onset_timestamp_by_wink, \
+    MIN_BEGINNING_PROTOCOL_WINK_SAMPLES
+from parameter_sweep import sweep_eeg_parameters, sweep_et_parameters
+from synthetic_sessions import generate_session, SYNTHETIC_CLOSED_EYES_TIME
+
+SESSION_DURATION = 60  # seconds
+ET_SAMPLE_STEP = EEG_SAMPLE_RATE // ET_SAMPLE_RATE  # the ET timestamps' jitter may move an event by an ET sample
+
+
+@pytest.fixture(scope="module")
+def cache_dir(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        cache_dir = str(tmp_path_factory.mktemp("ingestion_cache"))
+        monkeypatch.setattr(eeg_et_hr_synchronizer, "INGESTION_CACHE_DIR", cache_dir)
+        yield cache_dir
+
+
+@pytest.fixture(scope="module")
+def session(tmp_path_factory, cache_dir):
+    return generate_session(str(tmp_path_factory.mktemp("data")), SESSION_DURATION)
+
+
+@pytest.fixture(scope="module")
+def wink_session(tmp_path_factory, cache_dir):
+    return generate_session(str(tmp_path_factory.mktemp("wink_data")), SESSION_DURATION, protocol="wink")
+
+
+def test_detected_onsets(session):
+    eeg_df = preprocess_eeg_data(session["eeg_data_path"])
+    et_df = preprocess_et_data(session["et_data_path"], lazy=True)
+    last_press_time = session["press_times"][-1]
+    eeg_trial_onset_timestamp = get_eeg_trial_onset_timestamp(get_eeg_artifact_timestamps(eeg_df))
+    assert eeg_trial_onset_timestamp == (last_press_time + ARTIFACT_EPOCH_LENGTH) * EEG_SAMPLE_RATE
+    et_trial_onset_timestamp = get_et_trial_onset_timestamps(get_closed_eyes_timestamps(et_df))
+    expected_et_trial_onset_timestamp = (last_press_time + session["et_lead_time"] + SYNTHETIC_CLOSED_EYES_TIME) * \
+        EEG_SAMPLE_RATE
+    assert abs(et_trial_onset_timestamp - expected_et_trial_onset_timestamp) <= ET_SAMPLE_STEP
+    np.testing.assert_array_equal(get_lemon_onset_timestamps(eeg_df), session["lemon_onsets"])
+
+
+def test_cross_correlation_matches_onsets(session):
+    eeg_df = preprocess_eeg_data(session["eeg_data_path"])
+    et_df = preprocess_et_data(session["et_data_path"], lazy=True)
+    eeg_trial_onset_timestamp = get_eeg_trial_onset_timestamp(get_eeg_artifact_timestamps(eeg_df))
+    et_trial_onset_timestamp = get_et_trial_onset_timestamps(get_closed_eyes_timestamps(et_df))
+    et_index_map = get_et_index_map(eeg_df, et_df, eeg_trial_onset_timestamp)
+    assert len(et_index_map) == len(eeg_df) - eeg_trial_onset_timestamp
+    assert abs(et_index_map[0] - et_trial_onset_timestamp) <= ET_SAMPLE_STEP
+    assert abs(et_index_map[-1] - et_index_map[0] - (len(et_index_map) - 1)) <= ET_SAMPLE_STEP  # no drift
+
+
+def test_wink_onset(wink_session):
+    et_df = preprocess_et_data(wink_session["et_data_path"], lazy=True)
+    expected_timestamp = (wink_session["trial_onset_time"] + wink_session["et_lead_time"]) * EEG_SAMPLE_RATE
+    timestamp = get_et_trial_onset_timestamp_by_wink(et_df, MIN_BEGINNING_PROTOCOL_WINK_SAMPLES)
+    assert abs(timestamp - expected_timestamp) <= ET_SAMPLE_STEP
+
+
+def test_cached_read_matches_parsing(session, cache_dir):
+    path = session["eeg_data_path"]
+    os.utime(path, (os.path.getatime(path), os.path.getmtime(path) - 60))  # not racy, so it is cached
+    parsed = pd.read_csv(path)
+    assert read_csv_cached(path, cache_dir=cache_dir).equals(parsed)  # parsed, and cached
+    cached = read_csv_cached(path, cache_dir=cache_dir)
+    assert cached.equals(parsed)
+    assert list(cached.dtypes) == list(parsed.dtypes)
+
+
+# the default chunk size is longer than the session, and a chunk size that doesn't divide the session's length (nor
+# its trial) checks the chunks' boundaries
+@pytest.mark.parametrize("chunk_size", [eeg_et_hr_synchronizer.STREAMING_CHUNK_SIZE, 997])
+@pytest.mark.parametrize("use_ingestion_cache", [True, False])
+def test_streaming_matches_in_memory(session, tmp_path, monkeypatch, chunk_size, use_ingestion_cache):
+    monkeypatch.setattr(eeg_et_hr_synchronizer, "STREAMING_CHUNK_SIZE", chunk_size)
+    monkeypatch.setattr(eeg_et_hr_synchronizer, "USE_INGESTION_CACHE", use_ingestion_cache)
+    in_memory = synchronize_recording(session["eeg_data_path"], session["et_data_path"],
+                                      output_dir=str(tmp_path / "in_memory"))
+    streaming = synchronize_recording(session["eeg_data_path"], session["et_data_path"],
+                                      output_dir=str(tmp_path / "streaming"), streaming=True)
+    assert (in_memory["eeg_trial_onset_timestamp"], in_memory["et_trial_onset_timestamp"]) == \
+        (streaming["eeg_trial_onset_timestamp"], streaming["et_trial_onset_timestamp"])
+    data_files = sorted(name for name in os.listdir(in_memory["output_dir"]) if name.endswith(".csv"))
+    assert data_files == sorted(name for name in os.listdir(streaming["output_dir"]) if name.endswith(".csv"))
+    _, mismatch, errors = filecmp.cmpfiles(in_memory["output_dir"], streaming["output_dir"], data_files, shallow=False)
+    assert not mismatch and not errors
+
+
+def test_sweep_matches_detectors(session, monkeypatch):
+    eeg_df = preprocess_eeg_data(session["eeg_data_path"])
+    et_df = preprocess_et_data(session["et_data_path"], lazy=True)
+    eeg_sweep = sweep_eeg_parameters(eeg_df, [20, 100, 1000], [0.2, 0.5, 1], [4, 12])
+    for row in eeg_sweep.itertuples():
+        epoch_jump = int(row.artifact_epoch_length * EEG_SAMPLE_RATE)
+        monkeypatch.setattr(eeg_et_hr_synchronizer, "ARTIFACT_DIFFERENCE_THRESHOLD", row.artifact_difference_threshold)
+        monkeypatch.setattr(eeg_et_hr_synchronizer, "EPOCH_JUMP", epoch_jump)
+        timestamps = get_eeg_artifact_timestamps_per_electrode(eeg_df, [ARTIFACT_ELECTRODE], row.eeg_beginning_time,
+                                                               epoch_jump)[ARTIFACT_ELECTRODE]
+        assert row.eeg_trial_onset_timestamp == get_trial_onset_timestamps(timestamps, row.eeg_beginning_time)
+        assert row.events_num == len(get_beginning_timestamps(timestamps, row.eeg_beginning_time * EEG_SAMPLE_RATE))
+    et_sweep = sweep_et_parameters(et_df, [0, 10, 200], [5, 20])
+    for row in et_sweep.itertuples():
+        monkeypatch.setattr(eeg_et_hr_synchronizer, "SHORT_BLINK_SAMPLES_NUM", row.short_blink_samples_num)
+        timestamps = get_closed_eyes_timestamps(et_df)
+        assert row.et_trial_onset_timestamp == get_trial_onset_timestamps(timestamps, row.et_beginning_time)
+        assert row.events_num == len(get_beginning_timestamps(timestamps, row.et_beginning_time * EEG_SAMPLE_RATE))